@@ -14,7 +14,7 @@ from atropos import align
 from atropos.align import Match
 from atropos.io.seqio import ColorspaceSequence, FastaReader
 from atropos.util import (
-    IUPAC_BASES, GC_BASES, MergingDict, NestedDict, CountingDict, Const, 
+    IUPAC_BASES, GC_BASES, MergingDict, CountingArray, CountingMatrix, Const,
     reverse_complement)
 from atropos.util import colorspace as cs
 
@@ -290,24 +290,34 @@ class Adapter(object):
             self._front_flag = None  # means: guess
         else:
             self._front_flag = where not in (BACK, SUFFIX)
-        # statistics about length of removed sequences
-        self.lengths_front = CountingDict()
-        self.lengths_back = CountingDict()
-        self.errors_front = NestedDict()
-        self.errors_back = NestedDict()
+        # statistics about length of removed sequences, and the number of
+        # errors by length; these grow to the read length as needed
+        nrows = len(self.sequence) + 1
+        ncols = int(max_error_rate * len(self.sequence)) + 1
+        self.lengths_front = CountingArray(nrows)
+        self.lengths_back = CountingArray(nrows)
+        self.errors_front = CountingMatrix(nrows, ncols)
+        self.errors_back = CountingMatrix(nrows, ncols)
         self.adjacent_bases = { 'A': 0, 'C': 0, 'G': 0, 'T': 0, '': 0 }
-        self.aligner = align.Aligner(
-            self.sequence, self.max_error_rate, flags=self.where,
-            wildcard_ref=self.adapter_wildcards,
-            wildcard_query=self.read_wildcards)
-        self.aligner.min_overlap = self.min_overlap
-        if self.indels:
-            self.aligner.indel_cost = indel_cost
+        self._ungapped = not self.indels and where in (BACK, FRONT, ANYWHERE)
+        if self._ungapped:
+            # When indels are disallowed, we only need to count mismatches at
+            # each offset rather than perform a full alignment.
+            self.aligner = align.UngappedAligner(
+                self.sequence, self.max_error_rate, flags=self.where,
+                wildcard_ref=self.adapter_wildcards,
+                wildcard_query=self.read_wildcards,
+                min_overlap=self.min_overlap)
         else:
-            # TODO
-            # When indels are disallowed, an entirely different algorithm
-            # should be used.
-            self.aligner.indel_cost = 100000
+            self.aligner = align.Aligner(
+                self.sequence, self.max_error_rate, flags=self.where,
+                wildcard_ref=self.adapter_wildcards,
+                wildcard_query=self.read_wildcards)
+            self.aligner.min_overlap = self.min_overlap
+            if self.indels:
+                self.aligner.indel_cost = indel_cost
+            else:
+                self.aligner.indel_cost = 100000
     
     def __repr__(self):
         return '<Adapter(name="{name}", sequence="{sequence}", where={where}, '\
@@ -323,11 +333,14 @@ class Adapter(object):
         self.debug = True
         self.aligner.enable_debug()
     
-    def match_to(self, read):
+    def match_to(self, read, try_exact=True):
         """Attempt to match this adapter to the given read.
         
         Args:
             read: A :class:`Sequence` instance.
+            try_exact: Whether to look for an exact match before trying
+                approximate matching. Set to False if it is already known that
+                the adapter does not occur exactly in the read.
         
         Returns:
             A :class:`Match` instance if a match was found; return None if no
@@ -338,7 +351,7 @@ class Adapter(object):
         
         # try to find an exact match first unless wildcards are allowed
         pos = -1
-        if not self.adapter_wildcards:
+        if try_exact and not self.adapter_wildcards:
             if self.where == PREFIX:
                 if read_seq.startswith(self.sequence):
                     pos = 0
@@ -349,10 +362,7 @@ class Adapter(object):
                 pos = read_seq.find(self.sequence)
         
         if pos >= 0:
-            seqlen = len(self.sequence)
-            return Match(
-                0, seqlen, pos, pos + seqlen, seqlen, 0, self._front_flag,
-                self, read)
+            return self.exact_match(read, pos)
         
         # try approximate matching
         alignment = None
@@ -368,7 +378,11 @@ class Adapter(object):
                     wildcard_ref=self.adapter_wildcards,
                     wildcard_query=self.read_wildcards)
         else:
-            alignment = self.aligner.locate(read_seq)
+            if self._ungapped:
+                # share the read's packed bases with the other adapters
+                alignment = self.aligner.locate(read_seq, read.packed)
+            else:
+                alignment = self.aligner.locate(read_seq)
             if self.debug:
                 print(self.aligner.dpmatrix)  # pragma: no cover
         
@@ -388,40 +402,55 @@ class Adapter(object):
         
         return None
     
-    def _trimmed_anywhere(self, match):
+    def exact_match(self, read, pos):
+        """Returns the :class:`Match` for an exact occurrence of this adapter
+        at position `pos` of `read`.
+        """
+        seqlen = len(self.sequence)
+        return Match(
+            0, seqlen, pos, pos + seqlen, seqlen, 0, self._front_flag, self,
+            read)
+    
+    def _trimmed_anywhere(self, match, count=1):
         """Trims an adapter from either the front or back of sequence.
         
+        Args:
+            match: The match to trim.
+            count: The number of reads the match stands for (i.e. the amount
+                by which to increment the statistics).
+        
         Returns:
             A :class:`Sequence` instance: the trimmed read.
         """
         if match.front:
-            return self._trimmed_front(match)
+            return self._trimmed_front(match, count)
         else:
-            return self._trimmed_back(match)
+            return self._trimmed_back(match, count)
     
-    def _trimmed_front(self, match):
+    def _trimmed_front(self, match, count=1):
         """Trims an adapter from the front of sequence.
         
         Returns:
             A :class:`Sequence` instance: the trimmed read.
         """
         # TODO move away
-        self.lengths_front[match.rstop] += 1
-        self.errors_front[match.rstop][match.errors] += 1
+        self.lengths_front.increment(match.rstop, count)
+        self.errors_front.increment(match.rstop, match.errors, count)
         return match.read[match.rstop:]
     
-    def _trimmed_back(self, match):
+    def _trimmed_back(self, match, count=1):
         """Trims an adapter from the back of sequence.
         
         Returns:
             A :class:`Sequence` instance: the trimmed read.
         """
-        self.lengths_back[len(match.read) - match.rstart] += 1
-        self.errors_back[len(match.read) - match.rstart][match.errors] += 1
+        length = len(match.read) - match.rstart
+        self.lengths_back.increment(length, count)
+        self.errors_back.increment(length, match.errors, count)
         adjacent_base = match.read.sequence[match.rstart-1:match.rstart]
         if adjacent_base not in 'ACGT':
             adjacent_base = ''
-        self.adjacent_bases[adjacent_base] += 1
+        self.adjacent_bases[adjacent_base] += count
         return match.read[:match.rstart]
     
     def __len__(self):
@@ -472,7 +501,7 @@ class Adapter(object):
             total_front=total_front,
             total_back=total_back,
             total=total_front + total_back,
-            match_probabilities=self.random_match_probabilities())
+            match_probabilities=Const(self.random_match_probabilities()))
         
         where = self.where
         assert (
@@ -516,11 +545,13 @@ class ColorspaceAdapter(Adapter):
                 "A 5' colorspace adapter needs to be given in nucleotide space")
         self.aligner.reference = self.sequence
     
-    def match_to(self, read):
+    def match_to(self, read, try_exact=True):
         """Attempt to match this adapter to the given read.
         
         Args:
             read: A :class:`Sequence` instance.
+            try_exact: Whether to look for an exact match before trying
+                approximate matching.
         
         Returns:
             A :class:`Match` instance if a match was found; return None if no
@@ -528,7 +559,7 @@ class ColorspaceAdapter(Adapter):
             maximum error rate).
         """
         if self.where != PREFIX:
-            return super(ColorspaceAdapter, self).match_to(read)
+            return super(ColorspaceAdapter, self).match_to(read, try_exact)
         # create artificial adapter that includes a first color that encodes the
         # transition from primer base into adapter
         asequence = (
@@ -559,15 +590,15 @@ class ColorspaceAdapter(Adapter):
         assert match.length >= self.min_overlap
         return match
 
-    def _trimmed_front(self, match):
+    def _trimmed_front(self, match, count=1):
         """Trims an adapter from the front of sequence.
         
         Returns:
             A :class:`Sequence` instance: the trimmed read.
         """
         read = match.read
-        self.lengths_front[match.rstop] += 1
-        self.errors_front[match.rstop][match.errors] += 1
+        self.lengths_front.increment(match.rstop, count)
+        self.errors_front.increment(match.rstop, match.errors, count)
         # to remove a front adapter, we need to re-encode the first color
         # following the adapter match
         color_after_adapter = read.sequence[match.rstop:match.rstop + 1]
@@ -584,7 +615,7 @@ class ColorspaceAdapter(Adapter):
             new_read.qualities = read.qualities[match.rstop:]
         return new_read
 
-    def _trimmed_back(self, match):
+    def _trimmed_back(self, match, count=1):
         """Trims an adapter from the back of sequence.
         
         Returns:
@@ -592,8 +623,9 @@ class ColorspaceAdapter(Adapter):
         """
         # trim one more color if long enough
         adjusted_rstart = max(match.rstart - 1, 0)
-        self.lengths_back[len(match.read) - adjusted_rstart] += 1
-        self.errors_back[len(match.read) - adjusted_rstart][match.errors] += 1
+        length = len(match.read) - adjusted_rstart
+        self.lengths_back.increment(length, count)
+        self.errors_back.increment(length, match.errors, count)
         return match.read[:adjusted_rstart]
 
     def __repr__(self):
@@ -679,19 +711,20 @@ class LinkedAdapter(object):
         back_match = self.back_adapter.match_to(read)
         return LinkedMatch(front_match, back_match, self)
 
-    def trimmed(self, match):
+    def trimmed(self, match, count=1):
         """Returns the read trimmed with the front and/or back adapter
         trimmer(s).
         
         Args:
             match: The match to trim.
+            count: The number of reads the match stands for.
         
         Returns:
             The trimmed read.
         """
-        front_trimmed = self.front_adapter.trimmed(match.front_match)
+        front_trimmed = self.front_adapter.trimmed(match.front_match, count)
         if match.back_match:
-            return self.back_adapter.trimmed(match.back_match)
+            return self.back_adapter.trimmed(match.back_match, count)
         else:
             return front_trimmed
     
@@ -734,6 +767,146 @@ class LinkedAdapter(object):
         
         return stats
 
+class BarcodeIndex(object):
+    """Index for matching fixed-position barcodes (PREFIX or SUFFIX adapters
+    of equal length that are matched without indels or wildcards) by a single
+    dict lookup. Every sequence within the maximum number of errors (i.e.
+    Hamming distance) of a barcode is precomputed, along with the best
+    matching barcode: the one with the fewest errors, or the first one given in
+    the case of a tie, which is the barcode that :class:`Adapter` matching
+    would choose.
+    
+    Sequences that are within range of more than one barcode are collisions.
+    They are counted and reported, since reads with such barcodes cannot be
+    assigned unambiguously.
+    
+    Args:
+        adapters: List of :class:`Adapter`s; must satisfy :meth:`supports`.
+    """
+    ALPHABET = frozenset('ACGTN')
+    # Maximum number of entries in the neighbor table
+    MAX_SIZE = 2 ** 21
+    
+    def __init__(self, adapters):
+        self.adapters = adapters
+        self.where = adapters[0].where
+        self.length = len(adapters[0])
+        self.table = {}
+        collisions = set()
+        for index, adapter in enumerate(adapters):
+            for seq, errors in _hamming_neighbors(
+                    adapter.sequence, _max_errors(adapter)):
+                if seq in self.table:
+                    other_index, other_errors = self.table[seq]
+                    if adapters[other_index].sequence != adapter.sequence:
+                        collisions.add(seq)
+                    if other_errors <= errors:
+                        continue
+                self.table[seq] = (index, errors)
+        self.collisions = len(collisions)
+        if self.collisions:
+            logging.getLogger().warning(
+                "%d sequences are within the maximum error rate of more than "
+                "one barcode; reads with these sequences are assigned to the "
+                "closest (or first) matching barcode.", self.collisions)
+    
+    @staticmethod
+    def supports(adapters):
+        """Whether a BarcodeIndex can be used to match `adapters`.
+        """
+        if len(adapters) < 2:
+            return False
+        where = adapters[0].where
+        length = len(adapters[0])
+        size = 0
+        for adapter in adapters:
+            if not (
+                    type(adapter) is Adapter and
+                    adapter.where == where and
+                    where in (PREFIX, SUFFIX) and
+                    len(adapter) == length and
+                    not adapter.indels and
+                    not adapter.adapter_wildcards and
+                    not adapter.read_wildcards and
+                    set(adapter.sequence) <= BarcodeIndex.ALPHABET):
+                return False
+            errors = _max_errors(adapter)
+            size += sum(
+                _binomial(length, k) * 4 ** k for k in range(errors + 1))
+        return size <= BarcodeIndex.MAX_SIZE
+    
+    def covers(self, read_seq):
+        """Whether the result of matching `read_seq` (which must be uppercase)
+        is determined by the index.
+        """
+        return (
+            len(read_seq) >= self.length and
+            set(self._key(read_seq)) <= BarcodeIndex.ALPHABET)
+    
+    def _key(self, read_seq):
+        if self.where == PREFIX:
+            return read_seq[:self.length]
+        else:
+            return read_seq[len(read_seq) - self.length:]
+    
+    def match_to(self, read, read_seq):
+        """Find the best matching barcode in a read for which
+        `covers(read_seq)` is True.
+        
+        Args:
+            read: A :class:`Sequence` instance.
+            read_seq: The uppercase read sequence.
+        
+        Returns:
+            A :class:`Match` instance, or None if no barcode matches.
+        """
+        hit = self.table.get(self._key(read_seq))
+        if hit is None:
+            return None
+        index, errors = hit
+        adapter = self.adapters[index]
+        rstart = 0 if self.where == PREFIX else len(read_seq) - self.length
+        return Match(
+            0, self.length, rstart, rstart + self.length,
+            self.length - errors, errors, adapter._front_flag, adapter, read)
+
+def _max_errors(adapter):
+    """Returns the maximum number of errors allowed in a full-length match of
+    `adapter`, given its maximum error rate and random match probability.
+    """
+    length = len(adapter)
+    errors = 0
+    while errors < length:
+        matches = length - errors - 1
+        if (errors + 1) / length > adapter.max_error_rate or (
+                adapter.max_rmp is not None and
+                adapter.match_probability(matches, length) > adapter.max_rmp):
+            break
+        errors += 1
+    return errors
+
+def _hamming_neighbors(seq, max_errors):
+    """Generates all (sequence, errors) for sequences over the alphabet ACGTN
+    that differ from `seq` at up to `max_errors` positions.
+    """
+    yield seq, 0
+    for errors in range(1, max_errors + 1):
+        for positions in itertools.combinations(range(len(seq)), errors):
+            choices = [
+                [base for base in 'ACGTN' if base != seq[pos]]
+                for pos in positions]
+            for bases in itertools.product(*choices):
+                neighbor = list(seq)
+                for pos, base in zip(positions, bases):
+                    neighbor[pos] = base
+                yield ''.join(neighbor), errors
+
+def _binomial(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
 class AdapterCache(object):
     """Cache for known adapters.
     
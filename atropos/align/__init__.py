@@ -2,9 +2,10 @@
 """
 Alignment module.
 """
-from collections import namedtuple
-from atropos.align._align import Aligner, MultiAligner, compare_prefixes, locate
-from atropos.util import RandomMatchProbability, reverse_complement
+from atropos.align._align import (
+    AhoCorasick, Aligner, MultiAligner, UngappedAligner, InsertMatcher, Match,
+    MatchInfo, PackedSequence, compare_prefixes, correct_mismatches, locate)
+from atropos.util import RandomMatchProbability
 
 # flags for global alignment
 
@@ -43,146 +44,15 @@ def compare_suffixes(
         len(suffix_ref) - length, len(suffix_ref), len(suffix_query) - length,
         len(suffix_query), matches, errors)
 
-# Common match-result object returned by aligners
-
-# TODO creating instances of this class is relatively slow and responsible for
-# quite some runtime.
-
-class Match(object):
-    """An alignment match.
-    
-    Args:
-        astart: Starting position of the match within the adapter.
-        astop: Ending position of the match within the adapter.
-        rstart: Starting position of the match within the read.
-        rstop: Ending position of the match within the read.
-        matches: Number of matching bases.
-        errors: Number of mismatching bases.
-        front: Whether the match is to the front of the read.
-        adapter: The :class:`Adapter`.
-        read: The :class:`Sequence`.
-        length: The length of the match.
-    """
-    __slots__ = [
-        'astart', 'astop', 'rstart', 'rstop', 'matches', 'errors', 'front',
-        'adapter', 'read', 'length']
-    
-    def __init__(
-            self, astart, astop, rstart, rstop, matches, errors,
-            front=None, adapter=None, read=None):
-        self.astart = astart
-        self.astop = astop
-        self.rstart = rstart
-        self.rstop = rstop
-        self.matches = matches
-        self.errors = errors
-        self.front = self._guess_is_front() if front is None else front
-        self.adapter = adapter
-        self.read = read
-        # Number of aligned characters in the adapter. If there are indels,
-        # this may be different from the number of characters in the read.
-        self.length = self.astop - self.astart
-        assert self.length > 0
-        assert self.length - self.errors > 0
-        # TODO: this assertion may not always hold now that we use both error
-        # rates and probabilities
-        #if self.adapter:
-        #    assert self.errors / self.length <= self.adapter.max_error_rate
-
-    def __str__(self):
-        return (
-            'Match(astart={0}, astop={1}, rstart={2}, rstop={3}, matches={4}, '
-            'errors={5})').format(
-                self.astart, self.astop, self.rstart, self.rstop, self.matches,
-                self.errors)
-    
-    def copy(self):
-        """Create a copy of this Match.
-        """
-        return Match(
-            self.astart, self.astop, self.rstart, self.rstop, self.matches,
-            self.errors, self.front, self.adapter, self.read)
-    
-    def _guess_is_front(self):
-        """Return whether this is guessed to be a front adapter.
-        
-        The match is assumed to be a front adapter when the first base of
-        the read is involved in the alignment to the adapter.
-        """
-        return self.rstart == 0
-    
-    def wildcards(self, wildcard_char='N'):
-        """Return a string that contains, for each wildcard character,
-        the character that it matches. For example, if the adapter
-        ATNGNA matches ATCGTA, then the string 'CT' is returned.
-
-        If there are indels, this is not reliable as the full alignment
-        is not available.
-        """
-        wildcards = [
-            self.read.sequence[self.rstart + i]
-            for i in range(self.length)
-            if (self.adapter.sequence[self.astart + i] == wildcard_char and
-                self.rstart + i < len(self.read.sequence))
-        ]
-        return ''.join(wildcards)
-
-    def rest(self):
-        """Returns the part of the read before this match if this is a
-        'front' (5') adapter, or the part after the match if this is not
-        a 'front' adapter (3'). This can be an empty string.
-        """
-        if self.front:
-            return self.read.sequence[:self.rstart]
-        else:
-            return self.read.sequence[self.rstop:]
-    
-    # TODO: write test
-    def get_info_record(self):
-        """Returns a :class:`MatchInfo`, which contains information about the
-        match to write into the info file.
-        """
-        seq = self.read.sequence
-        qualities = self.read.qualities
-        if qualities is None:
-            qualities = ''
-        rsize = rsize_total = self.rstop - self.rstart
-        if self.front and self.rstart > 0:
-            rsize_total = self.rstop
-        elif not self.front and self.rstop < len(seq):
-            rsize_total = len(seq) - self.rstart
-        return MatchInfo(
-            self.read.name,
-            self.errors,
-            self.rstart,
-            self.rstop,
-            seq[0:self.rstart],
-            seq[self.rstart:self.rstop],
-            seq[self.rstop:],
-            self.adapter.name,
-            qualities[0:self.rstart],
-            qualities[self.rstart:self.rstop],
-            qualities[self.rstop:],
-            self.front,
-            self.astop - self.astart,
-            rsize, rsize_total)
-
-MatchInfo = namedtuple("MatchInfo", (
-    "read_name", "errors", "rstart", "rstop", "seq_before", "seq_adapter",
-    "seq_after", "adapter_name", "qual_before", "qual_adapter", "qual_after",
-    "is_front", "asize", "rsize_adapter", "rsize_total"))
-
 # Alternative semi-global alignment (
 # http://www.bioinf.uni-freiburg.de/Lehre/Courses/2013_SS/V_Bioinformatik_1/lecture4.pdf)
 # strategies designed to improve insert matching of paired-end reads.
 #
-# Note: these are currently just prototype implementations. They will need to be optimized
-# using numpy and/or re-written in cython.
-#
 # 1. SeqPurge algorithm: insert match algorithm that performs thresholded exhaustive
 #    comparison to minimize probability of incorrect alignment. Relies on the fact that
 #    overlapping reads share alleles and indels (i.e. no gaps are required) (in C++).
 #    https://github.com/imgag/ngs-bits/tree/master/src/SeqPurge.
+#    This is what InsertAligner currently implements (see InsertMatcher in _align.pyx).
 #   * Speed up sequence comparison:
 #     * Between adapters and overhangs:
 #       * http://www.ncbi.nlm.nih.gov/pmc/articles/PMC4080745/pdf/btu177.pdf
@@ -253,129 +123,44 @@ class InsertAligner(object):
         self.adapter_check_cutoff = adapter_check_cutoff
         self.base_probs = base_probs or dict(
             match_prob=0.25, mismatch_prob=0.75)
-        self.aligner = MultiAligner(
-            max_insert_mismatch_frac,
-            START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2,
-            min_insert_overlap)
+        self.matcher = InsertMatcher(
+            adapter1, adapter2, match_probability,
+            insert_max_rmp=insert_max_rmp, adapter_max_rmp=adapter_max_rmp,
+            min_insert_overlap=min_insert_overlap,
+            max_insert_mismatch_frac=self.max_insert_mismatch_frac,
+            min_adapter_overlap=min_adapter_overlap,
+            max_adapter_mismatch_frac=self.max_adapter_mismatch_frac,
+            adapter_check_cutoff=adapter_check_cutoff,
+            base_probs=self.base_probs)
     
-    def match_insert(self, seq1, seq2):
+    def match_insert(self, seq1, seq2, packed1=None, packed2=None):
         """Use cutadapt aligner for insert and adapter matching.
         
         Args:
             seq1, seq2: Sequences to match.
+            packed1, packed2: The sequences as :class:`PackedSequence`s, e.g.
+                :attr:`Sequence.packed`, or None to pack them here.
         
         Returns:
-            A :class:`Match` object, or None if there is no match.
+            A tuple (insert_match, adapter_match1, adapter_match2), where
+            insert_match is a tuple as returned by :method:`Aligner.locate`
+            and the adapter matches are :class:`Match` objects (or None if the
+            overhangs are too short to check for adapters), or None if there
+            is no insert match.
         """
-        len1 = len(seq1)
-        len2 = len(seq2)
-        seq_len = min(len1, len2)
-        if len1 > len2:
-            seq1 = seq1[:len2]
-        elif len2 > len1:
-            seq2 = seq1[:len1]
-
-        seq2_rc = reverse_complement(seq2)
-        
-        def _match(insert_match, offset, insert_match_size, prob): # pylint disable=unused-argument
-            if offset < self.min_adapter_overlap:
-                # The reads are mostly overlapping, to the point where
-                # there's not enough overhang to do a confident adapter
-                # match. We return just the insert match to signal that
-                # error correction can be done even though no adapter
-                # trimming is required.
-                return (insert_match, None, None)
-            
-            # TODO: this is very sensitive to the exact correct choice of
-            # adapter. For example, if you specifiy GATCGGAA... and the correct
-            # adapter is AGATCGGAA..., the prefixes will not match exactly and
-            # the alignment will fail. We need to use a comparison that is a bit
-            # more forgiving.
-            
-            a1_match = compare_prefixes(seq1[insert_match_size:], self.adapter1)
-            a2_match = compare_prefixes(seq2[insert_match_size:], self.adapter2)
-            adapter_len = min(offset, self.adapter1_len, self.adapter2_len)
-            max_adapter_mismatches = round(
-                adapter_len * self.max_adapter_mismatch_frac)
-            if (
-                    a1_match[5] > max_adapter_mismatches and
-                    a2_match[5] > max_adapter_mismatches):
-                return None
-            
-            a1_prob = self.match_probability(a1_match[4], adapter_len)
-            a2_prob = self.match_probability(a2_match[4], adapter_len)
-            if (
-                    (adapter_len > self.adapter_check_cutoff) and
-                    ((a1_prob * a2_prob) > self.adapter_max_rmp)):
-                return None
-
-            adapter_len1 = min(self.adapter1_len, len1 - insert_match_size)
-            adapter_len2 = min(self.adapter2_len, len2 - insert_match_size)
-            best_adapter_matches, best_adapter_mismatches = (
-                a1_match if a1_prob < a2_prob else a2_match)[4:6]
-            
-            return (
-                insert_match,
-                Match(
-                    0, adapter_len1, insert_match_size, len1,
-                    best_adapter_matches, best_adapter_mismatches),
-                Match(
-                    0, adapter_len2, insert_match_size, len2,
-                    best_adapter_matches, best_adapter_mismatches))
-        
-        # # This is the old way of doing things, where we use the built-in
-        # # Aligner to do a single match.
-        # aligner = Aligner(
-        #     seq2_rc,
-        #     self.max_insert_mismatch_frac,
-        #     START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2,
-        #     False, False)
-        # aligner.min_overlap = self.min_insert_overlap
-        # aligner.indel_cost = 100000
-        #
-        # insert_match = aligner.locate(seq1)
-        #
-        # if not insert_match:
-        #     return None
-        #
-        # offset = min(insert_match[0], seq_len - insert_match[3])
-        # insert_match_size = seq_len - offset
-        # prob = self.match_probability(insert_match[4], insert_match_size)
-        #
-        # if prob > self.insert_max_rmp:
-        #     return None
-        #
-        # return _match(insert_match, offset, insert_match_size, prob)
-        
-        # Use an aligner that returns all matches that satisfy the
-        # overlap and error rate thresholds. We sort by matches and
-        # then mismatches, and then check each in turn until we find
-        # one with an adapter match (if any).
-        
-        insert_matches = self.aligner.locate(seq2_rc, seq1)
-        
-        if insert_matches:
-            # Filter by random-match probability
-            filtered_matches = []
-            for insert_match in insert_matches:
-                offset = min(insert_match[0], seq_len - insert_match[3])
-                insert_match_size = seq_len - offset
-                prob = self.match_probability(insert_match[4], insert_match_size, **self.base_probs)
-                if prob <= self.insert_max_rmp:
-                    filtered_matches.append((insert_match, offset, insert_match_size, prob))
-            
-            if filtered_matches:
-                if len(filtered_matches) == 1:
-                    return _match(*filtered_matches[0])
-                else:
-                    # Test matches in order of random-match probability.
-                    # TODO: compare against sorting by length (which is how
-                    # SeqPurge essentially does it).
-                    #filtered_matches.sort(key=lambda x: x[2], reverse=True)
-                    filtered_matches.sort(key=lambda x: x[3])
-                    for match_args in filtered_matches:
-                        match = _match(*match_args)
-                        if match:
-                            return match
-            
+        match = self.matcher.match_insert(seq1, seq2, packed1, packed2)
+        if match is None:
             return None
+        insert_match, adapter_match = match
+        if adapter_match is None:
+            return (insert_match, None, None)
+        insert_match_size, adapter_len1, adapter_len2, matches, errors = \
+            adapter_match
+        return (
+            insert_match,
+            Match(
+                0, adapter_len1, insert_match_size, len(seq1), matches,
+                errors),
+            Match(
+                0, adapter_len2, insert_match_size, len(seq2), matches,
+                errors))
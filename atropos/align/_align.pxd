@@ -0,0 +1,19 @@
+# kate: syntax Python;
+"""
+Declarations shared with other Cython modules: the 2-bit packed sequence is
+also used for k-mer counting (atropos.commands.detect._kmers).
+"""
+from libc.stdint cimport uint64_t
+
+cdef class PackedSequence:
+    cdef uint64_t* bases
+    cdef uint64_t* mask
+    cdef int capacity
+    cdef readonly int length
+    cdef readonly int ambiguous
+
+    cdef int _allocate(self, int length) except -1
+    cdef int _pack(self, const unsigned char* s, int length) except -1
+    cdef int _reverse_complement(self, PackedSequence rc) except -1
+    cdef int _code_at(self, int i)
+    cdef bint _masked_at(self, int i)
@@ -4,10 +4,13 @@
 # in most implementations of NW alignment (http://biorxiv.org/content/biorxiv/early/2015/11/12/031500.full.pdf).
 # They provide a correct implementation (qalign: http://www.exelixis-lab.org/web/software/alignment/).
 
+from collections import deque, namedtuple
 from cpython.mem cimport PyMem_Malloc, PyMem_Free, PyMem_Realloc
 from cpython.array cimport array, clone
+from libc.stdint cimport uint64_t
+from libc.string cimport memcpy, memset
 cdef array ld_array = array('d', [])
-from libc.math cimport ceil
+from libc.math cimport ceil, rint
 
 DEF START_WITHIN_SEQ1 = 1
 DEF START_WITHIN_SEQ2 = 2
@@ -179,9 +182,14 @@ cdef class Aligner:
     If neither flag is set, the full ASCII alphabet is used for comparison.
     If any of the flags is set, all non-IUPAC characters in the sequences
     compare as 'not equal'.
+
+    An Aligner can be reused for other references by assigning to its
+    reference attribute; the DP column is only reallocated when it needs to
+    grow.
     """
     cdef int m
     cdef _Entry* column  # one column of the DP matrix
+    cdef int _num_cols
     cdef double max_error_rate
     cdef int flags
     cdef int _insertion_cost
@@ -232,10 +240,12 @@ cdef class Aligner:
             return self._reference
 
         def __set__(self, str reference):
-            mem = <_Entry*> PyMem_Realloc(self.column, (len(reference) + 1) * sizeof(_Entry))
-            if not mem:
-                raise MemoryError()
-            self.column = mem
+            if self.column == NULL or len(reference) > self._num_cols:
+                mem = <_Entry*> PyMem_Realloc(self.column, (len(reference) + 1) * sizeof(_Entry))
+                if not mem:
+                    raise MemoryError()
+                self.column = mem
+                self._num_cols = len(reference)
             self._reference = reference.encode('ascii')
             self.m = len(reference)
             if self.wildcard_ref:
@@ -539,6 +549,258 @@ def compare_prefixes(str ref, str query, bint wildcard_ref=False, bint wildcard_
     # length - matches = no. of errors
     return (0, length, 0, length, matches, length - matches)
 
+# Word-packed byte comparison: the number of zero bytes in an 8-byte word can
+# be computed without branching, which lets us count 8 (mis)matches at a time.
+
+cdef uint64_t LOW7 = 0x7F7F7F7F7F7F7F7FULL
+cdef uint64_t ONES = 0x0101010101010101ULL
+
+cdef inline int _count_zero_bytes(uint64_t x) nogil:
+    cdef uint64_t y = (x & LOW7) + LOW7
+    y = ~(y | x | LOW7)
+    # Only the high bit of each zero byte is now set; sum them up.
+    return <int>((((y >> 7) * ONES) >> 56) & 0xFF)
+
+cdef inline int _count_mismatches(
+        const char* s1, const char* s2, int length, int max_errors,
+        bint compare_ascii) nogil:
+    """
+    Count mismatches between s1[0:length] and s2[0:length]. Returns early
+    (with a value > max_errors) as soon as the error budget is exceeded.
+    """
+    cdef int i = 0
+    cdef int errors = 0
+    cdef uint64_t w1, w2
+    while i + 8 <= length:
+        memcpy(&w1, s1 + i, 8)
+        memcpy(&w2, s2 + i, 8)
+        if compare_ascii:
+            errors += 8 - _count_zero_bytes(w1 ^ w2)
+        else:
+            errors += _count_zero_bytes(w1 & w2)
+        if errors > max_errors:
+            return errors
+        i += 8
+    while i < length:
+        if compare_ascii:
+            if s1[i] != s2[i]:
+                errors += 1
+        elif (s1[i] & s2[i]) == 0:
+            errors += 1
+        if errors > max_errors:
+            return errors
+        i += 1
+    return errors
+
+cdef class UngappedAligner:
+    """
+    Drop-in replacement for Aligner when indels are not allowed. Rather than
+    computing the DP matrix, the reference is slid across the query and
+    mismatches are counted at each offset (i.e. this computes Hamming distances
+    between the overlapping parts), abandoning an offset as soon as it cannot
+    beat the best match found so far. When wildcards are disabled and both
+    sequences consist only of A, C, G and T, they are compared as
+    PackedSequences, 32 bases at a time; otherwise eight characters are
+    compared at a time. The caller can pass the packed query (e.g.
+    Sequence.packed) so that a read is packed once for all adapters.
+
+    Only flag combinations that allow skipping a prefix and a suffix of the
+    query (i.e. BACK, FRONT and ANYWHERE adapters) are supported. Candidate
+    alignments are enumerated in the same order that Aligner discovers them, so
+    the result is identical to that of Aligner with a prohibitive indel cost.
+    """
+    cdef int m
+    cdef double max_error_rate
+    cdef int flags
+    cdef int _min_overlap
+    cdef bint wildcard_ref
+    cdef bint wildcard_query
+    cdef bytes _reference
+    cdef str str_reference
+    cdef PackedSequence packed_reference
+    cdef PackedSequence packed_query
+
+    def __cinit__(self, str reference, double max_error_rate, int flags=SEMIGLOBAL, bint wildcard_ref=False,
+                  bint wildcard_query=False, int min_overlap=1):
+        if not (flags & START_WITHIN_SEQ2 and flags & STOP_WITHIN_SEQ2):
+            raise ValueError(
+                'UngappedAligner requires START_WITHIN_SEQ2 and STOP_WITHIN_SEQ2')
+        self.max_error_rate = max_error_rate
+        self.flags = flags
+        self.wildcard_ref = wildcard_ref
+        self.wildcard_query = wildcard_query
+        self.packed_query = PackedSequence()
+        self.reference = reference
+        self.min_overlap = min_overlap
+
+    property min_overlap:
+        def __get__(self):
+            return self._min_overlap
+
+        def __set__(self, int value):
+            if value < 1:
+                raise ValueError('Minimum overlap must be at least 1')
+            self._min_overlap = value
+
+    property reference:
+        def __get__(self):
+            return self._reference
+
+        def __set__(self, str reference):
+            self._reference = reference.encode('ascii')
+            self.m = len(reference)
+            if self.wildcard_ref:
+                self._reference = self._reference.translate(IUPAC_TABLE)
+            elif self.wildcard_query:
+                self._reference = self._reference.translate(ACGT_TABLE)
+            self.str_reference = reference
+            self.packed_reference = None
+            if not (self.wildcard_ref or self.wildcard_query):
+                self.packed_reference = PackedSequence(reference)
+                if self.packed_reference.ambiguous:
+                    self.packed_reference = None
+
+    property dpmatrix:
+        """
+        Always None; there is no DP matrix.
+        """
+        def __get__(self):
+            return None
+
+    def enable_debug(self):
+        """
+        No-op; provided for compatibility with Aligner.
+        """
+        pass
+
+    def locate(self, str query, PackedSequence packed_query=None):
+        """
+        locate(query, packed_query=None) -> (refstart, refstop, querystart, querystop, matches, errors)
+
+        Find the query within the reference associated with this aligner. See
+        Aligner.locate. packed_query is the query as a PackedSequence; if it
+        is None, the query is packed into a buffer owned by the aligner.
+        """
+        cdef char* s1 = self._reference
+        cdef bytes query_bytes = query.encode('ascii')
+        cdef char* s2
+        cdef int m = self.m
+        cdef int n = len(query)
+        cdef double max_error_rate = self.max_error_rate
+        cdef int min_overlap = self._min_overlap
+        cdef bint start_in_ref = self.flags & START_WITHIN_SEQ1
+        cdef bint stop_in_ref = self.flags & STOP_WITHIN_SEQ1
+
+        if self.wildcard_query:
+            query_bytes = query_bytes.translate(IUPAC_TABLE)
+        elif self.wildcard_ref:
+            query_bytes = query_bytes.translate(ACGT_TABLE)
+        s2 = query_bytes
+        cdef bint compare_ascii = not (self.wildcard_query or self.wildcard_ref)
+        cdef bint compare_packed = False
+        cdef const uint64_t* b1 = NULL
+        cdef const uint64_t* b2 = NULL
+        if self.packed_reference is not None:
+            if packed_query is None:
+                packed_query = self.packed_query
+                packed_query._pack(<const unsigned char*>s2, n)
+            elif packed_query.length != n:
+                raise ValueError('packed_query is not the same length as query')
+            if not packed_query.ambiguous:
+                compare_packed = True
+                b1 = self.packed_reference.bases
+                b2 = packed_query.bases
+
+        cdef int best_matches = -1
+        cdef int best_cost = m + n
+        cdef int best_rstart = 0, best_rstop = 0, best_qstart = 0, best_qstop = 0
+        cdef int i, j, rstart, qstart, length, max_errors, errors, matches
+
+        with nogil:
+            # Alignments that include the end of the reference, in order of
+            # their end position within the query. If the start of the
+            # reference may be skipped, the first m-1 of these are overhangs
+            # at the start of the query.
+            j = 1 if start_in_ref else m
+            while j <= n:
+                if j < m:
+                    rstart = m - j
+                    qstart = 0
+                    length = j
+                else:
+                    rstart = 0
+                    qstart = j - m
+                    length = m
+                j += 1
+                if length < min_overlap or length < best_matches:
+                    continue
+                max_errors = <int>(length * max_error_rate)
+                if length - best_matches < max_errors:
+                    max_errors = length - best_matches
+                if compare_packed:
+                    errors = _packed_mismatches(
+                        b1, NULL, rstart, b2, NULL, qstart, length, max_errors,
+                        False)
+                else:
+                    errors = _count_mismatches(
+                        s1 + rstart, s2 + qstart, length, max_errors,
+                        compare_ascii)
+                if errors > max_errors:
+                    continue
+                matches = length - errors
+                if matches > best_matches or (matches == best_matches and errors < best_cost):
+                    best_matches = matches
+                    best_cost = errors
+                    best_rstart = rstart
+                    best_rstop = m
+                    best_qstart = qstart
+                    best_qstop = j - 1
+                    if errors == 0 and matches == m:
+                        # exact match, stop early
+                        break
+
+            # Alignments that include the end of the query, in order of the
+            # reference position aligned to the last query base.
+            if stop_in_ref and best_matches < m:
+                for i in range(1, m):
+                    if i <= n:
+                        rstart = 0
+                        qstart = n - i
+                        length = i
+                    elif start_in_ref:
+                        rstart = i - n
+                        qstart = 0
+                        length = n
+                    else:
+                        break
+                    if length < min_overlap or length < best_matches:
+                        continue
+                    max_errors = <int>(length * max_error_rate)
+                    if length - best_matches < max_errors:
+                        max_errors = length - best_matches
+                    if compare_packed:
+                        errors = _packed_mismatches(
+                            b1, NULL, rstart, b2, NULL, qstart, length,
+                            max_errors, False)
+                    else:
+                        errors = _count_mismatches(
+                            s1 + rstart, s2 + qstart, length, max_errors,
+                            compare_ascii)
+                    if errors > max_errors:
+                        continue
+                    matches = length - errors
+                    if matches > best_matches or (matches == best_matches and errors < best_cost):
+                        best_matches = matches
+                        best_cost = errors
+                        best_rstart = rstart
+                        best_rstop = i
+                        best_qstart = qstart
+                        best_qstop = n
+
+        if best_matches < 0:
+            return None
+        return (best_rstart, best_rstop, best_qstart, best_qstop, best_matches, best_cost)
+
 DEF OVERHANG_MULTIPLIER = 100000
 
 cdef class MultiAligner:
@@ -774,3 +1036,1046 @@ cdef class MultiAligner:
     def __dealloc__(self):
         PyMem_Free(self.column)
         PyMem_Free(self.match_array)
+
+def _complement_table():
+    """
+    Return a translation table that maps each IUPAC character to its
+    complement (preserving case). Other characters are mapped to themselves.
+    """
+    from atropos.util import BASE_COMPLEMENTS
+    t = bytearray(range(256))
+    for c, v in BASE_COMPLEMENTS.items():
+        t[ord(c)] = ord(v)
+    return bytes(t)
+
+cdef bytes COMPLEMENT_TABLE = _complement_table()
+
+# structure for a candidate/result of insert matching
+ctypedef struct _InsertMatch:
+    int size             # number of overlapping bases
+    int matches
+    int errors
+    double prob          # random match probability of the overlap
+    bint has_adapter     # whether the overhangs matched the adapters
+    int adapter_len1
+    int adapter_len2
+    int adapter_matches
+    int adapter_errors
+
+DEF MAX_INSERT_CANDIDATES = 100
+
+cdef class InsertMatcher:
+    """
+    Implementation of the insert matching procedure used by InsertAligner.
+
+    Read 2 is reverse-complemented and slid along read 1 without gaps, in
+    order of increasing overlap (as in SeqPurge). Every overlap whose error
+    rate is at most max_insert_mismatch_frac (up to a total of 100) is a
+    candidate; candidates whose random match probability exceeds
+    insert_max_rmp are discarded and the rest are tested in order of
+    increasing probability until one is found whose overhangs match the
+    adapters. Random match probabilities are memoized in lookup tables indexed
+    by (size, matches). When the reads and adapters consist only of A, C, G
+    and T, they are compared as PackedSequences.
+
+    match_insert() returns a tuple (insert_match, adapter_match), where
+    insert_match has the same format as the tuple returned by Aligner.locate
+    (read 2 reverse-complement is the reference and read 1 is the query), and
+    adapter_match is either None (if the overhangs are too short to match the
+    adapters) or a tuple (insert_size, adapter_len1, adapter_len2, matches,
+    errors).
+    """
+    cdef bytes adapter1
+    cdef bytes adapter2
+    cdef PackedSequence packed_adapter1
+    cdef PackedSequence packed_adapter2
+    cdef PackedSequence packed1
+    cdef PackedSequence packed2
+    cdef PackedSequence packed_rc
+    cdef int adapter1_len
+    cdef int adapter2_len
+    cdef object match_probability
+    cdef dict base_probs
+    cdef double insert_max_rmp
+    cdef double adapter_max_rmp
+    cdef int min_insert_overlap
+    cdef double max_insert_mismatch_frac
+    cdef int min_adapter_overlap
+    cdef double max_adapter_mismatch_frac
+    cdef int adapter_check_cutoff
+    cdef double* insert_probs
+    cdef double* adapter_probs
+    cdef int max_prob_size
+    cdef char* rc_buffer
+    cdef int rc_buffer_size
+    cdef _InsertMatch candidates[MAX_INSERT_CANDIDATES]
+
+    def __cinit__(
+            self, str adapter1, str adapter2, match_probability,
+            double insert_max_rmp=1E-6, double adapter_max_rmp=0.001,
+            int min_insert_overlap=1, double max_insert_mismatch_frac=0.2,
+            int min_adapter_overlap=1, double max_adapter_mismatch_frac=0.2,
+            int adapter_check_cutoff=9, dict base_probs=None):
+        self.adapter1 = adapter1.encode('ascii')
+        self.adapter1_len = len(adapter1)
+        self.adapter2 = adapter2.encode('ascii')
+        self.adapter2_len = len(adapter2)
+        self.packed_adapter1 = PackedSequence(adapter1)
+        self.packed_adapter2 = PackedSequence(adapter2)
+        self.packed1 = PackedSequence()
+        self.packed2 = PackedSequence()
+        self.packed_rc = PackedSequence()
+        self.match_probability = match_probability
+        self.base_probs = base_probs or dict(
+            match_prob=0.25, mismatch_prob=0.75)
+        self.insert_max_rmp = insert_max_rmp
+        self.adapter_max_rmp = adapter_max_rmp
+        self.min_insert_overlap = max(min_insert_overlap, 1)
+        self.max_insert_mismatch_frac = max_insert_mismatch_frac
+        self.min_adapter_overlap = min_adapter_overlap
+        self.max_adapter_mismatch_frac = max_adapter_mismatch_frac
+        self.adapter_check_cutoff = adapter_check_cutoff
+        self.max_prob_size = -1
+        self.rc_buffer_size = 0
+
+    cdef int _resize_tables(self, int size) except -1:
+        cdef int num_entries = (size + 1) * (size + 2) // 2
+        cdef int i = (self.max_prob_size + 1) * (self.max_prob_size + 2) // 2
+        mem = <double*> PyMem_Realloc(self.insert_probs, num_entries * sizeof(double))
+        if not mem:
+            raise MemoryError()
+        self.insert_probs = mem
+        mem = <double*> PyMem_Realloc(self.adapter_probs, num_entries * sizeof(double))
+        if not mem:
+            raise MemoryError()
+        self.adapter_probs = mem
+        # -1 marks entries that have not been computed yet
+        while i < num_entries:
+            self.insert_probs[i] = -1
+            self.adapter_probs[i] = -1
+            i += 1
+        self.max_prob_size = size
+        return 0
+
+    cdef double _insert_probability(self, int matches, int size) except? -2:
+        cdef int idx = size * (size + 1) // 2 + matches
+        if self.insert_probs[idx] < 0:
+            self.insert_probs[idx] = self.match_probability(
+                matches, size, **self.base_probs)
+        return self.insert_probs[idx]
+
+    cdef double _adapter_probability(self, int matches, int size) except? -2:
+        cdef int idx
+        if matches > size:
+            return self.match_probability(matches, size)
+        idx = size * (size + 1) // 2 + matches
+        if self.adapter_probs[idx] < 0:
+            self.adapter_probs[idx] = self.match_probability(matches, size)
+        return self.adapter_probs[idx]
+
+    cdef bint _match_adapters(
+            self, _InsertMatch* candidate, const char* s1, const char* s2,
+            PackedSequence packed1, PackedSequence packed2, int seq_len,
+            int len1, int len2) except? -1:
+        """
+        Compare the overhangs (the parts of the reads beyond the insert) to the
+        adapters. Returns whether the candidate is acceptable. packed1 and
+        packed2 are the unambiguous packed reads, or None.
+        """
+        cdef int size = candidate.size
+        cdef int offset = seq_len - size
+        cdef int len_a1, len_a2, adapter_len, max_mismatches
+        cdef int errors1, errors2
+        cdef double prob1, prob2
+
+        if offset < self.min_adapter_overlap:
+            # The reads are mostly overlapping, to the point where there's not
+            # enough overhang to do a confident adapter match. We return just
+            # the insert match to signal that error correction can be done
+            # even though no adapter trimming is required.
+            candidate.has_adapter = False
+            return True
+
+        # TODO: this is very sensitive to the exact correct choice of adapter.
+        # For example, if you specifiy GATCGGAA... and the correct adapter is
+        # AGATCGGAA..., the prefixes will not match exactly and the alignment
+        # will fail. We need to use a comparison that is a bit more forgiving.
+        len_a1 = min(offset, self.adapter1_len)
+        len_a2 = min(offset, self.adapter2_len)
+        if packed1 is not None and not self.packed_adapter1.ambiguous:
+            errors1 = _packed_mismatches(
+                packed1.bases, NULL, size, self.packed_adapter1.bases, NULL, 0,
+                len_a1, len_a1, False)
+        else:
+            errors1 = _count_mismatches(
+                s1 + size, self.adapter1, len_a1, len_a1, True)
+        if packed2 is not None and not self.packed_adapter2.ambiguous:
+            errors2 = _packed_mismatches(
+                packed2.bases, NULL, size, self.packed_adapter2.bases, NULL, 0,
+                len_a2, len_a2, False)
+        else:
+            errors2 = _count_mismatches(
+                s2 + size, self.adapter2, len_a2, len_a2, True)
+
+        adapter_len = min(offset, self.adapter1_len, self.adapter2_len)
+        # rint rounds half to even, like python's round()
+        max_mismatches = <int>rint(adapter_len * self.max_adapter_mismatch_frac)
+        if errors1 > max_mismatches and errors2 > max_mismatches:
+            return False
+
+        prob1 = self._adapter_probability(len_a1 - errors1, adapter_len)
+        prob2 = self._adapter_probability(len_a2 - errors2, adapter_len)
+        if (
+                adapter_len > self.adapter_check_cutoff and
+                prob1 * prob2 > self.adapter_max_rmp):
+            return False
+
+        candidate.has_adapter = True
+        candidate.adapter_len1 = min(self.adapter1_len, len1 - size)
+        candidate.adapter_len2 = min(self.adapter2_len, len2 - size)
+        if prob1 < prob2:
+            candidate.adapter_matches = len_a1 - errors1
+            candidate.adapter_errors = errors1
+        else:
+            candidate.adapter_matches = len_a2 - errors2
+            candidate.adapter_errors = errors2
+        return True
+
+    def match_insert(
+            self, str seq1, str seq2, PackedSequence packed1=None,
+            PackedSequence packed2=None):
+        """
+        match_insert(seq1, seq2, packed1=None, packed2=None) -> (insert_match, adapter_match)
+
+        Find the best insert overlap between seq1 and seq2, and check the
+        overhangs against the adapters. packed1 and packed2 are the reads as
+        PackedSequences (e.g. Sequence.packed); reads that are not given are
+        packed into buffers owned by the matcher.
+
+        Returns None if there is no acceptable insert match.
+        """
+        cdef int len1 = len(seq1)
+        cdef int len2 = len(seq2)
+        cdef int seq_len = min(len1, len2)
+        if seq_len == 0:
+            return None
+
+        cdef bytes seq1_bytes = seq1.encode('ascii')
+        cdef bytes seq2_bytes = seq2.encode('ascii')
+        cdef const char* s1 = seq1_bytes
+        cdef const char* s2 = seq2_bytes
+        cdef const unsigned char* complement = COMPLEMENT_TABLE
+
+        # Compare 32 bases at a time when neither read has any bases other
+        # than A, C, G and T; read2-rc is read 2 reverse-complemented in full,
+        # so its last seq_len bases are the truncated reverse-complement.
+        cdef const uint64_t* b1 = NULL
+        cdef const uint64_t* brc = NULL
+        cdef int rc_offset = len2 - seq_len
+        if packed1 is None:
+            packed1 = self.packed1
+            packed1._pack(<const unsigned char*>s1, len1)
+        elif packed1.length != len1:
+            raise ValueError('packed1 is not the same length as seq1')
+        if packed2 is None:
+            packed2 = self.packed2
+            packed2._pack(<const unsigned char*>s2, len2)
+        elif packed2.length != len2:
+            raise ValueError('packed2 is not the same length as seq2')
+        if packed1.ambiguous or packed2.ambiguous:
+            packed1 = packed2 = None
+        else:
+            packed2._reverse_complement(self.packed_rc)
+            b1 = packed1.bases
+            brc = self.packed_rc.bases
+
+        if seq_len > self.rc_buffer_size:
+            mem = <char*> PyMem_Realloc(self.rc_buffer, seq_len * sizeof(char))
+            if not mem:
+                raise MemoryError()
+            self.rc_buffer = mem
+            self.rc_buffer_size = seq_len
+        if seq_len > self.max_prob_size:
+            self._resize_tables(seq_len)
+
+        cdef char* rc = self.rc_buffer
+        cdef _InsertMatch* candidates = self.candidates
+        cdef _InsertMatch tmp
+        cdef double max_error_rate = self.max_insert_mismatch_frac
+        cdef int num_candidates = 0
+        cdef int i, j, size, max_errors, errors
+
+        with nogil:
+            # reverse-complement of read 2, truncated to the shorter length
+            if brc == NULL:
+                for i in range(seq_len):
+                    rc[i] = complement[<unsigned char>s2[seq_len - 1 - i]]
+
+            # Enumerate overlaps in order of increasing size: the last `size`
+            # bases of read2-rc are aligned to the first `size` bases of read1.
+            for size in range(self.min_insert_overlap, seq_len + 1):
+                max_errors = <int>(size * max_error_rate)
+                if brc != NULL:
+                    errors = _packed_mismatches(
+                        brc, NULL, rc_offset + seq_len - size, b1, NULL, 0,
+                        size, max_errors, False)
+                else:
+                    errors = _count_mismatches(
+                        rc + seq_len - size, s1, size, max_errors, True)
+                if errors > max_errors:
+                    continue
+                if errors == 0 and size == seq_len:
+                    # exact match of the full reads; ignore any other candidates
+                    num_candidates = 0
+                candidates[num_candidates].size = size
+                candidates[num_candidates].matches = size - errors
+                candidates[num_candidates].errors = errors
+                num_candidates += 1
+                if num_candidates >= MAX_INSERT_CANDIDATES:
+                    break
+
+        # Filter by random-match probability
+        j = 0
+        for i in range(num_candidates):
+            candidates[i].prob = self._insert_probability(
+                candidates[i].matches, candidates[i].size)
+            if candidates[i].prob <= self.insert_max_rmp:
+                candidates[j] = candidates[i]
+                j += 1
+        num_candidates = j
+
+        # Test candidates in order of random-match probability (stable
+        # insertion sort, so ties are resolved by size).
+        # TODO: compare against sorting by length (which is how SeqPurge
+        # essentially does it).
+        for i in range(1, num_candidates):
+            tmp = candidates[i]
+            j = i - 1
+            while j >= 0 and candidates[j].prob > tmp.prob:
+                candidates[j + 1] = candidates[j]
+                j -= 1
+            candidates[j + 1] = tmp
+
+        for i in range(num_candidates):
+            if self._match_adapters(
+                    &candidates[i], s1, s2, packed1, packed2, seq_len, len1,
+                    len2):
+                return self._create_result(&candidates[i], seq_len)
+
+        return None
+
+    cdef tuple _create_result(self, _InsertMatch* match, int seq_len):
+        insert_match = (
+            seq_len - match.size, seq_len, 0, match.size, match.matches,
+            match.errors)
+        if not match.has_adapter:
+            return (insert_match, None)
+        return (insert_match, (
+            match.size, match.adapter_len1, match.adapter_len2,
+            match.adapter_matches, match.adapter_errors))
+
+    def __dealloc__(self):
+        PyMem_Free(self.insert_probs)
+        PyMem_Free(self.adapter_probs)
+        PyMem_Free(self.rc_buffer)
+
+
+# Common match-result object returned by aligners
+
+DEF CORRECT_N = 0
+DEF CORRECT_CONSERVATIVE = 1
+DEF CORRECT_LIBERAL = 2
+
+cdef dict MISMATCH_ACTIONS = dict(
+    N=CORRECT_N, conservative=CORRECT_CONSERVATIVE, liberal=CORRECT_LIBERAL)
+
+def correct_mismatches(
+        str seq1, str qual1, str seq2, str qual2, int r1_start, int r1_end,
+        int r2_start, int r2_end, str mismatch_action,
+        int min_qual_difference=1):
+    """
+    Correct mismatches between the overlapping parts of a read pair: read1
+    positions [r1_start, r1_end) are compared with the reverse-complemented
+    read2 positions (r2_start, r2_end), walking backwards from r2_end - 1.
+
+    Mismatches are resolved according to mismatch_action:
+    * 'N': both bases are set to N.
+    * 'conservative': an N is replaced by the base (and quality) of the other
+      read; otherwise the base with the higher quality is copied to the other
+      read if the qualities differ by at least min_qual_difference.
+    * 'liberal': as for 'conservative', but mismatches whose qualities do not
+      differ enough are resolved in favor of the read with the higher mean
+      quality in the overlap (if the means differ by more than 1).
+
+    Qualities may be None, in which case only Ns are replaced (or, for 'N',
+    mismatches masked).
+
+    Returns:
+        Tuple (seq1, qual1, changed1, seq2, qual2, changed2), where changedX
+        is the number of bases that were changed in readX.
+    """
+    cdef int action = MISMATCH_ACTIONS[mismatch_action]
+    cdef bint has_quals = qual1 is not None and qual2 is not None
+    cdef bytearray s1 = bytearray(seq1.encode('ascii'))
+    cdef bytearray s2 = bytearray(seq2.encode('ascii'))
+    cdef bytearray q1, q2
+    cdef unsigned char* b1 = s1
+    cdef unsigned char* b2 = s2
+    cdef unsigned char* p1 = NULL
+    cdef unsigned char* p2 = NULL
+    cdef const unsigned char* complement = COMPLEMENT_TABLE
+    cdef unsigned char base1, base2
+    cdef int i, j, k, n, diff
+    cdef int changed1 = 0
+    cdef int changed2 = 0
+    cdef int nequal = 0
+    cdef long sum1 = 0
+    cdef long sum2 = 0
+    cdef int* equal = NULL
+    cdef double mean_diff
+
+    if has_quals:
+        q1 = bytearray(qual1.encode('ascii'))
+        q2 = bytearray(qual2.encode('ascii'))
+        p1 = q1
+        p2 = q2
+
+    n = min(r1_end - r1_start, r2_end - 1 - r2_start)
+    if n > 0 and action == CORRECT_LIBERAL:
+        equal = <int*>PyMem_Malloc(n * sizeof(int))
+        if not equal:
+            raise MemoryError()
+
+    try:
+        for k in range(n):
+            i = r1_start + k
+            j = r2_end - 1 - k
+            base1 = b1[i]
+            base2 = complement[b2[j]]
+            if base1 == base2:
+                continue
+            if action == CORRECT_N:
+                b1[i] = b'N'
+                b2[j] = b'N'
+                changed1 += 1
+                changed2 += 1
+            elif base1 == b'N':
+                b1[i] = base2
+                if has_quals:
+                    p1[i] = p2[j]
+                changed1 += 1
+            elif base2 == b'N':
+                b2[j] = complement[base1]
+                if has_quals:
+                    p2[j] = p1[i]
+                changed2 += 1
+            elif has_quals:
+                diff = p1[i] - p2[j]
+                if diff >= min_qual_difference:
+                    b2[j] = complement[base1]
+                    p2[j] = p1[i]
+                    changed2 += 1
+                elif diff <= -min_qual_difference:
+                    b1[i] = base2
+                    p1[i] = p2[j]
+                    changed1 += 1
+                elif action == CORRECT_LIBERAL:
+                    equal[nequal] = k
+                    nequal += 1
+
+        if nequal > 0:
+            # Only make the corrections if one read is significantly better
+            # than the other.
+            for i in range(r1_start, r1_end):
+                sum1 += p1[i]
+            for j in range(r2_start, r2_end):
+                sum2 += p2[j]
+            mean_diff = (
+                <double>sum1 / (r1_end - r1_start) -
+                <double>sum2 / (r2_end - r2_start))
+            if mean_diff > 1:
+                # read1 is better than read2
+                for k in range(nequal):
+                    i = r1_start + equal[k]
+                    j = r2_end - 1 - equal[k]
+                    b2[j] = complement[b1[i]]
+                    p2[j] = p1[i]
+                    changed2 += 1
+            elif mean_diff < -1:
+                # read2 is better than read1
+                for k in range(nequal):
+                    i = r1_start + equal[k]
+                    j = r2_end - 1 - equal[k]
+                    b1[i] = complement[b2[j]]
+                    p1[i] = p2[j]
+                    changed1 += 1
+    finally:
+        PyMem_Free(equal)
+
+    if changed1:
+        seq1 = s1.decode('ascii')
+        if has_quals:
+            qual1 = q1.decode('ascii')
+    if changed2:
+        seq2 = s2.decode('ascii')
+        if has_quals:
+            qual2 = q2.decode('ascii')
+    return (seq1, qual1, changed1, seq2, qual2, changed2)
+
+MatchInfo = namedtuple("MatchInfo", (
+    "read_name", "errors", "rstart", "rstop", "seq_before", "seq_adapter",
+    "seq_after", "adapter_name", "qual_before", "qual_adapter", "qual_after",
+    "is_front", "asize", "rsize_adapter", "rsize_total"))
+
+cdef class Match:
+    """An alignment match.
+    
+    Args:
+        astart: Starting position of the match within the adapter.
+        astop: Ending position of the match within the adapter.
+        rstart: Starting position of the match within the read.
+        rstop: Ending position of the match within the read.
+        matches: Number of matching bases.
+        errors: Number of mismatching bases.
+        front: Whether the match is to the front of the read. If None, the
+            match is guessed to be a front match if the first base of the read
+            is involved in the alignment.
+        adapter: The :class:`Adapter`.
+        read: The :class:`Sequence`.
+    """
+    cdef:
+        public int astart
+        public int astop
+        public int rstart
+        public int rstop
+        public int matches
+        public int errors
+        public bint front
+        public object adapter
+        public object read
+    
+    def __init__(
+            self, int astart, int astop, int rstart, int rstop, int matches,
+            int errors, front=None, adapter=None, read=None):
+        self.astart = astart
+        self.astop = astop
+        self.rstart = rstart
+        self.rstop = rstop
+        self.matches = matches
+        self.errors = errors
+        self.front = rstart == 0 if front is None else front
+        self.adapter = adapter
+        self.read = read
+        assert self.length > 0
+        assert self.length - self.errors > 0
+    
+    property length:
+        """Number of aligned characters in the adapter. If there are indels,
+        this may be different from the number of characters in the read.
+        """
+        def __get__(self):
+            return self.astop - self.astart
+    
+    def __str__(self):
+        return (
+            'Match(astart={0}, astop={1}, rstart={2}, rstop={3}, matches={4}, '
+            'errors={5})').format(
+                self.astart, self.astop, self.rstart, self.rstop, self.matches,
+                self.errors)
+    
+    def __reduce__(self):
+        return (Match, (
+            self.astart, self.astop, self.rstart, self.rstop, self.matches,
+            self.errors, self.front, self.adapter, self.read))
+    
+    cpdef Match copy(self):
+        """Create a copy of this Match.
+        """
+        cdef Match match = Match.__new__(Match)
+        match.astart = self.astart
+        match.astop = self.astop
+        match.rstart = self.rstart
+        match.rstop = self.rstop
+        match.matches = self.matches
+        match.errors = self.errors
+        match.front = self.front
+        match.adapter = self.adapter
+        match.read = self.read
+        return match
+    
+    def wildcards(self, str wildcard_char='N'):
+        """Return a string that contains, for each wildcard character,
+        the character that it matches. For example, if the adapter
+        ATNGNA matches ATCGTA, then the string 'CT' is returned.
+
+        If there are indels, this is not reliable as the full alignment
+        is not available.
+        """
+        cdef str seq = self.read.sequence
+        cdef str aseq = self.adapter.sequence
+        cdef int i
+        cdef int seq_len = len(seq)
+        wildcards = [
+            seq[self.rstart + i]
+            for i in range(self.astop - self.astart)
+            if (aseq[self.astart + i] == wildcard_char and
+                self.rstart + i < seq_len)
+        ]
+        return ''.join(wildcards)
+
+    def rest(self):
+        """Returns the part of the read before this match if this is a
+        'front' (5') adapter, or the part after the match if this is not
+        a 'front' adapter (3'). This can be an empty string.
+        """
+        if self.front:
+            return self.read.sequence[:self.rstart]
+        else:
+            return self.read.sequence[self.rstop:]
+    
+    def get_info_record(self):
+        """Returns a :class:`MatchInfo`, which contains information about the
+        match to write into the info file.
+        """
+        cdef str seq = self.read.sequence
+        qualities = self.read.qualities
+        if qualities is None:
+            qualities = ''
+        cdef int rsize, rsize_total
+        rsize = rsize_total = self.rstop - self.rstart
+        if self.front and self.rstart > 0:
+            rsize_total = self.rstop
+        elif not self.front and self.rstop < len(seq):
+            rsize_total = len(seq) - self.rstart
+        return MatchInfo(
+            self.read.name,
+            self.errors,
+            self.rstart,
+            self.rstop,
+            seq[0:self.rstart],
+            seq[self.rstart:self.rstop],
+            seq[self.rstop:],
+            self.adapter.name,
+            qualities[0:self.rstart],
+            qualities[self.rstart:self.rstop],
+            qualities[self.rstop:],
+            self.front,
+            self.astop - self.astart,
+            rsize, rsize_total)
+
+cdef class AhoCorasick:
+    """
+    Aho-Corasick automaton that finds the exact occurrences of a set of
+    patterns in a single pass over the text, rather than one pass per pattern.
+    The trie is compiled into a full transition table over the characters that
+    occur in the patterns (all other characters share a single symbol), so
+    each text character costs one table lookup.
+
+    Args:
+        patterns: The (non-empty) pattern strings.
+    """
+    cdef int npatterns
+    cdef int nsymbols
+    cdef int nstates
+    cdef int* transitions
+    cdef int* output_offsets
+    cdef int* outputs
+    cdef int* lengths
+    cdef bytes symbols
+    cdef readonly tuple patterns
+
+    def __cinit__(self, patterns):
+        cdef int i, j, state, sym, nxt
+        self.patterns = tuple(patterns)
+        self.npatterns = len(self.patterns)
+        if any(len(pattern) == 0 for pattern in self.patterns):
+            raise ValueError('Patterns must not be empty')
+
+        # Symbol 0 is shared by all characters that occur in no pattern
+        chars = sorted(set(''.join(self.patterns)))
+        table = bytearray(256)
+        for i, char in enumerate(chars):
+            table[ord(char)] = i + 1
+        self.symbols = bytes(table)
+        self.nsymbols = len(chars) + 1
+
+        # Build the trie
+        goto = [[-1] * self.nsymbols]
+        out = [[]]
+        for i, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern.encode('ascii'):
+                sym = table[char]
+                if goto[state][sym] < 0:
+                    goto[state][sym] = len(goto)
+                    goto.append([-1] * self.nsymbols)
+                    out.append([])
+                state = goto[state][sym]
+            out[state].append(i)
+
+        # Compute failure links breadth-first and fill in the missing
+        # transitions from the failure states
+        fail = [0] * len(goto)
+        queue = deque()
+        for sym in range(self.nsymbols):
+            nxt = goto[0][sym]
+            if nxt < 0:
+                goto[0][sym] = 0
+            else:
+                queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            out[state].extend(out[fail[state]])
+            for sym in range(self.nsymbols):
+                nxt = goto[state][sym]
+                if nxt < 0:
+                    goto[state][sym] = goto[fail[state]][sym]
+                else:
+                    fail[nxt] = goto[fail[state]][sym]
+                    queue.append(nxt)
+
+        self.nstates = len(goto)
+        self.transitions = <int*>PyMem_Malloc(
+            self.nstates * self.nsymbols * sizeof(int))
+        self.output_offsets = <int*>PyMem_Malloc(
+            (self.nstates + 1) * sizeof(int))
+        self.outputs = <int*>PyMem_Malloc(
+            max(1, sum(len(o) for o in out)) * sizeof(int))
+        self.lengths = <int*>PyMem_Malloc(
+            max(1, self.npatterns) * sizeof(int))
+        if not (self.transitions and self.output_offsets and self.outputs and
+                self.lengths):
+            raise MemoryError()
+        j = 0
+        for state in range(self.nstates):
+            for sym in range(self.nsymbols):
+                self.transitions[state * self.nsymbols + sym] = goto[state][sym]
+            self.output_offsets[state] = j
+            for i in out[state]:
+                self.outputs[j] = i
+                j += 1
+        self.output_offsets[self.nstates] = j
+        for i in range(self.npatterns):
+            self.lengths[i] = len(self.patterns[i])
+
+    def __dealloc__(self):
+        PyMem_Free(self.transitions)
+        PyMem_Free(self.output_offsets)
+        PyMem_Free(self.outputs)
+        PyMem_Free(self.lengths)
+
+    def __reduce__(self):
+        return (AhoCorasick, (self.patterns,))
+
+    def find_first(self, str text):
+        """
+        Return a list with the start position of the first occurrence of each
+        pattern in text (i.e. the result of text.find(pattern) for each
+        pattern), or -1 for patterns that do not occur.
+        """
+        cdef bytes btext = text.encode('ascii')
+        cdef const unsigned char* s = btext
+        cdef const unsigned char* table = self.symbols
+        cdef int n = len(btext)
+        cdef int remaining = self.npatterns
+        cdef int state = 0
+        cdef int i, j, p
+        cdef int* starts = <int*>PyMem_Malloc(
+            max(1, self.npatterns) * sizeof(int))
+        if not starts:
+            raise MemoryError()
+        for p in range(self.npatterns):
+            starts[p] = -1
+        for i in range(n):
+            if remaining == 0:
+                break
+            state = self.transitions[state * self.nsymbols + table[s[i]]]
+            for j in range(self.output_offsets[state],
+                           self.output_offsets[state + 1]):
+                p = self.outputs[j]
+                if starts[p] < 0:
+                    starts[p] = i - self.lengths[p] + 1
+                    remaining -= 1
+        result = [starts[p] for p in range(self.npatterns)]
+        PyMem_Free(starts)
+        return result
+
+# 2-bit packed nucleotide sequences. Each base is stored in two bits (A=0,
+# C=1, G=2, T=3), 32 bases per 64-bit word, so that complementing a base is an
+# XOR with 3 and comparing two words compares 32 bases at once. Characters
+# other than A, C, G and T (N, the other IUPAC codes and lower-case bases) are
+# recorded in a separate bitmask (one bit per base) and are stored as A in the
+# packed words. Sequences without masked bases compare exactly like their
+# strings; the aligners fall back to comparing characters otherwise.
+
+DEF BASES_PER_WORD = 32
+
+def _pack_table():
+    """
+    Return a translation table that maps the A, C, G and T characters to their
+    2-bit codes. All other characters are mapped to 0xFF.
+    """
+    t = bytearray(b'\xff') * 256
+    for v, c in enumerate('ACGT'):
+        t[ord(c)] = v
+    return bytes(t)
+
+cdef bytes PACK_TABLE = _pack_table()
+cdef str UNPACK_BASES = 'ACGT'
+cdef uint64_t LANES = 0x5555555555555555ULL
+
+cdef inline int _popcount(uint64_t x) nogil:
+    x = x - ((x >> 1) & 0x5555555555555555ULL)
+    x = (x & 0x3333333333333333ULL) + ((x >> 2) & 0x3333333333333333ULL)
+    x = (x + (x >> 4)) & 0x0F0F0F0F0F0F0F0FULL
+    return <int>((x * ONES) >> 56)
+
+cdef inline uint64_t _spread_bits(uint64_t x) nogil:
+    """Spread the low 32 bits of x out to the low bit of 32 2-bit lanes."""
+    x &= 0xFFFFFFFFULL
+    x = (x | (x << 16)) & 0x0000FFFF0000FFFFULL
+    x = (x | (x << 8)) & 0x00FF00FF00FF00FFULL
+    x = (x | (x << 4)) & 0x0F0F0F0F0F0F0F0FULL
+    x = (x | (x << 2)) & 0x3333333333333333ULL
+    x = (x | (x << 1)) & LANES
+    return x
+
+cdef inline uint64_t _bits_at(const uint64_t* words, int bit) nogil:
+    """
+    Return the 64 bits starting at bit position `bit`. The word following the
+    one containing `bit` must be readable (PackedSequence keeps a zeroed
+    padding word at the end of each array for this purpose).
+    """
+    cdef int w = bit >> 6
+    cdef int s = bit & 63
+    if s == 0:
+        return words[w]
+    return (words[w] >> s) | (words[w + 1] << (64 - s))
+
+cdef inline int _packed_mismatches(
+        const uint64_t* bases1, const uint64_t* mask1, int offset1,
+        const uint64_t* bases2, const uint64_t* mask2, int offset2,
+        int length, int max_errors, bint wildcards) nogil:
+    """
+    Count mismatches between positions offset1:offset1+length of the first
+    packed sequence and offset2:offset2+length of the second, 32 bases per
+    word. The masks may be NULL if neither sequence has masked bases. Returns
+    early (with a value > max_errors) as soon as the error budget is exceeded.
+    """
+    cdef int errors = 0
+    cdef int i = 0
+    cdef int n
+    cdef uint64_t diff, m1, m2
+    while i < length:
+        n = min(BASES_PER_WORD, length - i)
+        diff = (
+            _bits_at(bases1, 2 * (offset1 + i)) ^
+            _bits_at(bases2, 2 * (offset2 + i)))
+        # Reduce each 2-bit lane to its low bit.
+        diff = (diff | (diff >> 1)) & LANES
+        if mask1 != NULL:
+            m1 = _spread_bits(_bits_at(mask1, offset1 + i))
+            m2 = _spread_bits(_bits_at(mask2, offset2 + i))
+            diff &= ~(m1 | m2)
+            if not wildcards:
+                diff |= m1 ^ m2
+        if n < BASES_PER_WORD:
+            diff &= (1ULL << (2 * n)) - 1
+        errors += _popcount(diff)
+        if errors > max_errors:
+            return errors
+        i += BASES_PER_WORD
+    return errors
+
+cdef inline uint64_t _reverse_lanes(uint64_t x) nogil:
+    """Reverse the order of the 32 2-bit lanes of x."""
+    x = ((x >> 2) & 0x3333333333333333ULL) | ((x & 0x3333333333333333ULL) << 2)
+    x = ((x >> 4) & 0x0F0F0F0F0F0F0F0FULL) | ((x & 0x0F0F0F0F0F0F0F0FULL) << 4)
+    x = ((x >> 8) & 0x00FF00FF00FF00FFULL) | ((x & 0x00FF00FF00FF00FFULL) << 8)
+    x = ((x >> 16) & 0x0000FFFF0000FFFFULL) | ((x & 0x0000FFFF0000FFFFULL) << 16)
+    return (x >> 32) | (x << 32)
+
+cdef class PackedSequence:
+    """
+    A nucleotide sequence packed into two bits per base, plus a mask of the
+    positions that hold something other than A, C, G or T (N, another IUPAC
+    character or a lower-case base). Masked positions unpack as 'N'.
+
+    Args:
+        sequence: The sequence to pack.
+    """
+    def __cinit__(self, str sequence=''):
+        cdef bytes seq = sequence.encode('ascii')
+        self.capacity = -1
+        self._pack(seq, len(seq))
+
+    cdef int _allocate(self, int length) except -1:
+        # Clears the sequence and sets its length, growing the arrays if
+        # necessary, so that a PackedSequence can be reused as a buffer. There
+        # is one extra word of padding so that _bits_at never reads past the
+        # end.
+        cdef int nbases = (length + BASES_PER_WORD - 1) // BASES_PER_WORD + 1
+        cdef int nmask = (length + 63) // 64 + 1
+        if length > self.capacity:
+            mem = <uint64_t*>PyMem_Realloc(
+                self.bases, nbases * sizeof(uint64_t))
+            if not mem:
+                raise MemoryError()
+            self.bases = mem
+            mem = <uint64_t*>PyMem_Realloc(self.mask, nmask * sizeof(uint64_t))
+            if not mem:
+                raise MemoryError()
+            self.mask = mem
+            self.capacity = length
+        self.length = length
+        self.ambiguous = 0
+        memset(self.bases, 0, nbases * sizeof(uint64_t))
+        memset(self.mask, 0, nmask * sizeof(uint64_t))
+        return 0
+
+    cdef int _pack(self, const unsigned char* s, int length) except -1:
+        # Replaces the sequence with the `length` characters at `s`.
+        cdef const unsigned char* table = PACK_TABLE
+        cdef unsigned char code
+        cdef uint64_t word = 0
+        cdef int i
+        self._allocate(length)
+        for i in range(length):
+            code = table[s[i]]
+            if code > 3:
+                self.mask[i >> 6] |= 1ULL << (i & 63)
+                self.ambiguous += 1
+                code = 0
+            word |= (<uint64_t>code) << (2 * (i & 31))
+            if (i & 31) == 31:
+                self.bases[i >> 5] = word
+                word = 0
+        if length & 31:
+            self.bases[length >> 5] = word
+        return 0
+
+    def __dealloc__(self):
+        PyMem_Free(self.bases)
+        PyMem_Free(self.mask)
+
+    def __len__(self):
+        return self.length
+
+    def __reduce__(self):
+        return (PackedSequence, (self.unpack(),))
+
+    def __repr__(self):
+        return '<PackedSequence(length={0}, ambiguous={1})>'.format(
+            self.length, self.ambiguous)
+
+    cdef int _code_at(self, int i):
+        return (self.bases[i >> 5] >> (2 * (i & 31))) & 3
+
+    cdef bint _masked_at(self, int i):
+        return (self.mask[i >> 6] >> (i & 63)) & 1
+
+    def unpack(self):
+        """Returns the sequence as a string."""
+        cdef int i
+        chars = []
+        for i in range(self.length):
+            if self._masked_at(i):
+                chars.append('N')
+            else:
+                chars.append(UNPACK_BASES[self._code_at(i)])
+        return ''.join(chars)
+
+    def reverse_complement(self):
+        """Returns the reverse complement of this sequence as a new
+        PackedSequence. Masked positions stay masked.
+        """
+        cdef PackedSequence rc = PackedSequence.__new__(PackedSequence)
+        self._reverse_complement(rc)
+        return rc
+
+    cdef int _reverse_complement(self, PackedSequence rc) except -1:
+        # Replaces the sequence of `rc` with the reverse complement of this
+        # one.
+        cdef int i, j, start, n
+        cdef uint64_t word
+        rc._allocate(self.length)
+        rc.ambiguous = self.ambiguous
+        # Word k of the reverse complement holds, in reverse order, the
+        # complements of the 32 bases that end 32 * k bases before the end.
+        for i in range((self.length + BASES_PER_WORD - 1) // BASES_PER_WORD):
+            start = self.length - BASES_PER_WORD * (i + 1)
+            if start >= 0:
+                word = _bits_at(self.bases, 2 * start)
+                n = BASES_PER_WORD
+            else:
+                word = self.bases[0] << (-2 * start)
+                n = BASES_PER_WORD + start
+            word = _reverse_lanes(word) ^ 0xFFFFFFFFFFFFFFFFULL
+            if n < BASES_PER_WORD:
+                word &= (1ULL << (2 * n)) - 1
+            rc.bases[i] = word
+        if self.ambiguous:
+            for i in range(self.length):
+                if self._masked_at(i):
+                    j = self.length - i - 1
+                    rc.mask[j >> 6] |= 1ULL << (j & 63)
+        return 0
+
+    def kmers(self, int k):
+        """Returns the integer codes of all k-mers in this sequence, in order
+        of position. Codes are those computed by
+        :func:`atropos.util.encode_kmer`. Windows that contain a masked base
+        are given the code -1.
+
+        Args:
+            k: The k-mer size; must be between 1 and 32.
+        """
+        if not 1 <= k <= BASES_PER_WORD:
+            raise ValueError(
+                'k must be between 1 and {}'.format(BASES_PER_WORD))
+        cdef uint64_t code = 0
+        cdef uint64_t kmask = 0xFFFFFFFFFFFFFFFFULL
+        cdef int i
+        cdef int last_masked = -1
+        if k < BASES_PER_WORD:
+            kmask = (1ULL << (2 * k)) - 1
+        result = []
+        for i in range(self.length):
+            code = ((code << 2) | self._code_at(i)) & kmask
+            if self._masked_at(i):
+                last_masked = i
+            if i >= k - 1:
+                if last_masked > i - k:
+                    result.append(-1)
+                else:
+                    result.append(code)
+        return result
+
+    def mismatches(
+            self, PackedSequence other, int offset=0, int length=-1,
+            bint wildcards=False):
+        """Counts the mismatches between self[offset:offset+length] and
+        other[0:length], comparing 32 bases per machine word.
+
+        Args:
+            other: The PackedSequence to compare against.
+            offset: Position within this sequence at which to start.
+            length: Number of bases to compare. Defaults to the length of the
+                overlap between the two sequences.
+            wildcards: Whether masked bases match any base. Otherwise a masked
+                base only matches another masked base (like 'N' == 'N').
+        """
+        if offset < 0 or offset > self.length:
+            raise ValueError('offset must be between 0 and {}'.format(
+                self.length))
+        if length < 0:
+            length = min(self.length - offset, other.length)
+        elif offset + length > self.length or length > other.length:
+            raise ValueError('length exceeds the end of the sequence')
+        if self.ambiguous > 0 or other.ambiguous > 0:
+            return _packed_mismatches(
+                self.bases, self.mask, offset, other.bases, other.mask, 0,
+                length, length, wildcards)
+        return _packed_mismatches(
+            self.bases, NULL, offset, other.bases, NULL, 0, length, length,
+            wildcards)
@@ -0,0 +1,56 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+"""
+Compiled versions of the loop in Pipeline.handle_records, specialized for the
+single-end and paired-end pipeline mixins. The base-pair counts are summed in C
+variables and added to context['bp'] once per batch.
+"""
+from atropos import AtroposError
+
+def handle_single_end_records(pipeline, context, records):
+    """
+    Handle a batch of single-end records; equivalent to calling
+    SingleEndPipelineMixin.handle_record on each record.
+    """
+    cdef Py_ssize_t idx = 0
+    cdef long long bp = 0
+    bps = context['bp']
+    handle_reads = pipeline.handle_reads
+    try:
+        for record in records:
+            try:
+                bp += len(record)
+                handle_reads(context, record)
+            except Exception as err:
+                raise AtroposError(
+                    "An error occurred at record {} of batch {}".format(
+                    idx, context['index'])) from err
+            idx += 1
+    finally:
+        bps[0] += bp
+
+def handle_paired_end_records(pipeline, context, records):
+    """
+    Handle a batch of paired-end records; equivalent to calling
+    PairedEndPipelineMixin.handle_record on each record.
+    """
+    cdef Py_ssize_t idx = 0
+    cdef long long bp1 = 0
+    cdef long long bp2 = 0
+    bps = context['bp']
+    handle_reads = pipeline.handle_reads
+    try:
+        for record in records:
+            try:
+                read1, read2 = record
+                bp1 += len(read1.sequence)
+                bp2 += len(read2.sequence)
+                handle_reads(context, read1, read2)
+            except Exception as err:
+                raise AtroposError(
+                    "An error occurred at record {} of batch {}".format(
+                    idx, context['index'])) from err
+            idx += 1
+    finally:
+        bps[0] += bp1
+        bps[1] += bp2
@@ -9,9 +9,25 @@ from atropos.adapters import AdapterCache
 from atropos.io.seqio import open_reader, sra_reader
 from atropos.util import MergingDict, Const, Summarizable, Timing
 
+# Import the compiled record loops, if available.
+try:
+    from ._base import handle_single_end_records, handle_paired_end_records
+except ImportError:
+    handle_single_end_records = handle_paired_end_records = None
+
 class Pipeline(object):
     """Base class for analysis pipelines.
     """
+    # A function (pipeline, context, records), wrapped in staticmethod, that
+    # handles a batch of records in place of the loop in `handle_records`,
+    # calling `handle_reads` directly.
+    # The pipeline mixins set this to a compiled loop that is equivalent to
+    # calling their `handle_record`. It is not used if a subclass overrides
+    # `handle_record`.
+    records_loop = None
+    # Set to True by pipelines that stop before all of the input is read.
+    done = False
+    
     def __init__(self):
         self.record_counts = {}
         self.bp_counts = {}
@@ -21,6 +37,8 @@ class Pipeline(object):
         try:
             for batch in command_runner.iterator():
                 self.process_batch(batch)
+                if self.done:
+                    break
         except Exception as err:
             if raise_on_error:
                 raise
@@ -69,6 +87,10 @@ class Pipeline(object):
             context: The pipeline context (dict).
             records: The sequence of records.
         """
+        records_loop = self._get_records_loop()
+        if records_loop is not None:
+            records_loop(self, context, records)
+            return
         for idx, record in enumerate(records):
             try:
                 self.handle_record(context, record)
@@ -77,6 +99,18 @@ class Pipeline(object):
                     "An error occurred at record {} of batch {}".format(
                     idx, context['index'])) from err
     
+    def _get_records_loop(self):
+        """Returns `records_loop` if the class that sets it also defines the
+        `handle_record` of this pipeline, otherwise None.
+        """
+        handle_record = type(self).handle_record
+        for cls in type(self).__mro__:
+            if 'records_loop' in cls.__dict__:
+                if cls.__dict__.get('handle_record') is not handle_record:
+                    return None
+                break
+        return self.records_loop
+    
     def handle_record(self, context, record):
         """Handle a single record.
         
@@ -112,6 +146,8 @@ class Pipeline(object):
 class SingleEndPipelineMixin(object):
     """Mixin for pipelines that implements `handle_record` for single-end data.
     """
+    records_loop = staticmethod(handle_single_end_records)
+    
     def handle_record(self, context, record):
         context['bp'][0] += len(record)
         return self.handle_reads(context, record)
@@ -119,6 +155,8 @@ class SingleEndPipelineMixin(object):
 class PairedEndPipelineMixin(object):
     """Mixin for pipelines that implements `handle_record` for paired-end data.
     """
+    records_loop = staticmethod(handle_paired_end_records)
+    
     def handle_record(self, context, record):
         read1, read2 = record
         bps = context['bp']
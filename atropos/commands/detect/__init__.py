@@ -1,14 +1,18 @@
 """Detect adapter sequences directly from reads based on kmer frequency.
 """
 from collections import defaultdict
+import heapq
 import logging
 import math
 import re
 from atropos.align import Aligner, SEMIGLOBAL
 from atropos.commands.base import (
     BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin)
+from atropos.commands.detect.kmers import (
+    find_overrepresented_kmers, CountMinSketch)
 from atropos.util import (
-    reverse_complement, sequence_complexity, enumerate_range, run_interruptible)
+    Mergeable, reverse_complement, sequence_complexity, enumerate_range,
+    run_interruptible)
 
 # TODO: Test whether using rc=True in parse_known_contaminants is as fast
 # and as accurate as testing both the forward and reverse complement
@@ -41,8 +45,6 @@ from atropos.util import (
 # TODO: Re-download sequencing_adapters.fa if it has been updated since last
 # download.
 
-# TODO: parallelize adapter detection for multiple input files.
-
 class CommandRunner(BaseCommandRunner):
     name = 'detect'
     
@@ -55,16 +57,26 @@ class CommandRunner(BaseCommandRunner):
         if include != 'unknown':
             known_contaminants = self.load_known_adapters()
         
+        has_known = known_contaminants is not None and not (
+            known_contaminants.empty)
         detector = self.detector
         if not detector:
-            if known_contaminants and include == 'known':
+            if has_known and include == 'known':
                 detector = 'known'
-            elif n_reads <= 50000:
+            elif n_reads <= 50000 or kmer_size > 32:
                 detector = 'heuristic'
             else:
-                detector = 'khmer'
+                detector = 'sketch'
+        elif detector == 'known' and not has_known:
+            logging.getLogger().warning(
+                "There are no known contaminants for the 'known' detector; "
+                "using the heuristic detector instead")
+            detector = 'heuristic'
         
-        detector_args = dict(known_contaminants=known_contaminants)
+        detector_args = dict(
+            known_contaminants=known_contaminants,
+            check_interval=self.check_interval,
+            convergence_tolerance=self.convergence_tolerance)
             
         if detector == 'known':
             logging.getLogger().debug(
@@ -82,6 +94,12 @@ class CommandRunner(BaseCommandRunner):
             logging.getLogger().debug(
                 "Detecting contaminants using the kmer-based algorithm")
             detector_class = KhmerDetector
+        elif detector == 'sketch':
+            logging.getLogger().debug(
+                "Detecting contaminants using the count-min sketch algorithm")
+            detector_class = SketchDetector
+            detector_args['sketch_memory'] = self.sketch_memory
+            detector_args['sketch_depth'] = self.sketch_depth
         
         summary_args = dict(
             kmer_size=kmer_size, n_reads=n_reads, 
@@ -90,9 +108,10 @@ class CommandRunner(BaseCommandRunner):
         detector_args.update(summary_args)
         
         if self.paired:
-            detector = PairedDetector(detector_class, **detector_args)
+            pipeline_class = PairedDetector
+            detector_args['detector_class'] = detector_class
         else:
-            detector = detector_class(**detector_args)
+            pipeline_class = detector_class
         
         self.summary['detect'] = summary_args
         if known_contaminants:
@@ -103,9 +122,157 @@ class CommandRunner(BaseCommandRunner):
             "Detecting adapters and other potential contaminant "
             "sequences based on %d-mers in %d reads", kmer_size, n_reads)
         
-        # currently only single-threaded operation is supproted
-        self.summary.update(mode='serial', threads=1)
-        return run_interruptible(detector, self, raise_on_error=True)
+        if self.threads is None:
+            self.summary.update(mode='serial', threads=1)
+            detector = pipeline_class(**detector_args)
+            return run_interruptible(detector, self, raise_on_error=True)
+        else:
+            self.summary.update(mode='parallel', threads=self.threads)
+            return self.run_parallel(pipeline_class, detector_args)
+    
+    def run_parallel(self, pipeline_class, pipeline_args):
+        """Execute detect in parallel mode. Worker processes filter reads and
+        collect k-mer counts, and send their :class:`DetectorState` with their
+        summary. Contaminants are identified in the main process from the
+        merged state.
+        
+        Args:
+            pipeline_class: Pipeline class to instantiate.
+            pipeline_args: Arguments to pass to Pipeline constructor.
+        
+        Returns:
+            The return code.
+        """
+        from atropos.commands.multicore import (
+            ParallelPipelineMixin, ParallelPipelineRunner)
+        
+        logging.getLogger().debug(
+            "Starting atropos detect in parallel mode with threads=%d, "
+            "timeout=%d", self.threads, self.process_timeout)
+        
+        if self.threads < 2:
+            raise ValueError("'threads' must be >= 2")
+        
+        class ParallelDetectPipelineRunner(ParallelPipelineRunner):
+            """ParallelPipelineRunner that identifies contaminants once the
+            worker summaries have been merged.
+            """
+            def finish(self):
+                detect_summary = self.command_runner.summary['detect']
+                self.pipeline.set_state(detect_summary.pop('state'))
+                detect_summary['matches'] = self.pipeline.summarize_matches()
+        
+        pipeline_class = type(
+            'DetectPipelineImpl', (ParallelPipelineMixin, pipeline_class), {})
+        pipeline = pipeline_class(**pipeline_args)
+        runner = ParallelDetectPipelineRunner(self, pipeline)
+        return runner.run()
+
+class DetectorState(Mergeable):
+    """The information a :class:`Detector` collects from reads, which can be
+    merged with the information collected by another detector. Read sequences
+    are merged by union, so each distinct read is counted once however the
+    reads are split between detectors.
+    
+    Args:
+        read_length: Length of the first read, or None if no reads were seen.
+        read_sequences: Set of filtered read sequences.
+        sample: :class:`ReadSample` of the filtered reads.
+        sketch: :class:`atropos.commands.detect.kmers.CountMinSketch` of k-mer
+            counts, or None.
+    """
+    def __init__(
+            self, read_length=None, read_sequences=None, sample=None,
+            sketch=None):
+        self.read_length = read_length
+        self.read_sequences = read_sequences or set()
+        self.sample = sample
+        self.sketch = sketch
+    
+    def merge(self, other):
+        if self.read_length is None:
+            self.read_length = other.read_length
+        self.read_sequences.update(other.read_sequences)
+        if self.sample is None:
+            self.sample = other.sample
+        elif other.sample is not None:
+            self.sample.merge(other.sample)
+        if self.sketch is None:
+            self.sketch = other.sketch
+        elif other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        return self
+
+def _read_priority(key):
+    # splitmix64, so that priorities are uniformly distributed even though
+    # keys are consecutive.
+    key = (key + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return key ^ (key >> 31)
+
+class ReadSample(Mergeable):
+    """A uniform sample of at most `size` reads, used to estimate how many
+    reads contain a sequence.
+    
+    Each read is given a pseudo-random priority computed from its position in
+    the input (batch index and position within the batch), and the sample
+    holds the reads with the lowest priorities. The sample therefore does not
+    depend on how the batches are divided between worker processes, and
+    merging the samples of several workers gives the sample of all of their
+    reads.
+    
+    Args:
+        size: The maximum number of reads in the sample.
+    """
+    def __init__(self, size=10000):
+        self.size = size
+        self.n_reads = 0
+        # Max-heap (by negated priority) of (-priority, seq)
+        self._heap = []
+    
+    def __len__(self):
+        return len(self._heap)
+    
+    def add(self, batch_index, pos, seq):
+        """Add a read.
+        
+        Args:
+            batch_index, pos: The index of the read's batch and its position
+                within the batch.
+            seq: The read sequence.
+        """
+        self.n_reads += 1
+        self._push(-_read_priority((batch_index << 32) | pos), seq)
+    
+    def _push(self, neg_priority, seq):
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, (neg_priority, seq))
+        elif neg_priority > self._heap[0][0]:
+            heapq.heapreplace(self._heap, (neg_priority, seq))
+    
+    @property
+    def sequences(self):
+        """The sequences of the sampled reads.
+        """
+        return [seq for _, seq in self._heap]
+    
+    def estimate_count(self, subseq):
+        """Estimate the number of reads that contain `subseq`. The estimate
+        is exact if no more than `size` reads were added.
+        """
+        if not self._heap:
+            return 0
+        hits = sum(1 for _, seq in self._heap if subseq in seq)
+        if self.n_reads <= len(self._heap):
+            return hits
+        return int(round(hits * self.n_reads / len(self._heap)))
+    
+    def merge(self, other):
+        self.n_reads += other.n_reads
+        for neg_priority, seq in other._heap:
+            self._push(neg_priority, seq)
+        return self
 
 class Match(object):
     """A contaminant match.
@@ -188,13 +355,11 @@ class Match(object):
             if self.longest_match is None or self.longest_match[1] < seqlen:
                 self.longest_match = (seq[idx:], seqlen)
     
-    def estimate_abundance(self, read_sequences):
-        """Determine whether this match's sequence is within 'seq' by simple
-        exact string comparison.
+    def estimate_abundance(self, sample):
+        """Estimate the number of reads that contain this match's sequence,
+        by exact string comparison, from a :class:`ReadSample`.
         """
-        self.abundance = sum(
-            1 for read_seq in read_sequences
-            if self.seq in read_seq)
+        self.abundance = sample.estimate_count(self.seq)
     
     def summarize(self):
         summary = dict(
@@ -248,31 +413,39 @@ class ContaminantMatcher(object):
             that match, f2 is the fraction of sequence kmers that match, and
             seq is the best matching sequence (either `seq` or `seqrc`).
         """
-        fw_kmers = set(
-            seq[i:(i+self.kmer_size)]
-            for i in range(len(seq) - self.kmer_size + 1))
-        fw_matches = float(len(self.kmers & fw_kmers))
+        fw_kmers = kmer_set(seq, self.kmer_size)
+        rv_kmers = kmer_set(seqrc, self.kmer_size)
+        return self.score(
+            seq, len(fw_kmers), len(self.kmers & fw_kmers),
+            seqrc, len(rv_kmers), len(self.kmers & rv_kmers))
+    
+    def score(self, seq, n_fw, fw_matches, seqrc, n_rv, rv_matches):
+        """Computes match fractions from kmer counts.
         
-        rv_kmers = set(
-            seqrc[i:(i+self.kmer_size)]
-            for i in range(len(seqrc) - self.kmer_size + 1))
-        rv_matches = float(len(self.kmers & rv_kmers))
+        Args:
+            seq, seqrc: The sequence to match and its reverse complement.
+            n_fw, n_rv: The numbers of distinct kmers in `seq` and `seqrc`.
+            fw_matches, rv_matches: The numbers of kmers in `seq` and `seqrc`
+                that are also in the contaminant.
         
+        Returns:
+            Tuple (f1, f2, seq), as returned by `match`.
+        """
         if fw_matches >= rv_matches:
-            n_matches = fw_matches
-            kmers = fw_kmers
+            n_matches = float(fw_matches)
+            n_kmers = n_fw
             compare_seq = seq
         else:
-            n_matches = rv_matches
-            kmers = rv_kmers
+            n_matches = float(rv_matches)
+            n_kmers = n_rv
             compare_seq = seqrc
         
         self.matches += n_matches
         match_frac1 = match_frac2 = 0
         if self.n_kmers > 0:
             match_frac1 = n_matches / self.n_kmers
-        if len(kmers) > 0:
-            match_frac2 = n_matches / len(kmers)
+        if n_kmers > 0:
+            match_frac2 = n_matches / n_kmers
         return (match_frac1, match_frac2, compare_seq)
 
 def create_contaminant_matchers(contaminants, kmer_size):
@@ -290,7 +463,155 @@ def create_contaminant_matchers(contaminants, kmer_size):
         for seq, names in contaminants.iter_sequences()
     ]
 
-class Detector(SingleEndPipelineMixin, Pipeline):
+class ContaminantIndex(object):
+    """An inverted index from kmers to the known contaminants that contain
+    them. A sequence is matched against all contaminants at once by looking up
+    each of its kmers in the index, rather than by intersecting its kmers with
+    those of every contaminant.
+    
+    Args:
+        contaminants: A dict of {seq:names}.
+        kmer_size: The kmer size.
+    """
+    def __init__(self, contaminants, kmer_size):
+        self.kmer_size = kmer_size
+        self.matchers = create_contaminant_matchers(contaminants, kmer_size)
+        self.index = defaultdict(list)
+        for contam_id, contam in enumerate(self.matchers):
+            for kmer in contam.kmers:
+                self.index[kmer].append(contam_id)
+    
+    def match(self, seq, seqrc):
+        """Match a sequence against all contaminants with which it shares at
+        least one kmer.
+        
+        Args:
+            seq: The sequence to match.
+            seqrc: The reverse complement of `seq`.
+        
+        Returns:
+            A list of tuples (contam, (f1, f2, seq)), where contam is a
+            :class:`ContaminantMatcher` and (f1, f2, seq) is the result of
+            :method:`ContaminantMatcher.match`, in decreasing order of
+            (f1, f2).
+        """
+        fw_kmers = kmer_set(seq, self.kmer_size)
+        rv_kmers = kmer_set(seqrc, self.kmer_size)
+        fw_hits = self._count_hits(fw_kmers)
+        rv_hits = self._count_hits(rv_kmers)
+        results = []
+        for contam_id in sorted(set(fw_hits) | set(rv_hits)):
+            contam = self.matchers[contam_id]
+            results.append((contam, contam.score(
+                seq, len(fw_kmers), fw_hits.get(contam_id, 0),
+                seqrc, len(rv_kmers), rv_hits.get(contam_id, 0))))
+        results.sort(key=lambda x: (x[1][0], x[1][1]), reverse=True)
+        return results
+    
+    def _count_hits(self, kmers):
+        hits = defaultdict(int)
+        index = self.index
+        for kmer in kmers:
+            if kmer in index:
+                for contam_id in index[kmer]:
+                    hits[contam_id] += 1
+        return hits
+
+def kmer_set(seq, kmer_size):
+    """Returns the set of kmers in a sequence.
+    """
+    return set(
+        seq[i:(i+kmer_size)] for i in range(len(seq) - kmer_size + 1))
+
+class ConvergenceMixin(object):
+    """Mixin for detector pipelines that stops reading once the detected
+    contaminants are stable. Every `check_interval` batches, contaminants are
+    identified from the reads seen so far. The pipeline is done when the top
+    contaminants are the same as at the previous check, and none of their
+    frequencies has changed by more than `convergence_tolerance` (relative to
+    the larger frequency).
+    
+    Detectors that keep running counts (see :attr:`Detector.rescans_reads`)
+    only re-rank contaminants at a check. The others identify contaminants
+    with a pass over all the reads seen so far, so checking every
+    `check_interval` batches would take time quadratic in the number of reads.
+    For those, a check is skipped unless the number of reads has grown by a
+    factor of at least `check_growth` since the previous check, which keeps
+    the total time of all checks linear in the number of reads.
+    
+    Subclasses must set `check_interval` and `convergence_tolerance`, and
+    implement `_detectors`.
+    """
+    # Number of top contaminants compared between checks.
+    n_top = 5
+    # Minimum growth of the number of reads between checks of detectors that
+    # rescan reads.
+    check_growth = 1.25
+    _previous_freqs = None
+    _checked_reads = 0
+    
+    def process_batch(self, batch):
+        super().process_batch(batch)
+        if (
+                self.check_interval and
+                batch[0]['index'] % self.check_interval == 0 and
+                self._check_due()):
+            self.done = self._check_convergence()
+    
+    def _check_due(self):
+        if not any(detector.rescans_reads for detector in self._detectors()):
+            return True
+        n_reads = sum(self.record_counts.values())
+        return n_reads >= self._checked_reads * self.check_growth
+    
+    def finish(self, summary, **kwargs):
+        if self.check_interval:
+            # Contaminants are reported for the reads actually seen.
+            self._set_n_reads()
+        super().finish(summary, **kwargs)
+    
+    def _detectors(self):
+        """Returns the list of :class:`Detector`s used by this pipeline.
+        """
+        raise NotImplementedError()
+    
+    def _set_n_reads(self):
+        n_reads = sum(self.record_counts.values())
+        for detector in self._detectors():
+            if detector.n_reads != n_reads:
+                detector.n_reads = n_reads
+                detector._matches = None
+        return n_reads
+    
+    def _check_convergence(self):
+        n_reads = self._checked_reads = self._set_n_reads()
+        current = []
+        for detector in self._detectors():
+            detector._matches = None
+            freqs = {}
+            for match in detector.matches()[:self.n_top]:
+                freq = match.count
+                if not match.count_is_frequency:
+                    freq /= float(n_reads)
+                freqs[match.seq] = freq
+            current.append(freqs)
+        previous = self._previous_freqs
+        self._previous_freqs = current
+        if previous is None:
+            return False
+        for prev_freqs, cur_freqs in zip(previous, current):
+            if set(prev_freqs) != set(cur_freqs):
+                return False
+            for seq, freq in cur_freqs.items():
+                if abs(freq - prev_freqs[seq]) > (
+                        self.convergence_tolerance * max(freq, prev_freqs[seq])):
+                    return False
+        logging.getLogger().info(
+            "Detected contaminants are stable after %d reads; stopping",
+            n_reads)
+        return True
+
+class Detector(ConvergenceMixin, SingleEndPipelineMixin, Pipeline):
     """Base class for contaminant detectors.
     
     Args:
@@ -304,18 +625,37 @@ class Detector(SingleEndPipelineMixin, Pipeline):
             that is shorter than the read length + adapter length. Those
             bases will be removed from any sequencers before looking for 
             matching contaminants.
+        check_interval: If set, the number of batches between checks of
+            whether the detected contaminants are stable, in which case the
+            detector stops reading before `n_reads` reads. See
+            :class:`ConvergenceMixin`.
+        convergence_tolerance: Maximum relative change in the frequency of a
+            top contaminant between checks for it to be considered stable.
+        sample_size: Maximum number of reads in the :class:`ReadSample` from
+            which the abundance of contaminants is estimated.
     """
+    # Whether contaminants are identified by a pass over all the reads seen so
+    # far, rather than from running counts.
+    rescans_reads = False
+    
     def __init__(
             self, kmer_size=12, n_reads=10000, overrep_cutoff=100,
-            include='all', known_contaminants=None, past_end_bases=('A',)):
+            include='all', known_contaminants=None, past_end_bases=('A',),
+            check_interval=None, convergence_tolerance=0.05,
+            sample_size=10000):
         super().__init__()
         self.kmer_size = kmer_size
         self.n_reads = n_reads
+        self.check_interval = check_interval
+        self.convergence_tolerance = convergence_tolerance
         self.overrep_cutoff = overrep_cutoff
         self.include = include
         self.known_contaminants = known_contaminants
         self._read_length = None
         self._read_sequences = set()
+        self._sample = ReadSample(sample_size)
+        self._batch_index = None
+        self._batch_pos = 0
         self._matches = None
         self._past_end_regexp = None
         if past_end_bases:
@@ -347,7 +687,22 @@ class Detector(SingleEndPipelineMixin, Pipeline):
     def handle_reads(self, context, read1, read2=None):
         seq = self._filter_seq(read1.sequence)
         if seq:
-            self._read_sequences.add(seq)
+            self._add_to_sample(context, seq)
+            self._add_read(seq)
+    
+    def _add_read(self, seq):
+        """Collect information from a filtered read sequence. By default, the
+        read is added to the set of distinct read sequences.
+        """
+        self._read_sequences.add(seq)
+    
+    def _add_to_sample(self, context, seq):
+        batch_index = context['index'] if context else 0
+        if batch_index != self._batch_index:
+            self._batch_index = batch_index
+            self._batch_pos = 0
+        self._sample.add(batch_index, self._batch_pos, seq)
+        self._batch_pos += 1
     
     def _filter_seq(self, seq):
         if sequence_complexity(seq) <= 1.0:
@@ -360,6 +715,21 @@ class Detector(SingleEndPipelineMixin, Pipeline):
             return None
         return seq
     
+    def get_state(self):
+        """Returns the :class:`DetectorState` collected from the reads seen so
+        far.
+        """
+        return DetectorState(
+            self._read_length, self._read_sequences, self._sample)
+    
+    def set_state(self, state):
+        """Replace the collected information with a :class:`DetectorState`.
+        """
+        self._read_length = state.read_length
+        self._read_sequences = state.read_sequences
+        self._sample = state.sample
+        self._matches = None
+    
     def matches(self, **kwargs):
         """Returns the current set of matches.
         """
@@ -384,7 +754,7 @@ class Detector(SingleEndPipelineMixin, Pipeline):
         matches = self._get_contaminants()
         
         for match in matches:
-            match.estimate_abundance(self._read_sequences)
+            match.estimate_abundance(self._sample)
         
         def _filter(match):
             if match.count < self.min_report_freq:
@@ -438,22 +808,45 @@ class Detector(SingleEndPipelineMixin, Pipeline):
         """
         raise NotImplementedError()
     
-    def finish(self, summary, **kwargs):
+    def _detectors(self):
+        return [self]
+    
+    def summarize_matches(self, **kwargs):
+        """Returns a tuple with a list of match summaries.
+        """
+        return ([match.summarize() for match in self.matches(**kwargs)],)
+    
+    def finish(self, summary, worker=None, **kwargs):
         super().finish(summary)
-        summary['detect']['matches'] = ([
-            match.summarize()
-            for match in self.matches(**kwargs)
-        ],)
+        if worker is None:
+            summary['detect']['matches'] = self.summarize_matches(**kwargs)
+        else:
+            # Matches are identified by the main process once the states of
+            # all workers are merged.
+            summary['detect'] = dict(state=self.get_state())
 
-class PairedDetector(PairedEndPipelineMixin, Pipeline):
+class PairedDetector(ConvergenceMixin, PairedEndPipelineMixin, Pipeline):
     """Detector for paired-end reads.
+    
+    Args:
+        detector_class: The :class:`Detector` class to use for each read.
+        check_interval, convergence_tolerance: See :class:`Detector`.
+        kwargs: Additional arguments to pass to the `detector_class`
+            constructor.
     """
-    def __init__(self, detector_class, **kwargs):
+    def __init__(
+            self, detector_class, check_interval=None,
+            convergence_tolerance=0.05, **kwargs):
         super().__init__()
         self.read1_detector = detector_class(**kwargs)
         self.read2_detector = detector_class(**kwargs)
+        self.check_interval = check_interval
+        self.convergence_tolerance = convergence_tolerance
         self._read_length_set = False
     
+    def _detectors(self):
+        return [self.read1_detector, self.read2_detector]
+    
     def handle_records(self, context, records):
         if context['size'] == 0:
             return
@@ -468,15 +861,34 @@ class PairedDetector(PairedEndPipelineMixin, Pipeline):
         self.read1_detector.handle_reads(context, read1)
         self.read2_detector.handle_reads(context, read2)
     
-    def finish(self, summary, **kwargs):
+    def get_state(self):
+        """Returns a tuple of the :class:`DetectorState`s of the read1 and read2
+        detectors.
+        """
+        return (
+            self.read1_detector.get_state(), self.read2_detector.get_state())
+    
+    def set_state(self, state):
+        """Replace the collected information with a tuple of
+        :class:`DetectorState`s.
+        """
+        state1, state2 = state
+        self.read1_detector.set_state(state1)
+        self.read2_detector.set_state(state2)
+    
+    def summarize_matches(self, **kwargs):
+        """Returns a tuple with lists of match summaries for read1 and read2.
+        """
+        return (
+            self.read1_detector.summarize_matches(**kwargs)[0],
+            self.read2_detector.summarize_matches(**kwargs)[0])
+    
+    def finish(self, summary, worker=None, **kwargs):
         super().finish(summary)
-        summary['detect']['matches'] = ([
-            match.summarize()
-            for match in self.read1_detector.matches(**kwargs)
-        ], [
-            match.summarize()
-            for match in self.read2_detector.matches(**kwargs)
-        ])
+        if worker is None:
+            summary['detect']['matches'] = self.summarize_matches(**kwargs)
+        else:
+            summary['detect'] = dict(state=self.get_state())
 
 class KnownContaminantDetector(Detector):
     """Test known contaminants against reads. This has linear complexity and is
@@ -494,6 +906,10 @@ class KnownContaminantDetector(Detector):
         super().__init__(known_contaminants=known_contaminants, **kwargs)
         self.min_kmer_match_frac = min_kmer_match_frac
         self._min_k = min(len(s) for s in known_contaminants.sequences)
+        self._contaminant_index = None
+        self._unmatched = []
+        self._contaminant_reads = defaultdict(int)
+        self._max_match_fracs = defaultdict(int)
     
     @property
     def min_report_freq(self):
@@ -505,20 +921,37 @@ class KnownContaminantDetector(Detector):
             return seq
         return None
     
-    def _get_contaminants(self):
-        contaminant_matchers = create_contaminant_matchers(
-            self.known_contaminants, self.kmer_size)
-        counts = defaultdict(int)
-        max_match_fracs = defaultdict(int)
-        
-        for seq in self._read_sequences:
+    def _add_read(self, seq):
+        if seq not in self._read_sequences:
+            self._read_sequences.add(seq)
+            self._unmatched.append(seq)
+    
+    def set_state(self, state):
+        super().set_state(state)
+        self._contaminant_index = None
+        self._unmatched = list(self._read_sequences)
+        self._contaminant_reads = defaultdict(int)
+        self._max_match_fracs = defaultdict(int)
+    
+    def _match_reads(self):
+        """Match the distinct reads that have not been matched yet against the
+        known contaminants. Each distinct read is matched once, so checks of
+        convergence only match the reads seen since the previous check.
+        """
+        if self._contaminant_index is None:
+            self._contaminant_index = ContaminantIndex(
+                self.known_contaminants, self.kmer_size)
+        for seq in self._unmatched:
             seqrc = reverse_complement(seq)
-            for contam in contaminant_matchers:
-                match = contam.match(seq, seqrc)
+            for contam, match in self._contaminant_index.match(seq, seqrc):
                 if match[0] > self.min_kmer_match_frac:
-                    counts[contam] += 1
-                    if match[0] > max_match_fracs[contam]:
-                        max_match_fracs[contam] = match[0]
+                    self._contaminant_reads[contam] += 1
+                    if match[0] > self._max_match_fracs[contam]:
+                        self._max_match_fracs[contam] = match[0]
+        self._unmatched = []
+    
+    def _get_contaminants(self):
+        self._match_reads()
         
         min_count = math.ceil(
             self.n_reads * (self._read_length - self._min_k + 1) *
@@ -526,19 +959,23 @@ class KnownContaminantDetector(Detector):
         
         return [
             Match(
-                c[0], match_frac=max_match_fracs[c[0]], 
+                c[0], match_frac=self._max_match_fracs[c[0]], 
                 abundance=float(c[1]) / self.n_reads)
             for c in filter(
                 lambda x: x[1] >= min_count,
-                counts.items()
+                self._contaminant_reads.items()
             )
         ]
 
 class HeuristicDetector(Detector):
     """Use a heuristic iterative algorithm to arrive at likely contaminants.
-    This is the most accurate algorithm overall, but it has quadratic complexity
-    and becomes too slow/memory-intenstive when n_reads > 50k.
+    This is the most accurate algorithm overall. Over-represented k-mers are
+    found by :func:`atropos.commands.detect.kmers.find_overrepresented_kmers`,
+    which only keeps track of the occurrences of frequent k-mers, so memory
+    grows with the amount of contamination rather than with n_reads.
     """
+    rescans_reads = True
+    
     def __init__(
             self, min_frequency=0.001, min_contaminant_match_frac=0.9, 
             **kwargs):
@@ -557,58 +994,17 @@ class HeuristicDetector(Detector):
                 (self._read_length - kmer_size + 1) * self.overrep_cutoff /
                 float(4**kmer_size)))
         
-        kmer_size = self.kmer_size
-        kmers = defaultdict(lambda: [0, set()])
-        
-        for seq in self._read_sequences:
-            for i in range(len(seq) - kmer_size + 1):
-                kmer = seq[i:(i+kmer_size)]
-                kmers[kmer][0] += 1
-                kmers[kmer][1].add(seq)
-        
-        prev = None
-        cur = {}
-        results = {}
-        result_seqs = defaultdict(set)
-        min_count = _min_count(kmer_size)
-        
-        # Identify candidate kmers for increasing values of k
-        while True:
-            all_seqs = set()
-            for kmer, (count, seqs) in kmers.items():
-                if count > min_count:
-                    cur[kmer] = (count, seqs)
-                    all_seqs.update(seqs)
-            
-            if len(all_seqs) == 0:
-                break
-            
-            if prev:
-                for kmer, (count, seqs) in prev.items():
-                    if (
-                            not any(seq in cur for seq in seqs) and
-                            sequence_complexity(kmer) > 1.0):
-                        results[kmer] = count
-                        result_seqs[kmer].update(seqs)
-            
-            kmer_size += 1
-            kmers = defaultdict(lambda: [0, set()])
-            for seq in all_seqs:
-                for i in range(len(seq) - kmer_size + 1):
-                    kmer = seq[i:(i+kmer_size)]
-                    kmers[kmer][0] += 1
-                    kmers[kmer][1].add(seq)
-            
-            min_count = _min_count(kmer_size)
-            prev = cur
-            cur = {}
-        
-        results = list(results.items())
+        reads = list(self._read_sequences)
+        results = []
+        result_reads = {}
+        for kmer, count, read_id in find_overrepresented_kmers(
+                reads, self.kmer_size, _min_count):
+            results.append((kmer, count))
+            result_reads[kmer] = reads[read_id]
         
         # Now merge overlapping sequences by length and frequency to eliminate
         # redundancy in the set of candidate kmers.
         results.sort(key=lambda i: len(i[0]) * math.log(i[1]), reverse=True)
-        cur = results[0]
         merged = []
         unmerged = []
         while len(results) > 1:
@@ -644,33 +1040,33 @@ class HeuristicDetector(Detector):
         results = (x for x in results if x[1] >= min_count)
         # Convert to matches
         matches = [
-            Match(x[0], count=x[1], reads=result_seqs[x[0]]) 
+            Match(x[0], count=x[1], reads=(result_reads[x[0]],))
             for x in results]
         
         if self.known_contaminants:
             # Match to known sequences
-            contaminants = create_contaminant_matchers(
+            contaminant_index = ContaminantIndex(
                 self.known_contaminants, self.kmer_size)
             known = {}
             unknown = []
             
             def find_best_match(seq, best_matches, best_match_frac):
-                """Find best contaminant matches to `seq`.
+                """Find best contaminant matches to `seq`. Contaminants are
+                tested in decreasing order of match fractions, so alignment
+                stops at the first contaminant that scores lower than the best
+                match.
                 """
                 seqrc = reverse_complement(seq)
-                for contam in contaminants:
-                    match_frac1, match_frac2, compare_seq = contam.match(
-                        seq, seqrc)
-                    if match_frac1 < best_match_frac[0]:
-                        continue
+                for contam, (match_frac1, match_frac2, compare_seq) in \
+                        contaminant_index.match(seq, seqrc):
+                    if (match_frac1, match_frac2) < best_match_frac:
+                        break
                     if (
                             contam.seq in compare_seq or
                             align(
                                 compare_seq, contam.seq,
                                 self.min_contaminant_match_frac)):
-                        if (match_frac1 > best_match_frac[0] or (
-                                match_frac1 == best_match_frac[0] and
-                                match_frac2 > best_match_frac[1])):
+                        if (match_frac1, match_frac2) > best_match_frac:
                             best_matches = {}
                             best_match_frac = (match_frac1, match_frac2)
                         best_matches[contam] = (
@@ -725,40 +1121,27 @@ class HeuristicDetector(Detector):
         
         return matches
 
-class KhmerDetector(Detector):
-    """Identify contaminants based on kmer frequency using a fast kmer counting
-    approach (as implemented in the khmer library). This approach is fast but
-    not as accurate as the other two.
+class KmerCountDetector(Detector):
+    """Base class for detectors that identify contaminants based on the
+    frequency of individual kmers. These approaches are fast but not as
+    accurate as the heuristic algorithm.
     """
     @property
     def min_report_freq(self):
         return 0.0001
     
-    def _get_contaminants(self):
-        from khmer import Countgraph, khmer_args
-        # assuming all sequences are same length
-        n_win = self._read_length - self.kmer_size + 1
-        tablesize = self.n_reads * n_win
-        countgraph = Countgraph(
-            self.kmer_size, tablesize, khmer_args.DEFAULT_N_TABLES)
-        countgraph.set_use_bigcount(True)
-        
-        for seq in self._read_sequences:
-            countgraph.consume_and_tag(seq)
+    def _count_kmers(self):
+        """Count kmers and select those that are over-represented.
         
-        n_expected = math.ceil(tablesize / float(4**self.kmer_size))
-        min_count = n_expected * self.overrep_cutoff
-        if min_count >= 2**16:
-            raise ValueError(
-                "The minimum count for an over-represented k-kmer {} is "
-                "greater than the max khmer count (2^16)".format(min_count))
+        Returns:
+            Tuple (candidates, total), where candidates is a dict of {kmer:
+            count} and total is the number by which counts are divided to get
+            frequencies.
+        """
+        raise NotImplementedError()
     
-        candidates = {}
-        
-        for tag in countgraph.get_tagset():
-            count = countgraph.get(tag)
-            if count >= min_count:
-                candidates[tag] = count
+    def _get_contaminants(self):
+        candidates, total = self._count_kmers()
         
         if self.known_contaminants:
             matches = []
@@ -796,21 +1179,112 @@ class KhmerDetector(Detector):
                     # not sure what the correct metric is to use here
                     overall_count = sum(match_counts) / float(n_kmers)
                     matches.append(Match(
-                        seq, count=overall_count / float(tablesize), 
+                        seq, count=overall_count / float(total), 
                         names=names, match_frac=float(num_matches) / n_kmers))
             
             # Add remaining tags
             for tag in set(candidates.keys()) - seen:
                 matches.append(Match(
-                    tag, count=candidates[tag] / float(tablesize)))
+                    tag, count=candidates[tag] / float(total)))
         
         else:
             matches = [
-                Match(tag, count=count / float(tablesize))
+                Match(tag, count=count / float(total))
                 for tag, count in candidates.items()]
         
         return matches
 
+class KhmerDetector(KmerCountDetector):
+    """Identify contaminants based on kmer frequency using a fast kmer counting
+    approach (as implemented in the khmer library).
+    """
+    rescans_reads = True
+    
+    def _count_kmers(self):
+        from khmer import Countgraph, khmer_args
+        # assuming all sequences are same length
+        n_win = self._read_length - self.kmer_size + 1
+        tablesize = self.n_reads * n_win
+        countgraph = Countgraph(
+            self.kmer_size, tablesize, khmer_args.DEFAULT_N_TABLES)
+        countgraph.set_use_bigcount(True)
+        
+        for seq in self._read_sequences:
+            countgraph.consume_and_tag(seq)
+        
+        n_expected = math.ceil(tablesize / float(4**self.kmer_size))
+        min_count = n_expected * self.overrep_cutoff
+        if min_count >= 2**16:
+            raise ValueError(
+                "The minimum count for an over-represented k-kmer {} is "
+                "greater than the max khmer count (2^16)".format(min_count))
+    
+        candidates = {}
+        
+        for tag in countgraph.get_tagset():
+            count = countgraph.get(tag)
+            if count >= min_count:
+                candidates[tag] = count
+        
+        return candidates, tablesize
+
+class SketchDetector(KmerCountDetector):
+    """Identify contaminants based on kmer frequency, estimated using a
+    :class:`atropos.commands.detect.kmers.CountMinSketch`. Reads are added to
+    the sketch one batch at a time and are not retained (other than in the
+    bounded :class:`ReadSample`), so the memory used is fixed regardless of
+    the number of reads.
+    
+    Args:
+        sketch_memory: Number of bytes to use for the sketch counters.
+        sketch_depth: Number of rows (hash functions) in the sketch.
+        kwargs: Additional arguments to pass to the :class:`Detector`
+            constructor.
+    """
+    # Number of sequences to add to the sketch at a time.
+    batch_size = 1000
+    
+    def __init__(self, sketch_memory=64 * 2**20, sketch_depth=4, **kwargs):
+        super().__init__(**kwargs)
+        # There are at most 4^k / overrep_cutoff over-represented kmers.
+        capacity = min(max(
+            math.ceil(4**self.kmer_size / self.overrep_cutoff), 2**10), 2**20)
+        self.sketch = CountMinSketch(
+            self.kmer_size, sketch_memory, sketch_depth, capacity)
+        self._batch = []
+    
+    def _add_read(self, seq):
+        self._batch.append(seq)
+        if len(self._batch) >= self.batch_size:
+            self._consume_batch()
+    
+    def _consume_batch(self):
+        if self._batch:
+            self.sketch.consume(self._batch)
+            self._batch = []
+    
+    def get_state(self):
+        self._consume_batch()
+        state = super().get_state()
+        state.sketch = self.sketch
+        return state
+    
+    def set_state(self, state):
+        super().set_state(state)
+        self.sketch = state.sketch
+        self._batch = []
+    
+    def _count_kmers(self):
+        self._consume_batch()
+        total = self.sketch.total
+        n_expected = math.ceil(total / float(4**self.kmer_size))
+        min_count = n_expected * self.overrep_cutoff
+        candidates = dict(
+            (kmer, count)
+            for kmer, count in self.sketch.heavy_hitters()
+            if count >= min_count)
+        return candidates, max(total, 1)
+
 def align(seq1, seq2, min_overlap_frac=0.9):
     """Align two sequences.
     
@@ -0,0 +1,698 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+"""
+Search for over-represented k-mers of increasing length; see
+atropos.commands.detect.kmers.
+
+K-mers of the initial size are first counted in a fixed-size table indexed by
+their 2-bit encoding (or by a hash of the encoding of their last 32 bases,
+when there are more possible k-mers than table entries). A table entry is
+always at least the count of any k-mer that maps to it, so only the k-mers in
+entries whose count is above the tracking threshold need to be counted exactly.
+
+Bases are read from the reads' PackedSequences (atropos.align), which share the
+2-bit codes of atropos.util.encode_kmer.
+"""
+
+from cpython.array cimport array, clone
+from cpython.mem cimport PyMem_Malloc, PyMem_Realloc, PyMem_Free
+from libc.stdint cimport uint32_t, uint64_t
+from libc.string cimport memcpy, memset
+from atropos.align._align cimport PackedSequence
+from atropos.util._util cimport _ascii_buffer
+from atropos.util import sequence_complexity
+
+cdef inline unsigned char _base_code(
+        const uint64_t* bases, const uint64_t* mask, const unsigned char* seq,
+        Py_ssize_t pos):
+    # The code of the base at `pos` in a k-mer, from the read's packed bases
+    # and mask: the 2-bit code of A, C, G or T; 4 = N; 5 = a character that
+    # cannot be part of a k-mer.
+    if (mask[pos >> 6] >> (pos & 63)) & 1:
+        return 4 if seq[pos] == b'N' else 5
+    return (bases[pos >> 5] >> (2 * (pos & 31))) & 3
+
+cdef uint32_t MAX_COUNT = 0xFFFFFFFFU
+cdef uint64_t HASH_MULTIPLIER = 0x9E3779B97F4A7C15ULL
+
+cdef class Occurrences:
+    """Growable arrays of k-mer occurrences (read id, position, k-mer id),
+    in order of read id and position.
+    """
+    cdef uint32_t* read_ids
+    cdef uint32_t* positions
+    cdef uint32_t* kmer_ids
+    cdef Py_ssize_t size
+    cdef Py_ssize_t capacity
+
+    def __cinit__(self):
+        self.read_ids = self.positions = self.kmer_ids = NULL
+        self.size = self.capacity = 0
+
+    def __dealloc__(self):
+        PyMem_Free(self.read_ids)
+        PyMem_Free(self.positions)
+        PyMem_Free(self.kmer_ids)
+
+    def __len__(self):
+        return self.size
+
+    cdef int append(
+            self, uint32_t read_id, uint32_t pos, uint32_t kmer_id) except -1:
+        cdef Py_ssize_t capacity
+        if self.size == self.capacity:
+            capacity = max(1024, 2 * self.capacity)
+            self.read_ids = <uint32_t*>_realloc(self.read_ids, capacity)
+            self.positions = <uint32_t*>_realloc(self.positions, capacity)
+            self.kmer_ids = <uint32_t*>_realloc(self.kmer_ids, capacity)
+            self.capacity = capacity
+        self.read_ids[self.size] = read_id
+        self.positions[self.size] = pos
+        self.kmer_ids[self.size] = kmer_id
+        self.size += 1
+        return 0
+
+cdef void* _realloc(void* ptr, Py_ssize_t n) except NULL:
+    ptr = PyMem_Realloc(ptr, n * sizeof(uint32_t))
+    if ptr == NULL:
+        raise MemoryError()
+    return ptr
+
+cdef class Reads:
+    """Buffers, packed sequences and lengths of the read sequences.
+    """
+    cdef list reads
+    cdef list packed
+    cdef const unsigned char** buffers
+    cdef uint32_t* lengths
+    cdef Py_ssize_t size
+
+    def __cinit__(self, list reads):
+        cdef Py_ssize_t i
+        self.reads = reads
+        self.packed = [PackedSequence(read) for read in reads]
+        self.size = len(reads)
+        self.buffers = <const unsigned char**>PyMem_Malloc(
+            max(1, self.size) * sizeof(const unsigned char*))
+        self.lengths = <uint32_t*>PyMem_Malloc(
+            max(1, self.size) * sizeof(uint32_t))
+        if self.buffers == NULL or self.lengths == NULL:
+            raise MemoryError()
+        for i in range(self.size):
+            self.buffers[i] = _ascii_buffer(reads[i])
+            self.lengths[i] = len(reads[i])
+
+    def __dealloc__(self):
+        PyMem_Free(self.buffers)
+        PyMem_Free(self.lengths)
+
+def find_overrepresented_kmers(
+        list reads, int kmer_size, min_count, int table_bits=24):
+    """Find over-represented k-mers of increasing length.
+
+    Args:
+        reads: List of read sequences. The id of a read is its index in the
+            list.
+        kmer_size: The initial k-mer size.
+        min_count: Function that returns, for a given k-mer size, the count
+            a k-mer must exceed to be over-represented.
+        table_bits: Log2 of the number of entries in the table used to count
+            k-mers of the initial size.
+
+    Returns:
+        A list of tuples (kmer, count, read_id), in order of increasing
+        k-mer size, of the over-represented k-mers with sequence complexity
+        > 1.0 that are extended by an over-represented k-mer of the next
+        size. read_id is the id of the read with the earliest occurrence of
+        the k-mer.
+    """
+    cdef Reads _reads = Reads(reads)
+    cdef Py_ssize_t max_len = 0
+    cdef Py_ssize_t i, j, n_kmers
+    cdef long long track_count, threshold
+    cdef uint32_t read_id, pos, kmer_id
+    cdef Occurrences occurrences
+    cdef array counts, frequent, best_reads, best_positions, active
+    cdef bint any_frequent
+
+    for i in range(_reads.size):
+        if _reads.lengths[i] > max_len:
+            max_len = _reads.lengths[i]
+    if max_len < kmer_size:
+        return []
+    # A k-mer that is over-represented at some size > k has over-represented
+    # k-mers as its prefix and suffix only if k-mers are tracked down to the
+    # lowest threshold of any size.
+    track_count = min(min_count(k) for k in range(kmer_size, max_len + 1))
+
+    kmers, counts, occurrences = _count_initial_kmers(
+        _reads, kmer_size, track_count, table_bits)
+
+    results = []
+    prev = None
+    prev_whole = None
+    active = clone(array('b'), max(1, _reads.size), False)
+    while True:
+        n_kmers = len(kmers)
+        threshold = min_count(kmer_size)
+        frequent = clone(array('b'), max(1, n_kmers), True)
+        any_frequent = False
+        for i in range(n_kmers):
+            if counts.data.as_uints[i] > threshold:
+                frequent.data.as_schars[i] = 1
+                any_frequent = True
+        if not any_frequent:
+            break
+
+        if prev:
+            # A k-mer is not reported if one of the reads that contain it is
+            # itself an over-represented (k+1)-mer.
+            whole_reads = set()
+            for j in range(occurrences.size):
+                read_id = occurrences.read_ids[j]
+                if (
+                        occurrences.positions[j] == 0 and
+                        frequent.data.as_schars[occurrences.kmer_ids[j]] and
+                        _reads.lengths[read_id] == kmer_size):
+                    whole_reads.add(read_id)
+            excluded = set(
+                prev_id for prev_read_id, prev_id in prev_whole
+                if prev_read_id in whole_reads)
+            for prev_id, kmer, count, best_read in prev:
+                if (
+                        prev_id not in excluded and
+                        sequence_complexity(kmer) > 1.0):
+                    results.append((kmer, count, best_read))
+
+        best_reads = clone(array('I'), max(1, n_kmers), False)
+        best_positions = clone(array('I'), max(1, n_kmers), False)
+        for i in range(n_kmers):
+            best_positions.data.as_uints[i] = MAX_COUNT
+        memset(active.data.as_chars, 0, max(1, _reads.size))
+        prev_whole = []
+        for j in range(occurrences.size):
+            kmer_id = occurrences.kmer_ids[j]
+            if not frequent.data.as_schars[kmer_id]:
+                continue
+            read_id = occurrences.read_ids[j]
+            pos = occurrences.positions[j]
+            active.data.as_schars[read_id] = 1
+            if pos < best_positions.data.as_uints[kmer_id]:
+                best_positions.data.as_uints[kmer_id] = pos
+                best_reads.data.as_uints[kmer_id] = read_id
+            if _reads.lengths[read_id] == kmer_size + 1:
+                prev_whole.append((read_id, kmer_id))
+        prev = [
+            (i, kmers[i], counts.data.as_uints[i], best_reads.data.as_uints[i])
+            for i in range(n_kmers)
+            if frequent.data.as_schars[i]]
+
+        kmers, counts, occurrences = _extend_kmers(
+            _reads, kmer_size, occurrences, n_kmers, active, track_count)
+        kmer_size += 1
+
+    return results
+
+cdef tuple _count_initial_kmers(
+        Reads reads, int kmer_size, long long track_count, int table_bits):
+    cdef int code_size = min(kmer_size, 32)
+    cdef uint64_t code_mask = 0xFFFFFFFFFFFFFFFFULL
+    cdef bint direct = 2 * kmer_size <= table_bits
+    cdef Py_ssize_t table_size
+    cdef array table
+    cdef uint32_t* table_counts
+    cdef uint64_t code, bucket
+    cdef Py_ssize_t read_id, pos, start, last_invalid, last_n, n_ids
+    cdef const unsigned char* seq
+    cdef PackedSequence packed
+    cdef unsigned char base
+    cdef bint counting
+    cdef Occurrences candidates = Occurrences()
+    cdef Occurrences occurrences = Occurrences()
+    cdef array id_counts, new_ids, counts
+    cdef Py_ssize_t j
+    cdef uint32_t kmer_id
+
+    if code_size < 32:
+        code_mask = (1ULL << (2 * code_size)) - 1
+    if direct:
+        table_bits = 2 * kmer_size
+    table_size = 1 << table_bits
+    table = clone(array('I'), table_size, True)
+    table_counts = table.data.as_uints
+
+    # The first pass counts k-mers in the table and the second pass counts
+    # the k-mers in entries with a count above the tracking threshold.
+    kmer_ids = {}
+    first_positions = []
+    for counting in (True, False):
+        for read_id in range(reads.size):
+            seq = reads.buffers[read_id]
+            packed = reads.packed[read_id]
+            code = 0
+            last_invalid = last_n = -1
+            for pos in range(reads.lengths[read_id]):
+                base = _base_code(packed.bases, packed.mask, seq, pos)
+                if base == 5:
+                    last_invalid = pos
+                    base = 0
+                elif base == 4:
+                    last_n = pos
+                    base = 0
+                code = ((code << 2) | base) & code_mask
+                if pos - last_invalid < kmer_size:
+                    continue
+                if direct:
+                    bucket = code
+                else:
+                    bucket = (code * HASH_MULTIPLIER) >> (64 - table_bits)
+                if counting:
+                    if table_counts[bucket] < MAX_COUNT:
+                        table_counts[bucket] += 1
+                elif table_counts[bucket] > track_count:
+                    start = pos - kmer_size + 1
+                    if kmer_size <= 32 and pos - last_n >= kmer_size:
+                        key = code
+                    else:
+                        key = reads.reads[read_id][start:(pos + 1)]
+                    kmer_id = kmer_ids.setdefault(key, len(kmer_ids))
+                    if kmer_id == len(first_positions):
+                        first_positions.append((read_id, start))
+                    candidates.append(read_id, start, kmer_id)
+    table = None
+
+    # Exact counts of the candidate k-mers; keep those above the threshold.
+    n_ids = len(kmer_ids)
+    id_counts = clone(array('I'), max(1, n_ids), True)
+    for j in range(candidates.size):
+        id_counts.data.as_uints[candidates.kmer_ids[j]] += 1
+    new_ids = clone(array('I'), max(1, n_ids), False)
+    kmers = []
+    counts = array('I')
+    for j in range(n_ids):
+        if id_counts.data.as_uints[j] > track_count:
+            new_ids.data.as_uints[j] = len(kmers)
+            read_id, start = first_positions[j]
+            kmers.append(reads.reads[read_id][start:(start + kmer_size)])
+            counts.append(id_counts.data.as_uints[j])
+        else:
+            new_ids.data.as_uints[j] = MAX_COUNT
+    for j in range(candidates.size):
+        kmer_id = new_ids.data.as_uints[candidates.kmer_ids[j]]
+        if kmer_id != MAX_COUNT:
+            occurrences.append(
+                candidates.read_ids[j], candidates.positions[j], kmer_id)
+    return kmers, counts, occurrences
+
+cdef tuple _extend_kmers(
+        Reads reads, int kmer_size, Occurrences occurrences,
+        Py_ssize_t n_kmers, array active, long long track_count):
+    # Occurrences are sorted by read and position, so the occurrence of the
+    # suffix of an extended k-mer is the one that follows the occurrence of its
+    # prefix. Extended k-mers are identified by the id of their prefix and
+    # the code of their last base.
+    cdef Py_ssize_t n_keys = 5 * n_kmers
+    cdef array key_counts = clone(array('I'), max(1, n_keys), True)
+    cdef array new_ids = clone(array('I'), max(1, n_keys), False)
+    cdef uint32_t* keys = <uint32_t*>PyMem_Malloc(
+        max(1, occurrences.size) * sizeof(uint32_t))
+    cdef Occurrences new_occurrences = Occurrences()
+    cdef Py_ssize_t j
+    cdef uint32_t read_id, pos, key, kmer_id
+    cdef uint32_t no_key = MAX_COUNT
+    cdef PackedSequence packed
+    if keys == NULL:
+        raise MemoryError()
+    kmers = []
+    counts = array('I')
+    try:
+        for j in range(occurrences.size):
+            keys[j] = no_key
+            read_id = occurrences.read_ids[j]
+            if not active.data.as_schars[read_id] or j + 1 == occurrences.size:
+                continue
+            pos = occurrences.positions[j]
+            if (
+                    occurrences.read_ids[j + 1] == read_id and
+                    occurrences.positions[j + 1] == pos + 1):
+                packed = reads.packed[read_id]
+                key = 5 * occurrences.kmer_ids[j] + _base_code(
+                    packed.bases, packed.mask, reads.buffers[read_id],
+                    pos + kmer_size)
+                keys[j] = key
+                key_counts.data.as_uints[key] += 1
+        for j in range(n_keys):
+            new_ids.data.as_uints[j] = no_key
+        for j in range(occurrences.size):
+            key = keys[j]
+            if key == no_key or key_counts.data.as_uints[key] <= track_count:
+                continue
+            read_id = occurrences.read_ids[j]
+            pos = occurrences.positions[j]
+            kmer_id = new_ids.data.as_uints[key]
+            if kmer_id == no_key:
+                kmer_id = new_ids.data.as_uints[key] = len(kmers)
+                kmers.append(
+                    reads.reads[read_id][pos:(pos + kmer_size + 1)])
+                counts.append(key_counts.data.as_uints[key])
+            new_occurrences.append(read_id, pos, kmer_id)
+    finally:
+        PyMem_Free(keys)
+    return kmers, counts, new_occurrences
+
+cdef uint64_t _mix(uint64_t x):
+    # splitmix64 finalizer
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL
+    return x ^ (x >> 31)
+
+cdef class CountMinSketch:
+    """Estimates the counts of k-mers with a count-min sketch, and keeps track
+    of the k-mers with the highest estimated counts.
+
+    The sketch is a table of `depth` rows of 32-bit counters. Each row has its
+    own hash function, and the estimated count of a k-mer is the minimum of
+    its counters. Counters are updated conservatively: only the counters that
+    are below the new estimate are increased, which reduces the overestimation
+    caused by collisions.
+
+    The heavy hitters are kept in a min-heap of at most `capacity` k-mers,
+    ordered by estimated count, with a hash table from k-mer code to heap
+    position. A k-mer that is not in the heap replaces the heap's minimum when
+    its estimate exceeds it.
+
+    K-mers that contain a base other than A, C, G or T are not counted.
+
+    Args:
+        kmer_size: The k-mer size; must be between 1 and 32.
+        memory: The number of bytes to use for the counters.
+        depth: The number of rows.
+        capacity: The maximum number of heavy hitters.
+    """
+    cdef readonly int kmer_size
+    cdef readonly int depth
+    cdef readonly Py_ssize_t width
+    cdef readonly Py_ssize_t capacity
+    cdef readonly unsigned long long total
+    cdef uint32_t* counters
+    cdef uint64_t* seeds
+    cdef Py_ssize_t* indexes
+    cdef uint64_t* heap_codes
+    cdef uint32_t* heap_counts
+    cdef Py_ssize_t* heap_slots
+    cdef Py_ssize_t heap_size
+    cdef uint64_t* index_codes
+    cdef Py_ssize_t* index_positions
+    cdef uint64_t index_mask
+
+    def __cinit__(
+            self, int kmer_size, Py_ssize_t memory=64 * 2**20, int depth=4,
+            Py_ssize_t capacity=2**16):
+        cdef Py_ssize_t i, index_size = 1
+        if not 1 <= kmer_size <= 32:
+            raise ValueError("kmer_size must be between 1 and 32")
+        if depth < 1 or capacity < 1:
+            raise ValueError("depth and capacity must be >= 1")
+        self.kmer_size = kmer_size
+        self.depth = depth
+        self.capacity = capacity
+        self.width = memory // (depth * sizeof(uint32_t))
+        if not 1 <= self.width < 2**32:
+            raise ValueError("memory must be between {} and {} bytes".format(
+                depth * sizeof(uint32_t), depth * sizeof(uint32_t) * 2**32))
+        while index_size < 2 * capacity:
+            index_size <<= 1
+        self.index_mask = index_size - 1
+        self.counters = <uint32_t*>PyMem_Malloc(
+            self.width * depth * sizeof(uint32_t))
+        self.seeds = <uint64_t*>PyMem_Malloc(depth * sizeof(uint64_t))
+        self.indexes = <Py_ssize_t*>PyMem_Malloc(depth * sizeof(Py_ssize_t))
+        self.heap_codes = <uint64_t*>PyMem_Malloc(capacity * sizeof(uint64_t))
+        self.heap_counts = <uint32_t*>PyMem_Malloc(capacity * sizeof(uint32_t))
+        self.heap_slots = <Py_ssize_t*>PyMem_Malloc(
+            capacity * sizeof(Py_ssize_t))
+        self.index_codes = <uint64_t*>PyMem_Malloc(
+            index_size * sizeof(uint64_t))
+        self.index_positions = <Py_ssize_t*>PyMem_Malloc(
+            index_size * sizeof(Py_ssize_t))
+        if (
+                self.counters == NULL or self.seeds == NULL or
+                self.indexes == NULL or
+                self.heap_codes == NULL or self.heap_counts == NULL or
+                self.heap_slots == NULL or self.index_codes == NULL or
+                self.index_positions == NULL):
+            raise MemoryError()
+        memset(self.counters, 0, self.width * depth * sizeof(uint32_t))
+        for i in range(depth):
+            self.seeds[i] = _mix(i + 1) | 1
+        self._clear_heavy_hitters()
+        self.total = 0
+
+    def __dealloc__(self):
+        PyMem_Free(self.counters)
+        PyMem_Free(self.seeds)
+        PyMem_Free(self.indexes)
+        PyMem_Free(self.heap_codes)
+        PyMem_Free(self.heap_counts)
+        PyMem_Free(self.heap_slots)
+        PyMem_Free(self.index_codes)
+        PyMem_Free(self.index_positions)
+
+    def consume(self, seqs):
+        """Count the k-mers in a batch of sequences.
+        """
+        cdef PackedSequence packed
+        cdef Py_ssize_t pos, last_invalid
+        cdef uint64_t code, code_mask = 0xFFFFFFFFFFFFFFFFULL
+        if self.kmer_size < 32:
+            code_mask = (1ULL << (2 * self.kmer_size)) - 1
+        for read in seqs:
+            packed = PackedSequence(read)
+            code = 0
+            last_invalid = -1
+            for pos in range(packed.length):
+                if (packed.mask[pos >> 6] >> (pos & 63)) & 1:
+                    last_invalid = pos
+                code = ((code << 2) | (
+                    (packed.bases[pos >> 5] >> (2 * (pos & 31))) & 3)
+                ) & code_mask
+                if pos - last_invalid >= self.kmer_size:
+                    self._add(code)
+
+    def get(self, str kmer):
+        """Returns the estimated count of a k-mer.
+        """
+        cdef PackedSequence packed
+        if len(kmer) != self.kmer_size:
+            raise ValueError("Expected a k-mer of size {}".format(
+                self.kmer_size))
+        packed = PackedSequence(kmer)
+        if packed.ambiguous:
+            return 0
+        return self._estimate(packed.kmers(self.kmer_size)[0])
+
+    def heavy_hitters(self):
+        """Returns a list of tuples (kmer, estimated count) of the k-mers with
+        the highest estimated counts, in decreasing order of count.
+        """
+        cdef Py_ssize_t i
+        result = [
+            (_decode(self.heap_codes[i], self.kmer_size), self.heap_counts[i])
+            for i in range(self.heap_size)]
+        result.sort(key=lambda x: (-x[1], x[0]))
+        return result
+
+    def merge(self, CountMinSketch other):
+        """Add the counts of another sketch with the same dimensions to this
+        sketch. The heavy hitters of both sketches are re-ranked by their
+        estimated counts in the merged sketch.
+        """
+        cdef Py_ssize_t i, n_codes
+        cdef uint64_t total
+        cdef uint64_t* codes
+        if (
+                other.kmer_size != self.kmer_size or
+                other.depth != self.depth or other.width != self.width):
+            raise ValueError("Cannot merge sketches of different sizes")
+        for i in range(self.width * self.depth):
+            total = <uint64_t>self.counters[i] + other.counters[i]
+            self.counters[i] = MAX_COUNT if total > MAX_COUNT else total
+        self.total += other.total
+        n_codes = self.heap_size + other.heap_size
+        codes = <uint64_t*>PyMem_Malloc(n_codes * sizeof(uint64_t))
+        if codes == NULL:
+            raise MemoryError()
+        memcpy(codes, self.heap_codes, self.heap_size * sizeof(uint64_t))
+        memcpy(
+            codes + self.heap_size, other.heap_codes,
+            other.heap_size * sizeof(uint64_t))
+        self._clear_heavy_hitters()
+        for i in range(n_codes):
+            self._update_heavy_hitters(codes[i], self._estimate(codes[i]))
+        PyMem_Free(codes)
+        return self
+
+    def __reduce__(self):
+        return (
+            CountMinSketch,
+            (self.kmer_size, self.width * self.depth * sizeof(uint32_t),
+             self.depth, self.capacity),
+            self.__getstate__())
+
+    def __getstate__(self):
+        cdef Py_ssize_t i
+        return (
+            self.total,
+            (<char*>self.counters)[:self.width * self.depth * sizeof(uint32_t)],
+            [self.heap_codes[i] for i in range(self.heap_size)],
+            [self.heap_counts[i] for i in range(self.heap_size)])
+
+    def __setstate__(self, state):
+        cdef bytes counters
+        cdef Py_ssize_t pos
+        self.total, counters, codes, counts = state
+        memcpy(self.counters, <char*>counters, len(counters))
+        self._clear_heavy_hitters()
+        for pos in range(len(codes)):
+            self.heap_codes[pos] = codes[pos]
+            self.heap_counts[pos] = counts[pos]
+            self.heap_slots[pos] = self._insert(codes[pos], pos)
+        self.heap_size = len(codes)
+
+    cdef void _clear_heavy_hitters(self):
+        cdef Py_ssize_t i
+        for i in range(self.index_mask + 1):
+            self.index_positions[i] = -1
+        self.heap_size = 0
+
+    cdef inline Py_ssize_t _counter(self, int row, uint64_t code):
+        # The top 32 bits of a multiply-shift hash, scaled to the row width.
+        cdef uint64_t hashed = (
+            ((code ^ self.seeds[row]) * self.seeds[row]) >> 32)
+        return row * self.width + <Py_ssize_t>((hashed * self.width) >> 32)
+
+    cdef uint32_t _estimate(self, uint64_t code):
+        cdef int row
+        cdef uint32_t count, estimate = MAX_COUNT
+        for row in range(self.depth):
+            count = self.counters[self._counter(row, code)]
+            if count < estimate:
+                estimate = count
+        return estimate
+
+    cdef void _add(self, uint64_t code):
+        cdef int row
+        cdef uint32_t estimate = MAX_COUNT
+        cdef Py_ssize_t* indexes = self.indexes
+        for row in range(self.depth):
+            indexes[row] = self._counter(row, code)
+            if self.counters[indexes[row]] < estimate:
+                estimate = self.counters[indexes[row]]
+        if estimate < MAX_COUNT:
+            estimate += 1
+            for row in range(self.depth):
+                if self.counters[indexes[row]] < estimate:
+                    self.counters[indexes[row]] = estimate
+        self.total += 1
+        self._update_heavy_hitters(code, estimate)
+
+    cdef void _update_heavy_hitters(self, uint64_t code, uint32_t count):
+        cdef Py_ssize_t slot = self._find(code)
+        cdef Py_ssize_t pos
+        if slot >= 0:
+            pos = self.index_positions[slot]
+            self.heap_counts[pos] = count
+            self._sift_down(pos)
+        elif self.heap_size < self.capacity:
+            pos = self.heap_size
+            self.heap_size += 1
+            self.heap_codes[pos] = code
+            self.heap_counts[pos] = count
+            self.heap_slots[pos] = self._insert(code, pos)
+            self._sift_up(pos)
+        elif count > self.heap_counts[0]:
+            self._delete(self.heap_slots[0])
+            self.heap_codes[0] = code
+            self.heap_counts[0] = count
+            self.heap_slots[0] = self._insert(code, 0)
+            self._sift_down(0)
+
+    cdef inline Py_ssize_t _slot(self, uint64_t code):
+        return <Py_ssize_t>(_mix(code) & self.index_mask)
+
+    cdef Py_ssize_t _find(self, uint64_t code):
+        cdef Py_ssize_t slot = self._slot(code)
+        while self.index_positions[slot] >= 0:
+            if self.index_codes[slot] == code:
+                return slot
+            slot = (slot + 1) & self.index_mask
+        return -1
+
+    cdef Py_ssize_t _insert(self, uint64_t code, Py_ssize_t pos):
+        cdef Py_ssize_t slot = self._slot(code)
+        while self.index_positions[slot] >= 0:
+            slot = (slot + 1) & self.index_mask
+        self.index_codes[slot] = code
+        self.index_positions[slot] = pos
+        return slot
+
+    cdef void _delete(self, Py_ssize_t slot):
+        # Backward-shift deletion for linear probing.
+        cdef Py_ssize_t nxt = slot, home
+        while True:
+            nxt = (nxt + 1) & self.index_mask
+            if self.index_positions[nxt] < 0:
+                break
+            home = self._slot(self.index_codes[nxt])
+            if ((nxt - home) & self.index_mask) >= (
+                    (nxt - slot) & self.index_mask):
+                self.index_codes[slot] = self.index_codes[nxt]
+                self.index_positions[slot] = self.index_positions[nxt]
+                self.heap_slots[self.index_positions[slot]] = slot
+                slot = nxt
+        self.index_positions[slot] = -1
+
+    cdef void _swap(self, Py_ssize_t i, Py_ssize_t j):
+        cdef uint64_t code = self.heap_codes[i]
+        cdef uint32_t count = self.heap_counts[i]
+        cdef Py_ssize_t slot = self.heap_slots[i]
+        self.heap_codes[i] = self.heap_codes[j]
+        self.heap_counts[i] = self.heap_counts[j]
+        self.heap_slots[i] = self.heap_slots[j]
+        self.heap_codes[j] = code
+        self.heap_counts[j] = count
+        self.heap_slots[j] = slot
+        self.index_positions[self.heap_slots[i]] = i
+        self.index_positions[self.heap_slots[j]] = j
+
+    cdef void _sift_up(self, Py_ssize_t pos):
+        cdef Py_ssize_t parent
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if self.heap_counts[parent] <= self.heap_counts[pos]:
+                break
+            self._swap(parent, pos)
+            pos = parent
+
+    cdef void _sift_down(self, Py_ssize_t pos):
+        cdef Py_ssize_t child
+        while True:
+            child = 2 * pos + 1
+            if child >= self.heap_size:
+                break
+            if (
+                    child + 1 < self.heap_size and
+                    self.heap_counts[child + 1] < self.heap_counts[child]):
+                child += 1
+            if self.heap_counts[pos] <= self.heap_counts[child]:
+                break
+            self._swap(pos, child)
+            pos = child
+
+cdef str _decode(uint64_t code, int kmer_size):
+    cdef bytearray kmer = bytearray(kmer_size)
+    cdef int i
+    for i in range(kmer_size - 1, -1, -1):
+        kmer[i] = b'ACGT'[code & 3]
+        code >>= 2
+    return kmer.decode('ascii')
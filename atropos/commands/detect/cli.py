@@ -2,8 +2,8 @@
 """
 from atropos.io import STDOUT, STDERR
 from atropos.commands.cli import (
-    BaseCommandParser, positive, readable_url, writeable_file,
-    readwriteable_file, probability)
+    BaseCommandParser, configure_threads, positive, readable_url,
+    writeable_file, readwriteable_file, probability, int_or_str)
 
 class CommandParser(BaseCommandParser):
     name = 'detect'
@@ -27,9 +27,10 @@ you don't know what are the adapter sequences.
         group.add_argument(
             "-d",
             "--detector",
-            choices=('known', 'heuristic', 'khmer'), default=None,
+            choices=('known', 'heuristic', 'sketch', 'khmer'), default=None,
             help="Which detector to use. (automatically choose based on other "
-                 "options)")
+                 "options: 'heuristic' for up to 50000 reads, otherwise "
+                 "'sketch')")
         group.add_argument(
             "-k",
             "--kmer-size",
@@ -44,6 +45,21 @@ you don't know what are the adapter sequences.
                  "length. Those bases will be removed from any sequencers "
                  "before looking for matching contaminants. Can also be a "
                  "regular expression.")
+        group.add_argument(
+            "--check-interval",
+            type=positive(), default=None, metavar="BATCHES",
+            help="Identify contaminants every BATCHES batches of reads, and "
+                 "stop reading once the top contaminants and their "
+                 "frequencies are stable. The heuristic and khmer detectors "
+                 "are also only checked once the number of reads has grown "
+                 "by 25%% since the previous check. (always read --max-reads "
+                 "reads)")
+        group.add_argument(
+            "--convergence-tolerance",
+            type=probability, default=0.05, metavar="TOL",
+            help="Maximum relative change in the frequency of a top "
+                 "contaminant between checks for detection to stop early. "
+                 "(0.05)")
         group.add_argument(
             "-i",
             "--include-contaminants",
@@ -98,6 +114,37 @@ you don't know what are the adapter sequences.
             help="Minimum fraction of nucleotides that must align for a "
                  "detected contaminant to match a known adapter sequence.")
         
+        group = self.add_group("Sketch Detector Options")
+        group.add_argument(
+            "--sketch-memory",
+            type=int_or_str, default="64M", metavar="SIZE",
+            help="Memory to use for k-mer counters. Can use K/M/G suffixes. "
+                 "(64M)")
+        group.add_argument(
+            "--sketch-depth",
+            type=positive(), default=4,
+            help="Number of hash functions used to count k-mers. (4)")
+        
+        group = self.add_group(
+            "Parallel", title="Parallel (multi-core) options")
+        group.add_argument(
+            "-T",
+            "--threads",
+            type=positive(int, True), default=None, metavar="THREADS",
+            help="Number of threads to use for filtering reads and counting "
+                 "k-mers. Set to 0 to use max available threads. (Do not use "
+                 "multithreading)")
+        group.add_argument(
+            "--process-timeout",
+            type=positive(int, True), default=60, metavar="SECONDS",
+            help="Number of seconds process should wait before escalating "
+                 "messages to ERROR level. (60)")
+        group.add_argument(
+            "--read-queue-size",
+            type=int_or_str, default=None, metavar="SIZE",
+            help="Size of queue for batches of reads to be processed. "
+                 "(THREADS * 100)")
+        
         group = self.add_group("Output")
         group.add_argument(
             "-o",
@@ -135,6 +182,20 @@ you don't know what are the adapter sequences.
                  "(report all)")
     
     def validate_command_options(self, options):
+        if options.detector == 'sketch' and options.kmer_size > 32:
+            self.parser.error(
+                "The sketch detector requires --kmer-size <= 32")
+        if options.threads is not None:
+            if options.check_interval:
+                self.parser.error(
+                    "--check-interval cannot be used with --threads")
+            threads = configure_threads(options, self.parser)
+            if options.read_queue_size is None:
+                options.read_queue_size = threads * 100
+            elif (
+                    options.read_queue_size > 0 and
+                    options.read_queue_size < threads):
+                self.parser.error("Read queue size must be >= than 'threads'")
         options.report_file = options.output
         is_std = options.report_file in (STDOUT, STDERR)
         if options.fasta:
@@ -0,0 +1,342 @@
+"""Search for over-represented k-mers of increasing length.
+
+This is the k-mer search used by the heuristic contaminant detector. At the
+initial k-mer size, the k-mers of all reads are counted. At each following
+size k+1, k-mers are only counted in the reads that contain an over-represented
+k-mer, and the search stops at the first size at which no k-mer is
+over-represented.
+
+Rather than recounting all the (k+1)-mers of those reads, k-mers are grown by
+extension: a (k+1)-mer can only be over-represented if both the k-mer it starts
+with and the k-mer it ends with occur at least as often, so the only
+(k+1)-mers that are counted are those formed by two overlapping k-mers at
+adjacent positions of a read. The k-mers being tracked at each size are
+recorded as a list of occurrences - (read id, position, k-mer id) - in which
+read ids are indexes into the list of reads, so memory is bounded by the
+number of occurrences of frequent k-mers rather than by the number of distinct
+k-mers in the reads.
+
+K-mers that contain a character other than A, C, G, T or N are not counted.
+
+The contaminant detector for large samples instead estimates k-mer counts with
+a :class:`CountMinSketch`, which uses a fixed amount of memory regardless of the
+number of reads.
+"""
+# Import cythonized functions, defaulting to pure python implementations.
+try:
+    from ._kmers import find_overrepresented_kmers, CountMinSketch
+
+except ImportError:
+    from array import array
+    import logging
+    import re
+    from collections import defaultdict
+    from atropos.align import PackedSequence
+    from atropos.util import sequence_complexity, decode_kmer
+
+    logging.getLogger().debug("Import failed for cythonized kmer functions")
+
+    def find_overrepresented_kmers(reads, kmer_size, min_count):
+        """Find over-represented k-mers of increasing length.
+
+        Args:
+            reads: List of read sequences. The id of a read is its index in the
+                list.
+            kmer_size: The initial k-mer size.
+            min_count: Function that returns, for a given k-mer size, the count
+                a k-mer must exceed to be over-represented.
+
+        Returns:
+            A list of tuples (kmer, count, read_id), in order of increasing
+            k-mer size, of the over-represented k-mers with sequence complexity
+            > 1.0 that are extended by an over-represented k-mer of the next
+            size. read_id is the id of the read with the earliest occurrence of
+            the k-mer.
+        """
+        track_count = _track_count(reads, kmer_size, min_count)
+        if track_count is None:
+            return []
+        kmers, counts, occurrences = _count_initial_kmers(
+            reads, kmer_size, track_count)
+
+        results = []
+        prev = None
+        prev_whole = None
+        while True:
+            threshold = min_count(kmer_size)
+            frequent = [count > threshold for count in counts]
+            if not any(frequent):
+                break
+
+            if prev:
+                # A k-mer is not reported if one of the reads that contain it is
+                # itself an over-represented (k+1)-mer.
+                whole_reads = set(
+                    read_id for read_id, pos, kmer_id in occurrences
+                    if pos == 0 and frequent[kmer_id] and
+                    len(reads[read_id]) == kmer_size)
+                excluded = set(
+                    kmer_id for read_id, kmer_id in prev_whole
+                    if read_id in whole_reads)
+                for kmer_id, (kmer, count, read_id) in prev:
+                    if (
+                            kmer_id not in excluded and
+                            sequence_complexity(kmer) > 1.0):
+                        results.append((kmer, count, read_id))
+
+            earliest = {}
+            for read_id, pos, kmer_id in occurrences:
+                if frequent[kmer_id] and (
+                        kmer_id not in earliest or
+                        pos < earliest[kmer_id][1]):
+                    earliest[kmer_id] = (read_id, pos)
+            prev = [
+                (kmer_id, (kmers[kmer_id], counts[kmer_id], read_id))
+                for kmer_id, (read_id, pos) in sorted(earliest.items())]
+            prev_whole = [
+                (read_id, kmer_id)
+                for read_id, pos, kmer_id in occurrences
+                if frequent[kmer_id] and len(reads[read_id]) == kmer_size + 1]
+
+            active = set(
+                read_id for read_id, pos, kmer_id in occurrences
+                if frequent[kmer_id])
+            occurrences = [occ for occ in occurrences if occ[0] in active]
+            kmers, counts, occurrences = _extend_kmers(
+                reads, kmer_size, occurrences, track_count)
+            kmer_size += 1
+
+        return results
+
+    def _track_count(reads, kmer_size, min_count):
+        # A k-mer that is over-represented at some size > k has over-represented
+        # k-mers as its prefix and suffix only if k-mers are tracked down to
+        # the lowest threshold of any size.
+        max_len = max((len(read) for read in reads), default=0)
+        if max_len < kmer_size:
+            return None
+        return min(min_count(k) for k in range(kmer_size, max_len + 1))
+
+    def _count_initial_kmers(reads, kmer_size, track_count):
+        regexp = re.compile('[ACGTN]{%d,}' % kmer_size)
+
+        def _iter_kmers(read):
+            for match in regexp.finditer(read):
+                for pos in range(match.start(), match.end() - kmer_size + 1):
+                    yield pos, read[pos:(pos+kmer_size)]
+
+        all_counts = defaultdict(int)
+        for read in reads:
+            for pos, kmer in _iter_kmers(read):
+                all_counts[kmer] += 1
+
+        kmer_ids = {}
+        occurrences = []
+        for read_id, read in enumerate(reads):
+            for pos, kmer in _iter_kmers(read):
+                if all_counts[kmer] > track_count:
+                    kmer_id = kmer_ids.setdefault(kmer, len(kmer_ids))
+                    occurrences.append((read_id, pos, kmer_id))
+
+        kmers = sorted(kmer_ids, key=kmer_ids.get)
+        return kmers, [all_counts[kmer] for kmer in kmers], occurrences
+
+    def _extend_kmers(reads, kmer_size, occurrences, track_count):
+        # Occurrences are sorted by read and position, so the occurrence of the
+        # suffix of an extended k-mer is the one that follows the occurrence of
+        # its prefix.
+        extended = []
+        key_counts = defaultdict(int)
+        for idx, (read_id, pos, kmer_id) in enumerate(occurrences[:-1]):
+            next_read_id, next_pos, _ = occurrences[idx+1]
+            if next_read_id == read_id and next_pos == pos + 1:
+                key = (kmer_id, reads[read_id][pos + kmer_size])
+                extended.append((read_id, pos, key))
+                key_counts[key] += 1
+
+        kmer_ids = {}
+        kmers = []
+        counts = []
+        new_occurrences = []
+        for read_id, pos, key in extended:
+            count = key_counts[key]
+            if count > track_count:
+                if key not in kmer_ids:
+                    kmer_ids[key] = len(kmers)
+                    kmers.append(reads[read_id][pos:(pos+kmer_size+1)])
+                    counts.append(count)
+                new_occurrences.append((read_id, pos, kmer_ids[key]))
+        return kmers, counts, new_occurrences
+
+    MASK64 = 0xFFFFFFFFFFFFFFFF
+    
+    def _mix(value):
+        # splitmix64 finalizer
+        value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+        return value ^ (value >> 31)
+
+    class CountMinSketch(object):
+        """Estimates the counts of k-mers with a count-min sketch, and keeps
+        track of the k-mers with the highest estimated counts.
+
+        The sketch is a table of `depth` rows of 32-bit counters. Each row has
+        its own hash function, and the estimated count of a k-mer is the
+        minimum of its counters. Counters are updated conservatively: only the
+        counters that are below the new estimate are increased, which reduces
+        the overestimation caused by collisions.
+
+        The heavy hitters are kept in a min-heap of at most `capacity` k-mers,
+        ordered by estimated count. A k-mer that is not in the heap replaces
+        the heap's minimum when its estimate exceeds it.
+
+        K-mers that contain a base other than A, C, G or T are not counted.
+
+        Args:
+            kmer_size: The k-mer size; must be between 1 and 32.
+            memory: The number of bytes to use for the counters.
+            depth: The number of rows.
+            capacity: The maximum number of heavy hitters.
+        """
+        def __init__(
+                self, kmer_size, memory=64 * 2**20, depth=4, capacity=2**16):
+            if not 1 <= kmer_size <= 32:
+                raise ValueError("kmer_size must be between 1 and 32")
+            if depth < 1 or capacity < 1:
+                raise ValueError("depth and capacity must be >= 1")
+            self.kmer_size = kmer_size
+            self.depth = depth
+            self.capacity = capacity
+            self.width = memory // (depth * 4)
+            if not 1 <= self.width < 2**32:
+                raise ValueError(
+                    "memory must be between {} and {} bytes".format(
+                        depth * 4, depth * 4 * 2**32))
+            self.counters = [
+                array('I', bytes(4 * self.width)) for _ in range(depth)]
+            self.seeds = [_mix(row + 1) | 1 for row in range(depth)]
+            self.heap = []
+            self.positions = {}
+            self.total = 0
+
+        def consume(self, seqs):
+            """Count the k-mers in a batch of sequences.
+            """
+            for seq in seqs:
+                for code in PackedSequence(seq).kmers(self.kmer_size):
+                    if code >= 0:
+                        self._add(code)
+
+        def get(self, kmer):
+            """Returns the estimated count of a k-mer.
+            """
+            if len(kmer) != self.kmer_size:
+                raise ValueError("Expected a k-mer of size {}".format(
+                    self.kmer_size))
+            code = PackedSequence(kmer).kmers(self.kmer_size)[0]
+            if code < 0:
+                return 0
+            return self._estimate(code)
+        
+        def merge(self, other):
+            """Add the counts of another sketch with the same dimensions to
+            this sketch. The heavy hitters of both sketches are re-ranked by
+            their estimated counts in the merged sketch.
+            """
+            if (
+                    other.kmer_size != self.kmer_size or
+                    other.depth != self.depth or other.width != self.width):
+                raise ValueError("Cannot merge sketches of different sizes")
+            for counters, other_counters in zip(
+                    self.counters, other.counters):
+                for idx, count in enumerate(other_counters):
+                    if count:
+                        counters[idx] = min(counters[idx] + count, 0xFFFFFFFF)
+            self.total += other.total
+            codes = [code for count, code in self.heap + other.heap]
+            self.heap = []
+            self.positions = {}
+            for code in codes:
+                self._update_heavy_hitters(code, self._estimate(code))
+            return self
+
+        def heavy_hitters(self):
+            """Returns a list of tuples (kmer, estimated count) of the k-mers
+            with the highest estimated counts, in decreasing order of count.
+            """
+            result = [
+                (decode_kmer(code, self.kmer_size), count)
+                for count, code in self.heap]
+            result.sort(key=lambda x: (-x[1], x[0]))
+            return result
+
+        def _counter(self, row, code):
+            # The top 32 bits of a multiply-shift hash, scaled to the row
+            # width.
+            seed = self.seeds[row]
+            hashed = (((code ^ seed) * seed) & MASK64) >> 32
+            return (hashed * self.width) >> 32
+
+        def _estimate(self, code):
+            return min(
+                counters[self._counter(row, code)]
+                for row, counters in enumerate(self.counters))
+        
+        def _add(self, code):
+            indexes = [
+                self._counter(row, code) for row in range(self.depth)]
+            estimate = min(
+                counters[idx]
+                for counters, idx in zip(self.counters, indexes))
+            if estimate < 0xFFFFFFFF:
+                estimate += 1
+                for counters, idx in zip(self.counters, indexes):
+                    if counters[idx] < estimate:
+                        counters[idx] = estimate
+            self.total += 1
+            self._update_heavy_hitters(code, estimate)
+
+        def _update_heavy_hitters(self, code, count):
+            heap = self.heap
+            if code in self.positions:
+                pos = self.positions[code]
+                heap[pos] = (count, code)
+                self._sift_down(pos)
+            elif len(heap) < self.capacity:
+                heap.append((count, code))
+                self.positions[code] = len(heap) - 1
+                self._sift_up(len(heap) - 1)
+            elif count > heap[0][0]:
+                del self.positions[heap[0][1]]
+                heap[0] = (count, code)
+                self.positions[code] = 0
+                self._sift_down(0)
+
+        def _swap(self, i, j):
+            heap = self.heap
+            heap[i], heap[j] = heap[j], heap[i]
+            self.positions[heap[i][1]] = i
+            self.positions[heap[j][1]] = j
+
+        def _sift_up(self, pos):
+            heap = self.heap
+            while pos > 0:
+                parent = (pos - 1) >> 1
+                if heap[parent][0] <= heap[pos][0]:
+                    break
+                self._swap(parent, pos)
+                pos = parent
+
+        def _sift_down(self, pos):
+            heap = self.heap
+            size = len(heap)
+            while True:
+                child = 2 * pos + 1
+                if child >= size:
+                    break
+                if child + 1 < size and heap[child + 1][0] < heap[child][0]:
+                    child += 1
+                if heap[pos][0] <= heap[child][0]:
+                    break
+                self._swap(pos, child)
+                pos = child
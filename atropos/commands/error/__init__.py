@@ -1,13 +1,12 @@
 """Estimate the empircal error rate.
 """
-from collections import defaultdict
-import csv
+from collections import Counter, defaultdict
+import logging
 import re
 from atropos import AtroposError
 from atropos.commands.base import (
     BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin)
-from atropos.io import open_output
-from atropos.util import qual2prob, run_interruptible
+from atropos.util import count_quals, qual2prob, run_interruptible
 
 class CommandRunner(BaseCommandRunner):
     name = 'error'
@@ -24,16 +23,59 @@ class CommandRunner(BaseCommandRunner):
         
         estimator_args = dict(max_read_len=self.max_bases)
         if self.paired:
-            estimator = PairedErrorEstimator(
+            pipeline_class = PairedErrorEstimator
+            pipeline_args = dict(
                 estimator_class=estimator_class, **estimator_args)
         else:
-            estimator = estimator_class(**estimator_args)
+            pipeline_class = estimator_class
+            pipeline_args = estimator_args
         
         self.summary['errorrate'] = estimator_args
         
-        # currently only single-threaded operation is supproted
-        self.summary.update(mode='serial', threads=1)
-        return run_interruptible(estimator, self, raise_on_error=True)
+        if self.threads is None:
+            self.summary.update(mode='serial', threads=1)
+            estimator = pipeline_class(**pipeline_args)
+            return run_interruptible(estimator, self, raise_on_error=True)
+        else:
+            self.summary.update(mode='parallel', threads=self.threads)
+            return self.run_parallel(pipeline_class, pipeline_args)
+    
+    def run_parallel(self, pipeline_class, pipeline_args):
+        """Execute error in parallel mode. Worker processes collect counts
+        from reads, and send their estimator state with their summary. Error
+        rates are estimated in the main process from the merged state.
+        
+        Args:
+            pipeline_class: Pipeline class to instantiate.
+            pipeline_args: Arguments to pass to Pipeline constructor.
+        
+        Returns:
+            The return code.
+        """
+        from atropos.commands.multicore import (
+            ParallelPipelineMixin, ParallelPipelineRunner)
+        
+        logging.getLogger().debug(
+            "Starting atropos error in parallel mode with threads=%d, "
+            "timeout=%d", self.threads, self.process_timeout)
+        
+        if self.threads < 2:
+            raise ValueError("'threads' must be >= 2")
+        
+        class ParallelErrorPipelineRunner(ParallelPipelineRunner):
+            """ParallelPipelineRunner that estimates error rates once the
+            worker summaries have been merged.
+            """
+            def finish(self):
+                errorrate_summary = self.command_runner.summary['errorrate']
+                self.pipeline.set_state(errorrate_summary.pop('state'))
+                errorrate_summary.update(self.pipeline.summarize_estimates())
+        
+        pipeline_class = type(
+            'ErrorPipelineImpl', (ParallelPipelineMixin, pipeline_class), {})
+        pipeline = pipeline_class(**pipeline_args)
+        runner = ParallelErrorPipelineRunner(self, pipeline)
+        return runner.run()
 
 class ErrorEstimator(SingleEndPipelineMixin, Pipeline):
     """Base class for error estimators.
@@ -43,21 +85,52 @@ class ErrorEstimator(SingleEndPipelineMixin, Pipeline):
         self.total_len = 0
         self.max_read_len = max_read_len
     
+    def handle_records(self, context, records):
+        context['bp'][0] += sum(len(record) for record in records)
+        self.add_reads(records)
+    
     def handle_reads(self, context, read1, read2=None):
+        self.add_reads((read1,))
+    
+    def add_reads(self, reads):
+        """Collect information from a batch of reads.
+        """
         raise NotImplementedError()
     
+    def get_state(self):
+        """Returns the information collected from reads, as a dict that can be
+        merged with the state of another estimator of the same class.
+        """
+        return dict(total_len=self.total_len)
+    
+    def set_state(self, state):
+        """Replaces the information collected from reads with `state`.
+        """
+        self.total_len = state['total_len']
+    
     def estimate(self):
         """Returns an estimate of the error rate.
         """
         raise NotImplementedError()
     
-    def finish(self, summary, **kwargs):
-        super().finish(summary)
+    def summarize_estimates(self):
+        """Returns a dict with the error rate estimate, the number of bases it
+        is based on, and the estimator-specific details.
+        """
         estimate, details = self.estimate()
-        summary['errorrate'].update(
+        return dict(
             estimate=(estimate,), 
             total_len=(self.total_len,),
             details=(details,))
+    
+    def finish(self, summary, worker=None, **kwargs):
+        super().finish(summary)
+        if worker is None:
+            summary['errorrate'].update(self.summarize_estimates())
+        else:
+            # Error rates are estimated by the main process once the states
+            # of all workers are merged.
+            summary['errorrate'] = dict(state=self.get_state())
 
 class BaseQualityErrorEstimator(ErrorEstimator):
     """Simple error estimation using base qualities. It is well-known that base
@@ -66,116 +139,228 @@ class BaseQualityErrorEstimator(ErrorEstimator):
     """
     def __init__(self, max_read_len=None):
         super().__init__(max_read_len)
-        self.total_qual = 0.0
+        # Number of occurrences of each quality character
+        self.qual_counts = [0] * 256
     
-    def handle_reads(self, context, read1, read2=None):
-        quals = read1.qualities
-        readlen = len(quals)
-        if self.max_read_len and self.max_read_len < readlen:
-            readlen = self.max_read_len
-            quals = quals[:readlen]
-        self.total_qual += sum(qual2prob(qchar) for qchar in quals)
-        self.total_len += readlen
+    def add_reads(self, reads):
+        if self.max_read_len:
+            max_len = self.max_read_len
+            quals = ''.join(read.qualities[:max_len] for read in reads)
+        else:
+            quals = ''.join(read.qualities for read in reads)
+        count_quals(quals, self.qual_counts)
+        self.total_len += len(quals)
+    
+    def get_state(self):
+        state = super().get_state()
+        state['qual_counts'] = self.qual_counts
+        return state
+    
+    def set_state(self, state):
+        super().set_state(state)
+        self.qual_counts = list(state['qual_counts'])
     
     def estimate(self):
-        return (self.total_qual / self.total_len, None)
+        total_qual = sum(
+            count * qual2prob(chr(qual))
+            for qual, count in enumerate(self.qual_counts) if count)
+        return (total_qual / self.total_len, None)
 
 # Error estimation using shadow counts
 
 FILTER_RE = re.compile("A+|C+|G+|T+|.*N.*")
 
-SHADOW_REGRESSION_R_SCRIPT = """
-library(ShadowRegression)
-errorRates = getErrorRates("{reads}", type="{method}")
-write.table(errorRates$perReadER, "{per_read}", sep="\t", quote=F, col.names=F,
-            row.names=T)
-write.table(errorRates$cycleER, "{per_cycle}", sep="\t", quote=F, col.names=F,
-            row.names=T)
-"""
-
 class ShadowRegressionErrorEstimator(ErrorEstimator):
     """Re-implementation of the shadow regression method described in:
     Wang et al., "Estimation of sequencing error rates in short reads",
         BMC Bioinformatics 2012 13:185, DOI: 10.1186/1471-2105-13-185
     
+    Reads that are within one edit of a more abundant read (its 'shadows') are
+    assumed to be sequencing errors of that read. The shadow counts of the
+    abundant reads are regressed on their read counts, and the error rates
+    overall and at each cycle are derived from the slopes.
+    
     Args:
         method: The differences that are considered in the error rate
             calculation; sub = substitutions, indel = insertions and
             deletions; all = both substitutions and indels.
         max_read_len: The maximum number of bases (starting from the 5' end)
             to consider from each read.
+        min_count: The minimum count of a read to be used in the regression.
     """
-    def __init__(self, method='sub', max_read_len=None, rscript_exe="Rscript"):
+    def __init__(self, method='sub', max_read_len=None, min_count=2):
         super().__init__(max_read_len)
-        self.seqs = defaultdict(lambda: 0)
+        # A Counter rather than a CountingDict, so that worker states are
+        # merged as plain dicts rather than packed.
+        self.seqs = Counter()
         self.method = method
-        self.rscript_exe = rscript_exe
+        self.min_count = min_count
     
-    def handle_reads(self, context, read1, read2=None):
-        seq = read1.sequence
-        readlen = len(seq)
-        if self.max_read_len and self.max_read_len < readlen:
-            readlen = self.max_read_len
-            seq = seq[:readlen]
-        if FILTER_RE.fullmatch(seq):
-            return
-        self.seqs[seq] += 1
-        self.total_len += readlen
+    def add_reads(self, reads):
+        max_len = self.max_read_len
+        seqs = self.seqs
+        for read in reads:
+            seq = read.sequence
+            if max_len:
+                seq = seq[:max_len]
+            if FILTER_RE.fullmatch(seq):
+                continue
+            seqs[seq] += 1
+            self.total_len += len(seq)
+    
+    def get_state(self):
+        state = super().get_state()
+        state['seqs'] = self.seqs
+        return state
+    
+    def set_state(self, state):
+        super().set_state(state)
+        self.seqs = state['seqs']
     
     def estimate(self):
-        # This is a temporary solution that requires R and the
-        # ShadowRegression package. Eventually, this will be
-        # replaced with a pure-python implementation.
-        import os
-        import subprocess
-        import tempfile
-        
-        tempfiles = (tempfile.mkstemp()[1] for i in range(4))
-        read_counts, per_read, per_cycle, script_file = tempfiles
-        try:
-            # write counts to a file
-            with open(read_counts, 'wt') as out:
-                self._write_read_counts(out)
-            
-            # execute R script
-            script = SHADOW_REGRESSION_R_SCRIPT.format(
-                reads=read_counts, method=self.method, per_read=per_read,
-                per_cycle=per_cycle)
-            with open(script_file, 'wt') as out:
-                out.write(script)
-            proc = subprocess.Popen(
-                [self.rscript_exe, "--vanilla", script_file],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            with proc:
-                stdout, stderr = proc.communicate()
-                if proc.returncode != 0:
-                    raise AtroposError(
-                        "R script failed: rc={}; stdout={}; stderr={}".format(
-                            proc.returncode, stdout, stderr))
-            
-            # read the results
-            with open(per_read, 'rt') as i:
-                reader = csv.reader(i, delimiter="\t")
-                per_read_error = dict(reader)
-                if len(per_read_error) != 4:
-                    raise AtroposError("Invalid output from R script")
-            with open(per_cycle, 'rt') as i:
-                reader = csv.reader(i, delimiter="\t")
-                per_cycle_error = list(row[0:3] for row in reader)
-                if not per_cycle_error:
-                    raise AtroposError("Invalid output from R script")
-            
-            return (
-                per_read_error["error rate"],
-                dict(per_read=per_read_error, per_cycle=per_cycle_error))
-        finally:
-            for path in tempfiles:
-                os.remove(path)
-    
-    def _write_read_counts(self, fileobj):
-        writer = csv.writer(fileobj, delimiter=" ")
-        writer.writerows(sorted(
-            self.seqs.items(), reverse=True, key=lambda i: i[1]))
+        import numpy as np
+        
+        templates, shadows = self._count_shadows()
+        counts = np.array([count for seq, count in templates], dtype=float)
+        if len(set(counts)) < 2:
+            raise AtroposError(
+                "Cannot estimate the error rate by shadow regression: need "
+                "abundant reads with at least two different counts (found {} "
+                "abundant reads)".format(len(templates)))
+        read_len = max(len(seq) for seq, count in templates)
+        
+        # Regress the total and per-cycle shadow counts on the read counts.
+        # Column 0 of y is the total shadow count.
+        design = np.column_stack((np.ones(len(counts)), counts))
+        y = np.zeros((len(counts), read_len + 1))
+        for row, cycle, count in shadows:
+            y[row, 0] += count
+            y[row, cycle + 1] += count
+        coefs, _, _, _ = np.linalg.lstsq(design, y, rcond=None)
+        residuals = y - design.dot(coefs)
+        variance = (residuals ** 2).sum(axis=0) / max(len(counts) - 2, 1)
+        sxx = ((counts - counts.mean()) ** 2).sum()
+        slopes = coefs[1]
+        slope_errs = np.sqrt(variance / sxx)
+        
+        # Assuming independent errors at rate e per base, a template of length
+        # L with n error-free copies has n * L * e / (1 - e) shadows with one
+        # error, so e = slope / (L + slope). Similarly, the error rate at cycle
+        # i is slope_i / (1 + slope_i).
+        avg_len = sum(len(seq) * count for seq, count in templates) / sum(
+            count for seq, count in templates)
+        slope, slope_err = slopes[0], slope_errs[0]
+        base_err = slope / (avg_len + slope)
+        base_stderr = slope_err * avg_len / (avg_len + slope) ** 2
+        # Probability that a read has at least one error
+        read_err = 1 - (1 - base_err) ** avg_len
+        read_stderr = (
+            base_stderr * avg_len * (1 - base_err) ** (avg_len - 1))
+        per_read_error = {
+            'error rate': float(base_err),
+            'standard error': float(base_stderr),
+            'read error rate': float(read_err),
+            'read standard error': float(read_stderr)
+        }
+        per_cycle_error = [
+            [cycle, float(cycle_slope / (1 + cycle_slope)),
+             float(cycle_err / (1 + cycle_slope) ** 2)]
+            for cycle, cycle_slope, cycle_err in zip(
+                range(1, read_len + 1), slopes[1:], slope_errs[1:])]
+        
+        return (
+            per_read_error["error rate"],
+            dict(per_read=per_read_error, per_cycle=per_cycle_error))
+    
+    def _count_shadows(self):
+        """Find the shadows of abundant reads.
+        
+        Since reads are truncated to the same length, a shadow with an
+        insertion or deletion at position i is its template up to i, followed
+        by the rest of the template shifted by one base. By the pigeonhole
+        principle, a read within one edit of a template has the same first
+        half (if the edit is in the second half), or the same second half,
+        possibly shifted by one base. Templates are indexed by these halves,
+        so only the reads that share a half with a template are compared to
+        it.
+        
+        Returns:
+            Tuple (templates, shadows), where templates is a list of (seq,
+            count) in decreasing order of count, and shadows is a list of
+            (template index, cycle, count), where cycle is the position of
+            the edit.
+        """
+        seqs = sorted(self.seqs.items(), key=lambda item: (-item[1], item[0]))
+        # Only reads with at least min_count copies can be templates.
+        n_candidates = 0
+        candidate_ids = defaultdict(list)
+        for seq, count in seqs:
+            if count < self.min_count:
+                break
+            half = len(seq) // 2
+            keys = (seq[:half], seq[half:], seq[half:-1], seq[half+1:])
+            for key in set(keys):
+                candidate_ids[key].append(n_candidates)
+            n_candidates += 1
+        
+        use_sub = self.method in ('sub', 'all')
+        use_indel = self.method in ('indel', 'all')
+        # For each candidate, the (id, edit position, is substitution) of the
+        # reads within one edit of it
+        neighbors = [[] for _ in range(n_candidates)]
+        for seq_id, (seq, count) in enumerate(seqs):
+            half = len(seq) // 2
+            compared = set()
+            for key in (seq[:half], seq[half:], seq[half+1:], seq[half:-1]):
+                if key not in candidate_ids:
+                    continue
+                for candidate_id in candidate_ids[key]:
+                    if candidate_id == seq_id or candidate_id in compared:
+                        continue
+                    compared.add(candidate_id)
+                    edit = _find_edit(seqs[candidate_id][0], seq)
+                    if edit is not None:
+                        neighbors[candidate_id].append((seq_id,) + edit)
+        
+        is_template = [False] * n_candidates
+        templates = []
+        shadows = []
+        for seq_id, others in enumerate(neighbors):
+            seq, count = seqs[seq_id]
+            # Reads within one edit of any more abundant read are shadows,
+            # not templates.
+            if any(
+                    other < n_candidates and is_template[other]
+                    for other, _, _ in others):
+                continue
+            is_template[seq_id] = True
+            row = len(templates)
+            templates.append((seq, count))
+            for other, position, is_sub in others:
+                other_count = seqs[other][1]
+                if other_count > count:
+                    continue
+                if not (use_sub if is_sub else use_indel):
+                    continue
+                shadows.append((row, position, other_count))
+        
+        return templates, shadows
+
+def _find_edit(seq, other):
+    """Returns the (position, is substitution) of the single edit that makes
+    `seq` into `other`, or None if `other` is not within one edit of `seq`.
+    Insertions and deletions shift the rest of the read by one base.
+    """
+    if len(seq) != len(other) or seq == other:
+        return None
+    pos = 0
+    while seq[pos] == other[pos]:
+        pos += 1
+    if seq[pos+1:] == other[pos+1:]:
+        return (pos, True)
+    if seq[pos:-1] == other[pos+1:] or seq[pos+1:] == other[pos:-1]:
+        return (pos, False)
+    return None
 
 class PairedErrorEstimator(PairedEndPipelineMixin, Pipeline):
     """Estimator for a pair of input files.
@@ -186,20 +371,48 @@ class PairedErrorEstimator(PairedEndPipelineMixin, Pipeline):
         self.estimator1 = estimator_class(**kwargs)
         self.estimator2 = estimator_class(**kwargs)
     
+    def handle_records(self, context, records):
+        reads1 = [record[0] for record in records]
+        reads2 = [record[1] for record in records]
+        bps = context['bp']
+        bps[0] += sum(len(read.sequence) for read in reads1)
+        bps[1] += sum(len(read.sequence) for read in reads2)
+        self.estimator1.add_reads(reads1)
+        self.estimator2.add_reads(reads2)
+    
     def handle_reads(self, context, read1, read2):
-        self.estimator1.handle_reads(context, read1)
-        self.estimator2.handle_reads(context, read2)
+        self.estimator1.add_reads((read1,))
+        self.estimator2.add_reads((read2,))
+    
+    def get_state(self):
+        """Returns a tuple of the states of the read1 and read2 estimators.
+        """
+        return (self.estimator1.get_state(), self.estimator2.get_state())
     
-    def finish(self, summary, **kwargs):
+    def set_state(self, state):
+        """Sets the states of the read1 and read2 estimators.
+        """
+        state1, state2 = state
+        self.estimator1.set_state(state1)
+        self.estimator2.set_state(state2)
+    
+    def summarize_estimates(self):
         """Estimate error rates.
         
         Returns:
-            Tuple (read1_estimate, read2_estimate).
+            A dict with tuples (read1, read2) of estimates, total lengths and
+            details.
         """
-        super().finish(summary)
         estimate1, details1 = self.estimator1.estimate()
         estimate2, details2 = self.estimator2.estimate()
-        summary['errorrate'].update(
+        return dict(
             estimate=(estimate1, estimate2),
             total_len=(self.estimator1.total_len, self.estimator2.total_len),
             details=(details1, details2))
+    
+    def finish(self, summary, worker=None, **kwargs):
+        super().finish(summary)
+        if worker is None:
+            summary['errorrate'].update(self.summarize_estimates())
+        else:
+            summary['errorrate'] = dict(state=self.get_state())
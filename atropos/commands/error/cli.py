@@ -1,6 +1,7 @@
 """Command-line interface for the error command.
 """
-from atropos.commands.cli import BaseCommandParser, writeable_file
+from atropos.commands.cli import (
+    BaseCommandParser, configure_threads, int_or_str, positive, writeable_file)
 from atropos.io import STDOUT
 
 class CommandParser(BaseCommandParser):
@@ -29,7 +30,7 @@ error rate."""
             choices=('quality', 'shadow'), default="quality",
             help="Method for estimating error rates; quality = base qualities, "
                  "shadow = shadow regression. Be advised that the 'shadow' "
-                 "method is incredibly slow.")
+                 "method is much slower, and requires NumPy.")
         group.add_argument(
             "-m",
             "--max-bases",
@@ -37,6 +38,26 @@ error rate."""
             help="Maximum number of bases to use in the error calculation, "
                  "starting from the 5' end of the read.")
         
+        group = self.add_group(
+            "Parallel", title="Parallel (multi-core) options")
+        group.add_argument(
+            "-T",
+            "--threads",
+            type=positive(int, True), default=None, metavar="THREADS",
+            help="Number of threads to use for collecting read statistics. "
+                 "Set to 0 to use max available threads. (Do not use "
+                 "multithreading)")
+        group.add_argument(
+            "--process-timeout",
+            type=positive(int, True), default=60, metavar="SECONDS",
+            help="Number of seconds process should wait before escalating "
+                 "messages to ERROR level. (60)")
+        group.add_argument(
+            "--read-queue-size",
+            type=int_or_str, default=None, metavar="SIZE",
+            help="Size of queue for batches of reads to be processed. "
+                 "(THREADS * 100)")
+        
         group = self.add_group("Output")
         group.add_argument(
             "-o",
@@ -56,4 +77,12 @@ error rate."""
                  "the structured output (json/yaml/pickle formats).")
     
     def validate_command_options(self, options):
+        if options.threads is not None:
+            threads = configure_threads(options, self.parser)
+            if options.read_queue_size is None:
+                options.read_queue_size = threads * 100
+            elif (
+                    options.read_queue_size > 0 and
+                    options.read_queue_size < threads):
+                self.parser.error("Read queue size must be >= than 'threads'")
         options.report_file = options.output
@@ -342,6 +342,16 @@ def print_trim_report(summary, outfile):
                 adapter_cutter['records_with_adapters'][0],
                 adapter_cutter['fraction_records_with_adapters'][0],
                 pct=True)
+        if 'cache_hits' in adapter_cutter:
+            for read in range(2 if paired else 1):
+                if adapter_cutter['cache_hits'][read] is None:
+                    continue
+                _print(
+                    "Read {} alignment cache hits:".format(read+1)
+                    if paired else "Alignment cache hits:",
+                    adapter_cutter['cache_hits'][read],
+                    adapter_cutter['cache_hit_rate'][read],
+                    indent=(INDENT, '') if paired else None, pct=True)
     
     def _print_filter(name, sep):
         if name in filters:
@@ -7,7 +7,7 @@ import os
 from queue import Empty, Full
 import time
 from atropos import AtroposError
-from atropos.util import run_interruptible
+from atropos.util import pack_summary, run_interruptible
 
 RETRY_INTERVAL = 5
 """Max time to wait between retrying operations."""
@@ -211,6 +211,10 @@ class WorkerProcess(Process):
             finally:
                 self.pipeline.finish(summary, worker=self)
             
+            # Counters are sent to the main process as arrays, which are much
+            # smaller to pickle and faster to merge.
+            pack_summary(summary)
+            
             logging.getLogger().debug("%s finished normally", self.name)
         except Exception as err:
             logging.getLogger().error(
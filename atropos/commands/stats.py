@@ -3,13 +3,13 @@
 """
 import re
 from atropos.util import (
-    CountingDict, NestedDict, Histogram, Mergeable, Summarizable, ordered_dict, 
-    qual2int)
+    CountingDict, NestedDict, Histogram, Packable, PackedCounts, Summarizable,
+    ordered_dict, qual2int)
 
 DEFAULT_TILE_KEY_REGEXP = r"^(?:[^\:]+\:){4}([^\:]+)"
 """Regexp for the default Illumina read name format."""
 
-class PositionDicts(Mergeable, Summarizable):
+class PositionDicts(Packable, Summarizable):
     """A sequence of dicts, one for each position in a sequence.
     
     Args:
@@ -35,7 +35,7 @@ class PositionDicts(Mergeable, Summarizable):
                 self.dicts.append(self.dict_class())
     
     def merge(self, other):
-        if not isinstance(other, BaseCountingDicts):
+        if not isinstance(other, self.__class__):
             raise ValueError(
                 "Cannot merge object of type {}".format(type(other)))
         other_len = len(other.dicts)
@@ -44,6 +44,21 @@ class PositionDicts(Mergeable, Summarizable):
             self.dicts[i].merge(other.dicts[i])
         if other_len > min_len:
             self.dicts.extend(other.dicts[min_len:other_len])
+        return self
+    
+    def pack(self):
+        template = self.__class__(self.is_qualities, self.quality_base)
+        template.extend(len(self.dicts))
+        return PackedCounts.from_items(
+            template,
+            (
+                ((idx,) + keys, value)
+                for idx, dict_item in enumerate(self.dicts)
+                for keys, value in dict_item.pack().items()),
+            (tuple(range(len(self.dicts))),) + (None,) * self.dict_dims)
+    
+    def set_count(self, keys, count):
+        self[keys[0]].set_count(keys[1:], count)
     
     def summarize(self):
         raise NotImplementedError()
@@ -53,6 +68,7 @@ class BaseCountingDicts(PositionDicts):
     number of items associated with each nucleotide base.
     """
     dict_class = CountingDict
+    dict_dims = 1
     
     def summarize(self):
         """Flatten into a table with N rows (where N is the size of the
@@ -82,6 +98,7 @@ class BaseNestedDicts(PositionDicts):
     """A PositionDicts in which items are NestedDicts.
     """
     dict_class = NestedDict
+    dict_dims = 2
     
     def summarize(self):
         """Flatten into a table of N*K rows, where N is the sequence size and
@@ -269,8 +286,8 @@ class ReadStatistics(object):
         """
         summary = dict(
             counts=self.count,
-            lengths=self.sequence_lengths.summarize(),
-            gc=self.sequence_gc.summarize(),
+            lengths=self.sequence_lengths,
+            gc=self.sequence_gc,
             bases=self.bases)
         if self.sequence_qualities:
             summary['qualities'] = self.sequence_qualities
@@ -1,6 +1,7 @@
 """Implementation of the 'trim' command.
 """
-from collections import Sequence, defaultdict
+from collections import Counter, Sequence, defaultdict
+from itertools import chain, islice
 import logging
 import os
 import sys
@@ -10,9 +11,10 @@ from atropos.commands.base import (
     PairedEndPipelineMixin)
 from atropos.commands.stats import (
     SingleEndReadStatistics, PairedEndReadStatistics)
-from atropos.adapters import AdapterParser, BACK
+from atropos.adapters import AdapterParser, BACK, LINKED
 from atropos.io import STDOUT
-from atropos.util import RandomMatchProbability, Const, run_interruptible
+from atropos.util import (
+    RandomMatchProbability, Const, reverse_complement, run_interruptible)
 from .modifiers import (
     AdapterCutter, DoubleEncoder, InsertAdapterCutter, LengthTagModifier,
     MergeOverlapping, MinCutter, NEndTrimmer, NextseqQualityTrimmer,
@@ -22,9 +24,11 @@ from .modifiers import (
     UnconditionalCutter, ZeroCapper)
 from .filters import (
     FilterFactory, Filters, MergedReadFilter, NContentFilter, NoFilter,
-    TooLongReadFilter, TooShortReadFilter, TrimmedFilter, UntrimmedFilter)
+    TooLongReadFilter, TooShortReadFilter, TrimmedFilter, UntrimmedFilter,
+    plan_early_filters)
 from .writers import (
     Formatters, InfoFormatter, RestFormatter, WildcardFormatter, Writers)
+from .codegen import compile_record_handler
 
 class TrimPipeline(Pipeline):
     """Base trimming pipeline.
@@ -32,11 +36,24 @@ class TrimPipeline(Pipeline):
     Args:
         record_handler:
         result_handler:
+        collapse_duplicates: Whether to modify reads with identical sequences
+            within a batch only once. Requires that all modifiers are
+            collapsible.
+        compile_handler: Whether to handle records with a function generated
+            for the configured modifiers, filters and formatters (see
+            :func:`atropos.commands.trim.codegen.compile_record_handler`).
     """
-    def __init__(self, record_handler, result_handler):
+    def __init__(
+            self, record_handler, result_handler, collapse_duplicates=False,
+            compile_handler=False):
         super().__init__()
         self.record_handler = record_handler
         self.result_handler = result_handler
+        self.collapse_duplicates = collapse_duplicates
+        self.compiled_handler = None
+        if compile_handler and not collapse_duplicates:
+            self.compiled_handler = compile_record_handler(
+                record_handler, isinstance(self, PairedEndPipelineMixin))
     
     def start(self, worker=None):
         self.result_handler.start(worker)
@@ -45,7 +62,17 @@ class TrimPipeline(Pipeline):
         context['results'] = defaultdict(lambda: [])
     
     def handle_records(self, context, records):
-        super().handle_records(context, records)
+        if self.collapse_duplicates:
+            context['duplicates'] = dict(
+                (key, [count, None])
+                for key, count in Counter(
+                    duplicate_key(*record) if isinstance(record, tuple)
+                    else duplicate_key(record)
+                    for record in records).items())
+        if self.compiled_handler:
+            self.compiled_handler(context, records)
+        else:
+            super().handle_records(context, records)
         self.result_handler.write_result(context['index'], context['results'])
     
     def handle_reads(self, context, read1, read2=None):
@@ -58,20 +85,81 @@ class TrimPipeline(Pipeline):
 
 class RecordHandler(object):
     """Base class for record handlers.
+    
+    Args:
+        modifiers: The :class:`Modifiers`.
+        filters: The :class:`Filters`.
+        formatters: The :class:`Formatters`.
+        early_filters: Optional :class:`EarlyFilters`, used to discard reads
+            before the remaining modifiers are applied.
     """
-    def __init__(self, modifiers, filters, formatters):
+    def __init__(self, modifiers, filters, formatters, early_filters=None):
         self.modifiers = modifiers
         self.filters = filters
         self.formatters = formatters
+        self.early_filters = early_filters
     
     def handle_record(self, context, read1, read2=None):
         """Handle a pair of reads.
         """
-        reads = self.modifiers.modify(read1, read2)
+        duplicates = context.get('duplicates')
+        if duplicates:
+            reads = self.modify_duplicate(duplicates, read1, read2)
+        elif self.early_filters:
+            dest, reads = self.modify_early_filter(read1, read2)
+            if dest is not None:
+                self.formatters.format(context['results'], dest, *reads)
+                return (dest, reads)
+        else:
+            reads = self.modifiers.modify(read1, read2)
         dest = self.filters.filter(*reads)
         self.formatters.format(context['results'], dest, *reads)
         return (dest, reads)
     
+    def modify_early_filter(self, read1, read2=None):
+        """Modify a read/pair, applying the early filters at each of their
+        checkpoints.
+        
+        Returns:
+            A tuple (dest, reads), where dest is the filter type by which the
+            read/pair was discarded (and reads are the reads as modified up to
+            that point), or None if the read/pair went through all modifiers.
+        """
+        reads = (read1, read2)
+        start = 0
+        for index, checks in self.early_filters.checkpoints:
+            reads = self.modifiers.modify(*reads, start=start, end=index)
+            start = index
+            dest = self.early_filters.filter(checks, *reads)
+            if dest is not None:
+                return (dest, reads)
+        return (None, self.modifiers.modify(*reads, start=start))
+    
+    def modify_duplicate(self, duplicates, read1, read2=None):
+        """Modify a read/pair whose sequence(s) may occur multiple times in
+        the current batch. The modifiers are only applied to a stand-in for the
+        first occurrence, and the modifications are then transferred to each of
+        the duplicates.
+        
+        Args:
+            duplicates: Dict mapping :func:`duplicate_key`s to lists
+                [count, modified reads].
+            read1, read2: The reads to modify.
+        """
+        duplicate = duplicates[duplicate_key(read1, read2)]
+        count, modified = duplicate
+        if count == 1:
+            return self.modifiers.modify(read1, read2)
+        if modified is None:
+            probes = (
+                (position_probe(read1),) if read2 is None
+                else (position_probe(read1), position_probe(read2)))
+            duplicate[1] = modified = self.modifiers.modify_duplicates(
+                count, *probes)
+        return tuple(
+            transfer_modifications(mod_read, read)
+            for mod_read, read in zip(modified, (read1, read2)))
+    
     def summarize(self):
         """Returns a summary dict.
         """
@@ -80,6 +168,46 @@ class RecordHandler(object):
             filters=self.filters.summarize(),
             formatters=self.formatters.summarize()))
 
+def duplicate_key(read1, read2=None):
+    """Returns the key used to identify duplicate reads/pairs.
+    """
+    if read2 is None:
+        return read1.sequence
+    return (read1.sequence, read2.sequence)
+
+def position_probe(read):
+    """Returns a copy of `read` in which each quality character is replaced
+    by the character whose code point is the position of the base in the
+    read. Since collapsible modifiers ignore qualities, this allows the bases
+    that remain in a modified read to be mapped back to the original read.
+    """
+    probe = read[:]
+    probe.qualities = ''.join(map(chr, range(len(read))))
+    return probe
+
+def transfer_modifications(modified_probe, read):
+    """Apply to `read` the modifications that were made to a
+    :func:`position_probe` of a read with an identical sequence.
+    
+    Args:
+        modified_probe: The modified probe read.
+        read: The read to modify.
+    
+    Returns:
+        A modified copy of `read`, with its own name and qualities.
+    """
+    size = len(modified_probe)
+    start = ord(modified_probe.qualities[0]) if size else 0
+    new_read = read[start:start + size]
+    new_read.sequence = modified_probe.sequence
+    new_read.match = modified_probe.match
+    new_read.match_info = modified_probe.match_info
+    new_read.clipped = list(modified_probe.clipped)
+    new_read.insert_overlap = modified_probe.insert_overlap
+    new_read.merged = modified_probe.merged
+    new_read.corrected = modified_probe.corrected
+    return new_read
+
 class StatsRecordHandlerWrapper(object):
     """Wrapper around a record handler that collects read statistics
     before and/or after trimming.
@@ -272,9 +400,21 @@ class TrimSummary(Summary):
                         frac(total, sum_total_bp)
                 else:
                     dict_val[frac_key] = frac(value, sum_total_bp)
+            elif key == 'cache_hits':
+                misses = dict_val['cache_misses']
+                if isinstance(value, Sequence):
+                    dict_val['cache_hit_rate'] = [
+                        frac(hits, hits + miss) if hits is not None else None
+                        for hits, miss in zip(value, misses)]
+                else:
+                    dict_val['cache_hit_rate'] = frac(value, value + misses)
 
 class CommandRunner(BaseCommandRunner):
     name = 'trim'
+    # A detected sequence that is at least this fraction of the read length is
+    # more likely to be a duplicated read than an adapter, so it is not used
+    # as an adapter by `detect_adapters`.
+    max_detected_adapter_frac = 0.9
     
     def __init__(self, options):
         super().__init__(options, TrimSummary)
@@ -289,7 +429,7 @@ class CommandRunner(BaseCommandRunner):
         has_adapters2 = options.adapters2 or options.anywhere2 or options.front2
         
         adapters1 = adapters2 = []
-        if has_adapters1 or has_adapters2:
+        if has_adapters1 or has_adapters2 or options.detect_adapters:
             adapter_cache = super().load_known_adapters()
             parser_args = dict(
                 colorspace=options.colorspace,
@@ -304,6 +444,9 @@ class CommandRunner(BaseCommandRunner):
                 parser_args['max_rmp'] = options.adapter_max_rmp
             adapter_parser = AdapterParser(**parser_args)
             
+            if options.detect_adapters:
+                adapters1, adapters2 = self.detect_adapters(
+                    adapter_cache, adapter_parser)
             if has_adapters1:
                 adapters1 = adapter_parser.parse_multi(
                     options.adapters, options.anywhere, options.front)
@@ -319,6 +462,7 @@ class CommandRunner(BaseCommandRunner):
         # TODO: can this be replaced with an argparse required group?
         if (
                 not adapters1 and not adapters2 and
+                not options.detect_adapters and
                 not options.quality_cutoff and
                 options.nextseq_trim is None and
                 options.cut == [] and options.cut2 == [] and
@@ -332,6 +476,11 @@ class CommandRunner(BaseCommandRunner):
             raise ValueError(
                 "You need to provide at least one adapter sequence.")
         
+        if options.alignment_cache_size and any(
+                adapter.where == LINKED for adapter in adapters1 + adapters2):
+            raise ValueError(
+                "The alignment cache cannot be used with linked adapters")
+        
         if (
                 options.aligner == 'insert' and any(
                     not a or len(a) != 1 or a[0].where != BACK
@@ -348,6 +497,12 @@ class CommandRunner(BaseCommandRunner):
         else:
             modifiers = SingleEndModifiers()
         
+        # MatchInfo records are only needed for the info file and by
+        # MinCutters, which count adapter-trimmed bases.
+        record_match_info = bool(
+            options.info_file or options.bisulfite or options.cut_min or
+            options.cut_min2)
+        
         for oper in options.op_order:
             if oper == 'W' and options.overwrite_low_quality:
                 lowq, highq, window = options.overwrite_low_quality
@@ -377,16 +532,23 @@ class CommandRunner(BaseCommandRunner):
                         max_adapter_mismatch_frac=\
                             options.insert_match_adapter_error_rate,
                         match_probability=match_probability,
-                        insert_max_rmp=options.insert_max_rmp)
+                        insert_max_rmp=options.insert_max_rmp,
+                        record_match_info=record_match_info)
                 else:
                     a1_args = dict(
                         adapters=adapters1,
                         times=options.times,
-                        action=options.action) if adapters1 else None
+                        action=options.action,
+                        record_match_info=record_match_info,
+                        cache_size=options.alignment_cache_size
+                    ) if adapters1 else None
                     a2_args = dict(
                         adapters=adapters2,
                         times=options.times,
-                        action=options.action) if adapters2 else None
+                        action=options.action,
+                        record_match_info=record_match_info,
+                        cache_size=options.alignment_cache_size
+                    ) if adapters2 else None
                     modifiers.add_modifier_pair(AdapterCutter, a1_args, a2_args)
             elif oper == 'C' and (options.cut or options.cut2):
                 modifiers.add_modifier_pair(
@@ -546,12 +708,30 @@ class CommandRunner(BaseCommandRunner):
             formatters.add_info_formatter(
                 WildcardFormatter(options.wildcard_file))
         
+        if options.collapse_duplicates and (
+                options.info_file or not modifiers.collapsible):
+            raise ValueError(
+                "Duplicate collapsing requires that reads are only modified "
+                "based on their sequences (e.g. no quality trimming), and "
+                "cannot be used with --info-file")
+        
+        early_filters = None
+        if options.early_filter:
+            if formatters.info_formatters or (
+                    options.stats and 'post' in options.stats):
+                raise ValueError(
+                    "Early filtering cannot be used with --info-file, "
+                    "--rest-file, --wildcard-file, or post-trimming statistics")
+            early_filters = plan_early_filters(
+                filters, modifiers, routed=formatters.seq_formatters)
+        
         if options.paired:
             mixin_class = PairedEndPipelineMixin
         else:
             mixin_class = SingleEndPipelineMixin
         writers = Writers(force_create)
-        record_handler = RecordHandler(modifiers, filters, formatters)
+        record_handler = RecordHandler(
+            modifiers, filters, formatters, early_filters)
         if options.stats:
             record_handler = StatsRecordHandlerWrapper(
                 record_handler, options.paired, options.stats,
@@ -585,7 +765,9 @@ class CommandRunner(BaseCommandRunner):
             result_handler = WorkerResultHandler(WriterResultHandler(writers))
             pipeline_class = type(
                 'TrimPipelineImpl', (mixin_class, TrimPipeline), {})
-            pipeline = pipeline_class(record_handler, result_handler)
+            pipeline = pipeline_class(
+                record_handler, result_handler, options.collapse_duplicates,
+                options.compile_handler)
             self.summary.update(mode='serial', threads=1)
             return run_interruptible(pipeline, self, raise_on_error=True)
         else:
@@ -593,6 +775,113 @@ class CommandRunner(BaseCommandRunner):
             self.summary.update(mode='parallel', threads=options.threads)
             return self.run_parallel(record_handler, writers, mixin_class)
     
+    def detect_adapters(self, adapter_cache, adapter_parser):
+        """Detect adapters in the first `options.detect_adapters` reads. The
+        reads are buffered, and are then trimmed along with the rest of the
+        input. The detection results are added to the summary.
+        
+        Args:
+            adapter_cache: The :class:`AdapterCache` of known adapters.
+            adapter_parser: The :class:`AdapterParser` used to create adapters
+                from the detected sequences.
+        
+        Returns:
+            Tuple (adapters1, adapters2) of lists with the best detected
+            adapter of each read, if any.
+        """
+        from atropos.commands.detect import (
+            HeuristicDetector, KnownContaminantDetector, PairedDetector,
+            kmer_set)
+        options = self.options
+        buffered = list(islice(self.iterable, options.detect_adapters))
+        self.iterable = chain(buffered, self.iterable)
+        records = [record for _, record in buffered]
+        if not records:
+            return [], []
+        
+        logging.getLogger().info(
+            "Detecting adapters in the first %d reads", len(records))
+        detector_name = options.adapter_detector
+        known_contaminants = None if adapter_cache.empty else adapter_cache
+        if detector_name == 'known' and known_contaminants is None:
+            logging.getLogger().warning(
+                "There are no known adapters for the 'known' adapter "
+                "detector; using the heuristic detector instead")
+            detector_name = 'heuristic'
+        if detector_name == 'known':
+            detector_class = KnownContaminantDetector
+        else:
+            detector_class = HeuristicDetector
+        detector_kmer_size = 12
+        detector_args = dict(
+            kmer_size=detector_kmer_size, n_reads=len(records),
+            known_contaminants=known_contaminants)
+        if options.paired:
+            detector = PairedDetector(detector_class, **detector_args)
+        else:
+            detector = detector_class(**detector_args)
+        for index, start in enumerate(range(0, len(records), self.size), 1):
+            batch = records[start:(start + self.size)]
+            detector.process_batch(
+                (dict(index=index, source=0, size=len(batch)), batch))
+        detect_summary = dict(
+            detect=dict(detector=detector_name, n_reads=len(records)))
+        detector.finish(detect_summary)
+        self.summary['detect'] = detect_summary['detect']
+        
+        detected = []
+        for read, matches in enumerate(detect_summary['detect']['matches'], 1):
+            adapters = []
+            reads = [
+                record[read - 1] if options.paired else record
+                for record in records]
+            max_adapter_len = self.max_detected_adapter_frac * max(
+                len(record.sequence) for record in reads)
+            # Same choice of sequence as for the detect command's fasta output,
+            # except that sequences that cover almost the whole read are
+            # skipped in favor of the next (possibly known) match.
+            match = None
+            for candidate in matches:
+                if (
+                        candidate['is_known'] or
+                        len(candidate['longest_kmer']) < max_adapter_len):
+                    match = candidate
+                    break
+                logging.getLogger().info(
+                    "Ignoring detected sequence %s for read %d: it covers "
+                    "almost the whole read, so it is more likely a duplicated "
+                    "read than an adapter", candidate['longest_kmer'], read)
+            if match:
+                if match['is_known']:
+                    # Known contaminants are matched in both orientations, so
+                    # use the orientation that shares more kmers with the
+                    # reads.
+                    name, seq = match['known_names'][0], match['known_seqs'][0]
+                    fw_kmers = kmer_set(seq, detector_kmer_size)
+                    rv_kmers = kmer_set(
+                        reverse_complement(seq), detector_kmer_size)
+                    fw_count = rv_count = 0
+                    for record in reads:
+                        read_kmers = kmer_set(
+                            record.sequence, detector_kmer_size)
+                        fw_count += len(fw_kmers & read_kmers)
+                        rv_count += len(rv_kmers & read_kmers)
+                    if rv_count > fw_count:
+                        seq = reverse_complement(seq)
+                else:
+                    name, seq = None, match['longest_kmer']
+                adapters.append(
+                    adapter_parser.parse_from_spec(seq, 'back', name))
+                logging.getLogger().info(
+                    "Detected adapter for read %d: %s", read, seq)
+            else:
+                logging.getLogger().warning(
+                    "No adapter detected for read %d", read)
+            detected.append(adapters)
+        if len(detected) == 1:
+            detected.append([])
+        return tuple(detected)
+    
     def run_parallel(self, record_handler, writers, mixin_class):
         """Parallel implementation of run_atropos. Works as follows:
         
@@ -963,7 +1252,9 @@ class CommandRunner(BaseCommandRunner):
         pipeline_class = type(
             'TrimPipelineImpl',
             (ParallelPipelineMixin, mixin_class, TrimPipeline), {})
-        pipeline = pipeline_class(record_handler, worker_result_handler)
+        pipeline = pipeline_class(
+            record_handler, worker_result_handler,
+            self.collapse_duplicates, self.compile_handler)
         runner = ParallelTrimPipelineRunner(
             self, pipeline, threads, writer_manager)
         return runner.run()
@@ -2,8 +2,14 @@
 # cython: profile=False, emit_code_comments=False
 """
 Quality trimming.
+
+Sequences and qualities are ASCII strings, which CPython stores as one byte
+per character, so the loops below read the string buffers directly rather than
+indexing the str and calling ord() on each character.
 """
 
+from atropos.util._util cimport _ascii_buffer
+
 def quality_trim_index(str qualities, int cutoff_front, int cutoff_back, int base=33):
     """
     Find the positions at which to trim low-quality ends from a nucleotide sequence.
@@ -19,15 +25,17 @@ def quality_trim_index(str qualities, int cutoff_front, int cutoff_back, int bas
     """
     cdef int s
     cdef int max_qual
-    cdef int stop = len(qualities)
+    cdef int n = len(qualities)
+    cdef int stop = n
     cdef int start = 0
     cdef int i
+    cdef const unsigned char* quals = _ascii_buffer(qualities)
 
     # find trim position for 5' end
     s = 0
     max_qual = 0
-    for i in range(len(qualities)):
-        s += cutoff_front - (ord(qualities[i]) - base)
+    for i in range(n):
+        s += cutoff_front - (quals[i] - base)
         if s < 0:
             break
         if s > max_qual:
@@ -37,8 +45,8 @@ def quality_trim_index(str qualities, int cutoff_front, int cutoff_back, int bas
     # same for 3' end
     max_qual = 0
     s = 0
-    for i in reversed(range(len(qualities))):
-        s += cutoff_back - (ord(qualities[i]) - base)
+    for i in range(n - 1, -1, -1):
+        s += cutoff_back - (quals[i] - base)
         if s < 0:
             break
         if s > max_qual:
@@ -60,20 +68,18 @@ def nextseq_trim_index(sequence, int cutoff, int base=33):
     This routine works as the one above, but counts qualities belonging to 'G'
     bases as being equal to cutoff - 1.
     """
-    bases = sequence.sequence
-    qualities = sequence.qualities
+    cdef str qualities = sequence.qualities
+    cdef const unsigned char* bases = _ascii_buffer(sequence.sequence)
+    cdef const unsigned char* quals = _ascii_buffer(qualities)
     cdef:
         int s = 0
         int max_qual = 0
         int max_i = len(qualities)
         int i, q
 
-    s = 0
-    max_qual = 0
-    max_i = len(qualities)
-    for i in reversed(xrange(max_i)):
-        q = ord(qualities[i]) - base
-        if bases[i] == 'G':
+    for i in range(max_i - 1, -1, -1):
+        q = quals[i] - base
+        if bases[i] == b'G':
             q = cutoff - 1
         s += cutoff - q
         if s < 0:
@@ -82,3 +88,57 @@ def nextseq_trim_index(sequence, int cutoff, int base=33):
             max_qual = s
             max_i = i
     return max_i
+
+
+def nend_trim_index(str sequence):
+    """
+    Find the positions at which to trim runs of N from the ends of a sequence.
+    Return tuple (start, stop), where start is the length of the leading run
+    and stop is the position at which the trailing run begins (so an all-N
+    sequence gives (len(sequence), 0)).
+    """
+    cdef int n = len(sequence)
+    cdef int start = 0
+    cdef int stop = n
+    cdef const unsigned char* bases = _ascii_buffer(sequence)
+    while start < n and bases[start] == b'N':
+        start += 1
+    while stop > 0 and bases[stop - 1] == b'N':
+        stop -= 1
+    return (start, stop)
+
+
+def mean_quality(str qualities, int base=33):
+    """
+    Return the mean of the quality values encoded in qualities.
+    """
+    cdef int n = len(qualities)
+    cdef long total = 0
+    cdef int i
+    cdef const unsigned char* quals = _ascii_buffer(qualities)
+    if n == 0:
+        raise ValueError("Cannot determine the mean of an empty sequence")
+    for i in range(n):
+        total += quals[i] - base
+    return <double>total / n
+
+
+def zero_cap_qualities(str qualities, int base=33):
+    """
+    Return qualities with all negative quality values (characters < base)
+    replaced by zero (chr(base)). Returns qualities itself if there are none.
+    """
+    cdef int n = len(qualities)
+    cdef int i
+    cdef const unsigned char* quals = _ascii_buffer(qualities)
+    cdef bytearray capped
+    for i in range(n):
+        if quals[i] < base:
+            break
+    else:
+        return qualities
+    capped = bytearray(qualities, 'latin-1')
+    for i in range(i, n):
+        if capped[i] < base:
+            capped[i] = base
+    return capped.decode('latin-1')
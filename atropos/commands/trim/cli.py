@@ -79,6 +79,20 @@ standard output.
                  "-g, otherwise as with -a. This option is mostly for rescuing "
                  "failed library preparations - do not use if you know which "
                  "end your adapter was ligated to! (none)")
+        group.add_argument(
+            "--detect-adapters",
+            type=positive(), default=None, metavar="READS",
+            help="Detect adapters in the first READS reads (or read pairs), "
+                 "and trim the best detected 3' adapter of each read. The "
+                 "reads used for detection are buffered in memory and then "
+                 "trimmed with the rest of the input. Cannot be used with "
+                 "-a/-g/-b/-A/-G/-B. (no)")
+        group.add_argument(
+            "--adapter-detector",
+            choices=('known', 'heuristic'), default='heuristic',
+            help="Which detector to use with --detect-adapters; see the "
+                 "'detect' command. 'known' falls back to 'heuristic' if "
+                 "there are no known adapters. (heuristic)")
         group.add_argument(
             "-F",
             "--known-adapters-file",
@@ -175,6 +189,29 @@ standard output.
             help="If no minimum overlap (-O) is specified, then adapters are "
                  "only matched when the probabilty of observing k out of n "
                  "matching bases is <= PROB. (1E-6)")
+        group.add_argument(
+            "--alignment-cache-size",
+            type=positive(int, True), default=0, metavar="SIZE",
+            help="Cache the adapter matches for up to SIZE distinct read "
+                 "sequences (per worker process). This can greatly speed up "
+                 "trimming of libraries with many duplicate reads (e.g. "
+                 "amplicon or small RNA libraries). (0, i.e. no cache)")
+        group.add_argument(
+            "--collapse-duplicates",
+            action="store_true", default=False,
+            help="Modify reads (or read pairs) with identical sequences only "
+                 "once per batch, and copy the result to the duplicates. "
+                 "Only possible when all read modifications depend only on "
+                 "the read sequence (adapter trimming, unconditional and "
+                 "minimum cutting, N trimming). Output is unchanged. (no)")
+        group.add_argument(
+            "--compile-handler",
+            action="store_true", default=False,
+            help="Generate a function specialized for the configured "
+                 "modifiers, filters and outputs, and use it to process each "
+                 "batch of reads. This reduces the per-read overhead. Not "
+                 "used with --collapse-duplicates, --early-filter, or --stats. "
+                 "Output is unchanged. (no)")
         
         # Arguments for insert match
         group.add_argument(
@@ -334,7 +371,19 @@ standard output.
                  "it is treated as the absolute number of N bases. If it is "
                  "between 0 and 1, it is treated as the proportion of N's "
                  "allowed in a read. (no)")
-        
+        group.add_argument(
+            "--early-filter",
+            action="store_true", default=False,
+            help="Discard reads as soon as it is certain that they will be "
+                 "filtered (e.g. reads that are already too short before "
+                 "adapter trimming), rather than applying all modifications "
+                 "first. Reads written to a filter-specific output (e.g. "
+                 "--too-short-output) are still fully modified. Trimmed "
+                 "reads are unchanged, but the modification statistics in "
+                 "the report only count the reads that were not discarded "
+                 "early. Cannot be used with --info-file, --rest-file, "
+                 "--wildcard-file, or post-trimming statistics. (no)")
+
         group = self.add_group("Output")
         group.add_argument(
             "-o",
@@ -588,6 +637,12 @@ standard output.
         parser = self.parser
         paired = options.paired
         
+        if options.detect_adapters and (
+                options.adapters or options.front or options.anywhere or
+                options.adapters2 or options.front2 or options.anywhere2):
+            parser.error(
+                "--detect-adapters cannot be used with -a/-g/-b/-A/-G/-B")
+        
         if not paired:
             if not options.output:
                 parser.error("An output file is required")
@@ -625,6 +680,7 @@ standard output.
             
             # Any of these options switch off legacy mode
             if (options.adapters2 or options.front2 or options.anywhere2 or
+                    options.detect_adapters or
                     options.cut2 or options.cut_min2 or
                     options.quality_cutoff or options.trim_n or
                     options.interleaved_input or options.pair_filter or
@@ -787,6 +843,12 @@ standard output.
                     "author).")
             if options.match_read_wildcards:
                 parser.error('IUPAC wildcards not supported in colorspace')
+            if options.alignment_cache_size:
+                parser.error(
+                    "The alignment cache is not supported in colorspace.")
+            if options.collapse_duplicates:
+                parser.error(
+                    "Duplicate collapsing is not supported in colorspace.")
             options.match_adapter_wildcards = False
         else:
             if options.trim_primer:
@@ -0,0 +1,159 @@
+"""Generation of a specialized function for handling batches of records.
+
+The generic trimming code path (`RecordHandler.handle_record` ->
+`Modifiers.modify` -> `Filters.filter` -> `Formatters.format`) decides on every
+read which modifiers, filters and formatters apply and how they are wrapped.
+All of these decisions are fixed once the pipeline is configured, so here we
+generate the source of a function with a single loop in which the modifiers,
+filters and formatters are called directly, in order, with everything that is
+constant for the run (single-end vs paired-end, filter wrapping, the formatter
+for each filter) resolved at generation time.
+"""
+import logging
+from atropos import AtroposError
+from .filters import NoFilter, SingleWrapper, PairedWrapper
+from .modifiers import ReadPairModifier
+
+class HandlerSource(object):
+    """Accumulates the lines and the namespace of the generated function.
+    """
+    def __init__(self):
+        self.lines = []
+        self.namespace = dict(AtroposError=AtroposError)
+    
+    def add_line(self, indent, line):
+        """Add a line of code at the given indentation level.
+        """
+        self.lines.append(('    ' * indent) + line)
+    
+    def add_name(self, prefix, value):
+        """Add a value to the namespace of the function.
+        
+        Returns:
+            The name by which the value can be referenced in generated code.
+        """
+        name = "{}{}".format(prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+    
+    def compile(self, func_name):
+        """Compile the source and return the generated function.
+        """
+        source = '\n'.join(self.lines) + '\n'
+        code = compile(source, "<generated {}>".format(func_name), 'exec')
+        exec(code, self.namespace)
+        func = self.namespace[func_name]
+        func.source = source
+        return func
+
+def compile_record_handler(record_handler, paired):
+    """Generate a function that handles the records of a batch in the same way
+    as `record_handler`.
+    
+    Args:
+        record_handler: A :class:`atropos.commands.trim.RecordHandler`.
+        paired: Whether records are read pairs.
+    
+    Returns:
+        A function with the same signature as
+        :method:`atropos.commands.base.Pipeline.handle_records`, or None if the
+        record handler cannot be compiled (it is wrapped, e.g. to collect
+        statistics, or it uses early filters).
+    """
+    # Avoid a circular import
+    from . import RecordHandler
+    if (
+            type(record_handler) is not RecordHandler or
+            record_handler.early_filters):
+        logging.getLogger().debug(
+            "Record handler %s cannot be compiled", record_handler)
+        return None
+    
+    src = HandlerSource()
+    src.add_line(0, "def handle_records(context, records):")
+    src.add_line(1, "results = context['results']")
+    src.add_line(1, "bps = context['bp']")
+    if paired:
+        src.add_line(1, "for idx, (read1, read2) in enumerate(records):")
+        src.add_line(2, "try:")
+        src.add_line(3, "bps[0] += len(read1.sequence)")
+        src.add_line(3, "bps[1] += len(read2.sequence)")
+    else:
+        src.add_line(1, "for idx, read1 in enumerate(records):")
+        src.add_line(2, "try:")
+        src.add_line(3, "bps[0] += len(read1)")
+        src.add_line(3, "read2 = None")
+    _add_modifiers(src, 3, record_handler.modifiers, paired)
+    _add_filters(
+        src, 3, record_handler.filters, record_handler.formatters, paired)
+    src.add_line(2, "except Exception as err:")
+    src.add_line(3, "raise AtroposError(")
+    src.add_line(4, "\"An error occurred at record {} of batch {}\".format(")
+    src.add_line(4, "idx, context['index'])) from err")
+    func = src.compile('handle_records')
+    logging.getLogger().debug("Generated record handler:\n%s", func.source)
+    return func
+
+def _add_modifiers(src, indent, modifiers, paired):
+    for mods in modifiers.modifiers:
+        if isinstance(mods, ReadPairModifier):
+            src.add_line(indent, "read1, read2 = {}(read1, read2)".format(
+                src.add_name('modifier', mods.__call__)))
+            continue
+        for read, mod in zip(('read1', 'read2'), mods):
+            if mod is not None and (paired or read == 'read1'):
+                src.add_line(indent, "{0} = {1}({0})".format(
+                    read, src.add_name('modifier', mod.__call__)))
+
+def _add_filters(src, indent, filters, formatters, paired):
+    # With multiplexed output or info formatters, dispatching on the
+    # destination is left to the Formatters.
+    format_name = None
+    if formatters.multiplexed or formatters.info_formatters:
+        format_name = src.add_name('format', formatters.format)
+    formatters_name = src.add_name('formatters', formatters)
+    
+    keyword = 'if'
+    for filter_type, wrapper in filters.filters.items():
+        wrapper_name = src.add_name('wrapper', wrapper)
+        if type(wrapper) in (SingleWrapper, PairedWrapper):
+            filter_name = src.add_name('filter', wrapper.filter.__call__)
+            if type(wrapper) is SingleWrapper:
+                cond = "{}(read1)".format(filter_name)
+            elif wrapper.min_affected == 1:
+                cond = "{0}(read1) or read2 is None or {0}(read2)".format(
+                    filter_name)
+            else:
+                cond = "{0}(read1) and (read2 is None or {0}(read2))".format(
+                    filter_name)
+            src.add_line(indent, "{} {}:".format(keyword, cond))
+            src.add_line(indent + 1, "{}.filtered += 1".format(wrapper_name))
+        else:
+            src.add_line(indent, "{} {}(read1, read2):".format(
+                keyword, wrapper_name))
+        _add_format(
+            src, indent + 1, filter_type, formatters, formatters_name,
+            format_name, paired)
+        keyword = 'elif'
+    
+    if keyword == 'elif':
+        src.add_line(indent, "else:")
+        indent += 1
+    _add_format(
+        src, indent, NoFilter, formatters, formatters_name,
+        format_name, paired)
+
+def _add_format(
+        src, indent, filter_type, formatters, formatters_name, format_name,
+        paired):
+    reads = "read1, read2" if paired else "read1"
+    if format_name:
+        src.add_line(indent, "{}(results, {}, read1, read2)".format(
+            format_name, src.add_name('dest', filter_type)))
+    elif filter_type in formatters.seq_formatters:
+        src.add_line(indent, "{}(results, {})".format(
+            src.add_name(
+                'formatter', formatters.seq_formatters[filter_type].format),
+            reads))
+    else:
+        src.add_line(indent, "{}.discarded += 1".format(formatters_name))
@@ -11,6 +11,7 @@ determine whether and where to write the read(s) based on whether it was rejecte
 by a filter, and which one.
 """
 from collections import OrderedDict
+from atropos.util import count_n
 
 # Constants used when returning from a Filter’s __call__ method to improve
 # readability (it is unintuitive that "return True" means "discard the read").
@@ -116,6 +117,9 @@ class TooShortReadFilter(object):
     """Returns True if the read sequence is shorter than `minimum_length`.
     """
     name = "too_short"
+    # Trimming cannot make a read longer, so a read that is too short stays
+    # too short.
+    monotonic_verdict = DISCARD
     
     def __init__(self, minimum_length):
         self.minimum_length = minimum_length
@@ -127,6 +131,9 @@ class TooLongReadFilter(object):
     """Returns True if the read sequence is longer than `maximum_length`.
     """
     name = "too_long"
+    # Trimming cannot make a read longer, so a read that is short enough stays
+    # short enough.
+    monotonic_verdict = KEEP
     
     def __init__(self, maximum_length):
         self.maximum_length = maximum_length
@@ -155,7 +162,7 @@ class NContentFilter(object):
     def __call__(self, read):
         """Return True when the read should be discarded.
         """
-        n_count = read.sequence.lower().count('n')
+        n_count = count_n(read.sequence)
         if self.is_proportion:
             if len(read) == 0:
                 return False
@@ -230,3 +237,79 @@ class Filters(object):
         return dict(
             (f.name, f.summarize())
             for f in self.filters.values())
+
+class EarlyFilters(object):
+    """Applies filters at points in the modifier chain where their verdict can
+    no longer change, so that reads which are going to be discarded can skip
+    the remaining (potentially expensive) modifiers.
+    
+    Args:
+        checkpoints: List of tuples (index, checks), where index is the
+            position in the modifier chain before which the checks are
+            applied, and checks is a list of tuples (filter_type, wrapper,
+            final_verdicts, discarded), one for each filter up to the last one
+            that can discard a read at that point, in filter order.
+    """
+    def __init__(self, checkpoints):
+        self.checkpoints = checkpoints
+    
+    def filter(self, checks, read1, read2=None):
+        """Apply the checks of a checkpoint to a read/pair.
+        
+        Returns:
+            The filter type by which the read/pair is discarded, or None if
+            the read/pair might still be kept or written to a filter-specific
+            output.
+        """
+        for filter_type, wrapper, final_verdicts, discarded in checks:
+            verdict = DISCARD if wrapper._filter(read1, read2) else KEEP
+            if verdict not in final_verdicts:
+                return None
+            if verdict == DISCARD:
+                if not discarded:
+                    return None
+                wrapper.filtered += 1
+                return filter_type
+        return None
+
+def plan_early_filters(filters, modifiers, routed=()):
+    """Determine at which points in the modifier chain filters can be
+    applied early. A filter's verdict is final at a given point if all of the
+    remaining modifiers are filter-neutral. In addition, if none of the
+    remaining modifiers can make a read longer, then the verdict of a length
+    filter is final when it is the filter's `monotonic_verdict`. A read is only
+    discarded at a checkpoint if the verdicts of all preceding filters are also
+    final.
+    
+    Args:
+        filters: The :class:`Filters`.
+        modifiers: The :class:`atropos.commands.trim.modifiers.Modifiers`.
+        routed: Filter types whose reads are written to an output file; these
+            need to be fully modified, so they are never discarded early.
+    
+    Returns:
+        A :class:`EarlyFilters`, or None if no filter can be applied early.
+    """
+    checkpoints = []
+    for index, (lengthens, filter_neutral) in enumerate(
+            modifiers.get_remaining_effects()):
+        checks = []
+        num_useful = 0
+        for filter_type, wrapper in filters.filters.items():
+            if filter_neutral:
+                final_verdicts = (DISCARD, KEEP)
+            else:
+                monotonic_verdict = getattr(
+                    wrapper.filter, 'monotonic_verdict', None)
+                if lengthens or monotonic_verdict is None:
+                    break
+                final_verdicts = (monotonic_verdict,)
+            discarded = filter_type not in routed
+            checks.append((filter_type, wrapper, final_verdicts, discarded))
+            if discarded and DISCARD in final_verdicts:
+                num_useful = len(checks)
+        if num_useful:
+            checkpoints.append((index, checks[:num_useful]))
+    if checkpoints:
+        return EarlyFilters(checkpoints)
+    return None
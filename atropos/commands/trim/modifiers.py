@@ -8,16 +8,42 @@ from collections import OrderedDict
 import copy
 import re
 from atropos import AtroposError
+from atropos.adapters import Adapter, BarcodeIndex, PREFIX, SUFFIX
 from atropos.align import (
-    Aligner, InsertAligner, SEMIGLOBAL, START_WITHIN_SEQ1, STOP_WITHIN_SEQ2)
-from atropos.util import BASE_COMPLEMENTS, reverse_complement, mean, quals2ints
-from .qualtrim import quality_trim_index, nextseq_trim_index
+    AhoCorasick, Aligner, InsertAligner, SEMIGLOBAL, START_WITHIN_SEQ1,
+    STOP_WITHIN_SEQ2, compare_prefixes, correct_mismatches)
+from atropos.util import (
+    LRUCache, reverse_complement, mean, quals2ints)
+from .qualtrim import (
+    quality_trim_index, nextseq_trim_index, nend_trim_index, mean_quality,
+    zero_cap_qualities)
 
 # Base classes
 
 class Modifier(object):
     """Base clas for modifiers.
     """
+    # Whether the result of this modifier depends only on the read sequence
+    # (and not on the name or qualities), and the modifier only trims, masks,
+    # or annotates the read. If so, reads with identical sequences can be
+    # modified once using `modify_duplicates`.
+    collapsible = False
+    
+    # Whether this modifier can make a read longer.
+    lengthens = True
+    
+    # Whether this modifier changes nothing that a filter inspects (the
+    # sequence, its length, or the match/merge annotations), i.e. it only edits
+    # the name or the qualities.
+    filter_neutral = False
+    
+    def modify_duplicates(self, read, count):
+        """Modify a read that stands for `count` reads with identical
+        sequences. The statistics are updated as though each of the reads had
+        been modified separately. Only supported by collapsible modifiers.
+        """
+        raise NotImplementedError()
+    
     @property
     def name(self):
         """Modifier name.
@@ -44,12 +70,20 @@ class ReadPairModifier(Modifier):
 class Trimmer(Modifier):
     """Base class of modifiers that trim bases from reads.
     """
+    lengthens = False
+    
     def __init__(self):
         self.trimmed_bases = 0
     
     def __call__(self, read):
         raise NotImplementedError()
     
+    def modify_duplicates(self, read, count):
+        trimmed_bases = self.trimmed_bases
+        read = self(read)
+        self.trimmed_bases += (self.trimmed_bases - trimmed_bases) * (count - 1)
+        return read
+    
     def subseq(self, read, begin=0, end=None):
         """Returns a subsequence of a read.
         
@@ -95,23 +129,106 @@ class AdapterCutter(Modifier):
         adapters: List of Adapter objects.
         times: Number of times to trim.
         action: What to do with a found adapter: None, 'trim', or 'mask'
+        record_match_info: Whether to set `match_info` on trimmed reads. This
+            is only required by the info file and by modifiers that inspect
+            the adapter matches (e.g. :class:`MinCutter`).
+        cache_size: If > 0, the adapter matches for up to this many distinct
+            read sequences are cached, so that duplicate reads do not need to
+            be re-aligned. Adapter statistics are still updated for every
+            read. Not supported for linked or colorspace adapters.
     """
-    def __init__(self, adapters=None, times=1, action='trim'):
+    collapsible = True
+    lengthens = False
+    
+    def __init__(
+            self, adapters=None, times=1, action='trim',
+            record_match_info=True, cache_size=0):
         super(AdapterCutter, self).__init__()
         self.adapters = adapters or []
         self.times = times
         self.action = action
+        self.record_match_info = record_match_info
+        self.cache = LRUCache(cache_size) if cache_size else None
         self.with_adapters = 0
-
+        # Exact occurrences of the adapters that may occur anywhere in the read
+        # (and that are matched literally) are found with a single pass of an
+        # Aho-Corasick automaton rather than one scan of the read per adapter.
+        self.exact_indexes = [
+            i for i, adapter in enumerate(self.adapters)
+            if isinstance(adapter, Adapter) and
+            not adapter.adapter_wildcards and
+            adapter.where not in (PREFIX, SUFFIX)]
+        self.automaton = None
+        if len(self.exact_indexes) > 1:
+            self.automaton = AhoCorasick(
+                self.adapters[i].sequence for i in self.exact_indexes)
+        else:
+            self.exact_indexes = []
+        self._exact_index_set = frozenset(self.exact_indexes)
+        # Fixed-position barcodes are matched by a single table lookup.
+        self.barcode_index = None
+        if BarcodeIndex.supports(self.adapters):
+            self.barcode_index = BarcodeIndex(self.adapters)
+    
+    def _exact_matches(self, read):
+        """Find the exact matches of the adapters in the automaton.
+        
+        Returns:
+            A dict mapping adapter index to Match instance.
+        """
+        starts = self.automaton.find_first(read.sequence.upper())
+        return dict(
+            (i, self.adapters[i].exact_match(read, pos))
+            for i, pos in zip(self.exact_indexes, starts)
+            if pos >= 0)
+    
+    def _cannot_beat(self, index, best_exact):
+        """Whether the adapter at `index` (which has no exact match) cannot
+        beat the best exact match, given as an (index, Match) tuple. An
+        approximate match cannot have more matches than the adapter is long,
+        and it can only match every adapter base if it has indels or matches
+        wildcards in the read. Ties go to the adapter that comes first.
+        """
+        adapter = self.adapters[index]
+        best_index, best_match = best_exact
+        if len(adapter) != best_match.matches:
+            return len(adapter) < best_match.matches
+        return (
+            index > best_index or
+            index in self._exact_index_set and
+            not (adapter.indels or adapter.read_wildcards))
+    
     def _best_match(self, read):
         """Find the best matching adapter in the given read.
         
         Returns:
             Either a Match instance or None if there are no matches.
         """
+        if self.barcode_index is not None:
+            read_seq = read.sequence.upper()
+            if self.barcode_index.covers(read_seq):
+                return self.barcode_index.match_to(read, read_seq)
+        
+        exact_matches = {}
+        best_exact = None
+        if self.automaton is not None:
+            exact_matches = self._exact_matches(read)
+            if exact_matches:
+                best_exact = min(
+                    exact_matches.items(),
+                    key=lambda item: (-item[1].matches, item[0]))
+        
         best = None
-        for adapter in self.adapters:
-            match = adapter.match_to(read)
+        for i, adapter in enumerate(self.adapters):
+            if i in exact_matches:
+                match = exact_matches[i]
+            elif best_exact and self._cannot_beat(i, best_exact):
+                continue
+            elif i in self._exact_index_set:
+                # the automaton found no exact match
+                match = adapter.match_to(read, try_exact=False)
+            else:
+                match = adapter.match_to(read)
             if match is None:
                 continue
             
@@ -132,20 +249,42 @@ class AdapterCutter(Modifier):
         
         Cut found adapters from a single read. Return modified read.
         """
+        return self._cut(read, 1)
+    
+    def modify_duplicates(self, read, count):
+        return self._cut(read, count)
+    
+    def _cut(self, read, count):
         if len(read) == 0:
             return read
         
         matches = []
-        
-        # try at most self.times times to remove an adapter
         trimmed_read = read
-        for _ in range(self.times):
-            match = self._best_match(trimmed_read)
-            if match is None:
-                # nothing found
-                break
-            matches.append(match)
-            trimmed_read = match.adapter.trimmed(match)
+        
+        cached_matches = None
+        if self.cache is not None:
+            cached_matches = self.cache.get(read.sequence)
+        
+        if cached_matches is not None:
+            # replay the cached matches against this read; trimming updates
+            # the adapter statistics
+            for cached_match in cached_matches:
+                match = cached_match.copy()
+                match.read = trimmed_read
+                matches.append(match)
+                trimmed_read = match.adapter.trimmed(match, count)
+        else:
+            # try at most self.times times to remove an adapter
+            for _ in range(self.times):
+                match = self._best_match(trimmed_read)
+                if match is None:
+                    # nothing found
+                    break
+                matches.append(match)
+                trimmed_read = match.adapter.trimmed(match, count)
+            
+            if self.cache is not None:
+                self.cache.put(read.sequence, self._cacheable(matches))
         
         if not matches:
             trimmed_read.match = None
@@ -165,7 +304,7 @@ class AdapterCutter(Modifier):
             for match in sorted(matches, reverse=True, key=lambda m: m.astart):
                 nstr = 'N' * (
                     len(match.read.sequence) -
-                    len(match.adapter.trimmed(match).sequence))
+                    len(match.adapter.trimmed(match, count).sequence))
                 # add N depending on match position
                 if match.front:
                     masked_sequence = nstr + masked_sequence
@@ -180,18 +319,36 @@ class AdapterCutter(Modifier):
             trimmed_read = read
         
         trimmed_read.match = matches[-1]
-        trimmed_read.match_info = [match.get_info_record() for match in matches]
+        if self.record_match_info:
+            trimmed_read.match_info = [
+                match.get_info_record() for match in matches]
+        else:
+            trimmed_read.match_info = None
         
-        self.with_adapters += 1
+        self.with_adapters += count
         return trimmed_read
     
+    @staticmethod
+    def _cacheable(matches):
+        """Returns copies of `matches` that do not reference a read.
+        """
+        cached_matches = []
+        for match in matches:
+            match = match.copy()
+            match.read = None
+            cached_matches.append(match)
+        return tuple(cached_matches)
+    
     def summarize(self):
         adapters_summary = OrderedDict()
         for adapter in self.adapters:
             adapters_summary[adapter.name] = adapter.summarize()
-        return dict(
+        summary = dict(
             records_with_adapters=self.with_adapters,
             adapters=adapters_summary)
+        if self.cache is not None:
+            summary.update(self.cache.summarize())
+        return summary
 
 # Other error correction approaches:
 # https://www.ncbi.nlm.nih.gov/pubmed/25161220
@@ -209,8 +366,7 @@ class ErrorCorrectorMixin(object):
     """
     def __init__(self, mismatch_action=None, min_qual_difference=1):
         self.mismatch_action = mismatch_action
-        self.r1r2_min_qual_difference = min_qual_difference
-        self.r2r1_min_qual_difference = -1 * min_qual_difference
+        self.min_qual_difference = min_qual_difference
         self.corrected_pairs = 0
         self.corrected_bp = [0, 0]
     
@@ -225,97 +381,36 @@ class ErrorCorrectorMixin(object):
         if read1.corrected > 0 or read2.corrected > 0:
             return
         
-        # read2 reverse-complement is the reference, read1 is the query
-        r1_seq = list(read1.sequence)
-        r2_seq = list(read2.sequence)
-        len2 = len(r2_seq)
-        
         has_quals = read1.qualities and read2.qualities
-        if has_quals:
-            r1_qual = list(read1.qualities)
-            r2_qual = list(read2.qualities)
-        elif self.mismatch_action in ('liberal', 'conservative'):
+        if not has_quals and self.mismatch_action in ('liberal', 'conservative'):
             raise ValueError(
                 "Cannot perform quality-based error correction on reads "
                 "lacking quality information")
         
-        r1_start = insert_match[2]
-        r1_end = insert_match[3]
-        r1_changed = 0
-        r2_start = len2 - insert_match[1]
-        r2_end = len2 - insert_match[0]
-        r2_changed = 0
-        quals_equal = []
-        
-        for i, j in zip(
-                range(r1_start, r1_end), range(r2_end - 1, r2_start, -1)):
-            base1 = r1_seq[i]
-            base2 = BASE_COMPLEMENTS[r2_seq[j]]
-            if base1 == base2:
-                continue
-            if self.mismatch_action == 'N':
-                r1_seq[i] = 'N'
-                r2_seq[j] = 'N'
-                r1_changed += 1
-                r2_changed += 1
-            elif base1 == 'N':
-                r1_seq[i] = base2
-                if has_quals:
-                    r1_qual[i] = r2_qual[j]
-                r1_changed += 1
-            elif base2 == 'N':
-                r2_seq[j] = BASE_COMPLEMENTS[base1]
-                if has_quals:
-                    r2_qual[j] = r1_qual[i]
-                r2_changed += 1
-            elif has_quals:
-                diff = ord(r1_qual[i]) - ord(r2_qual[j])
-                if diff >= self.r1r2_min_qual_difference:
-                    r2_seq[j] = BASE_COMPLEMENTS[base1]
-                    r2_qual[j] = r1_qual[i]
-                    r2_changed += 1
-                elif diff <= self.r2r1_min_qual_difference:
-                    r1_seq[i] = base2
-                    r1_qual[i] = r2_qual[j]
-                    r1_changed += 1
-                elif self.mismatch_action == 'liberal':
-                    quals_equal.append((i, j, base1, base2))
-        
-        if quals_equal:
-            mean_qual1 = mean([ord(b) for b in r1_qual[r1_start:r1_end]])
-            mean_qual2 = mean([ord(b) for b in r2_qual[r2_start:r2_end]])
-            # Only make the corrections if one read is significantly better
-            # than the other.
-            # TODO: this method of determining whether one read is better
-            # than the other is crude - come up with something better.
-            diff = mean_qual1 - mean_qual2
-            if diff > 1:
-                # read1 is better than read2
-                for i, j, base1, base2 in quals_equal:
-                    r2_seq[j] = BASE_COMPLEMENTS[base1]
-                    r2_qual[j] = r1_qual[i]
-                    r2_changed += 1
-            elif diff < -1:
-                # read2 is better than read1
-                for i, j, base1, base2 in quals_equal:
-                    r1_seq[i] = base2
-                    r1_qual[i] = r2_qual[j]
-                    r1_changed += 1
+        # read2 reverse-complement is the reference, read1 is the query
+        len2 = len(read2)
+        r1_seq, r1_qual, r1_changed, r2_seq, r2_qual, r2_changed = \
+            correct_mismatches(
+                read1.sequence, read1.qualities if has_quals else None,
+                read2.sequence, read2.qualities if has_quals else None,
+                insert_match[2], insert_match[3], len2 - insert_match[1],
+                len2 - insert_match[0], self.mismatch_action,
+                self.min_qual_difference)
         
         if r1_changed or r2_changed:
             self.corrected_pairs += 1
             if r1_changed:
                 self.corrected_bp[0] += r1_changed
-                read1.sequence = ''.join(r1_seq)
+                read1.sequence = r1_seq
                 read1.corrected = r1_changed
                 if has_quals:
-                    read1.qualities = ''.join(r1_qual)
+                    read1.qualities = r1_qual
             if r2_changed:
                 self.corrected_bp[1] += r2_changed
-                read2.sequence = ''.join(r2_seq)
+                read2.sequence = r2_seq
                 read2.corrected = r2_changed
                 if has_quals:
-                    read2.qualities = ''.join(r2_qual)
+                    read2.qualities = r2_qual
     
     def summarize(self):
         """Returns a summary dict.
@@ -339,11 +434,15 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
             same place on overlapping reads.
         min_insert_overlap: Minimum overlap required between reads to be
             considered an insert match.
+        record_match_info: Whether to set `match_info` on trimmed reads.
         aligner_args: Additional arguments to :class:`InsertAligner`.
     """
+    lengthens = False
+    
     def __init__(
             self, adapter1, adapter2, action='trim', mismatch_action=None,
-            symmetric=True, min_insert_overlap=1, **aligner_args):
+            symmetric=True, min_insert_overlap=1, record_match_info=True,
+            **aligner_args):
         ErrorCorrectorMixin.__init__(self, mismatch_action)
         self.adapter1 = adapter1
         self.adapter2 = adapter2
@@ -353,6 +452,7 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
         self.min_insert_len = min_insert_overlap
         self.action = action
         self.symmetric = symmetric
+        self.record_match_info = record_match_info
         self.with_adapters = [0, 0]
     
     def __call__(self, read1, read2):
@@ -360,7 +460,8 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
         if any(l < self.min_insert_len for l in read_lengths):
             return (read1, read2)
         
-        match = self.aligner.match_insert(read1.sequence, read2.sequence)
+        match = self.aligner.match_insert(
+            read1.sequence, read2.sequence, read1.packed, read2.packed)
         read1.insert_overlap = read2.insert_overlap = (match is not None)
         insert_match = None
         correct_errors = False
@@ -400,9 +501,17 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
         if correct_errors:
             self.correct_errors(read1, read2, insert_match)
         
-        return (
-            self.trim(read1, self.adapter1, adapter_match1, 0),
-            self.trim(read2, self.adapter2, adapter_match2, 1))
+        read1 = self.trim(read1, self.adapter1, adapter_match1, 0)
+        read2 = self.trim(read2, self.adapter2, adapter_match2, 1)
+        
+        if (
+                match and adapter_match1 and adapter_match2 and
+                self.action == 'trim' and len(read1) == len(read2)):
+            # Both reads have been trimmed to the insert, so they overlap
+            # exactly; record this so that MergeOverlapping need not realign.
+            read1.insert_sequences = (read1.sequence, read2.sequence)
+        
+        return (read1, read2)
     
     def trim(self, read, adapter, match, read_idx):
         """Trim an adapter from a read.
@@ -442,7 +551,10 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
                 pass
         
         trimmed_read.match = match
-        trimmed_read.match_info = [match.get_info_record()]
+        if self.record_match_info:
+            trimmed_read.match_info = [match.get_info_record()]
+        else:
+            trimmed_read.match_info = None
         
         self.with_adapters[read_idx] += 1
         return trimmed_read
@@ -494,11 +606,8 @@ class OverwriteRead(ReadPairModifier):
             raise ValueError(
                 "OverwriteRead modifier does not work with reads "
                 "lacking base qualities.")
-        qual1 = list(quals2ints(read1.qualities[:self.window_size], self.base))
-        summ1 = self.summary_fn(qual1)
-        
-        qual2 = list(quals2ints(read2.qualities[:self.window_size], self.base))
-        summ2 = self.summary_fn(qual2)
+        summ1 = self._summarize(read1.qualities[:self.window_size])
+        summ2 = self._summarize(read2.qualities[:self.window_size])
         
         if (
                 summ1 < self.worse_read_min_quality and
@@ -513,6 +622,11 @@ class OverwriteRead(ReadPairModifier):
             read2 = read1.reverse_complement()
         
         return (read1, read2)
+    
+    def _summarize(self, qualities):
+        if self.summary_fn is mean:
+            return mean_quality(qualities, self.base)
+        return self.summary_fn(list(quals2ints(qualities, self.base)))
 
 class UnconditionalCutter(Trimmer):
     """A modifier that unconditionally removes the first n or the last n bases
@@ -525,6 +639,7 @@ class UnconditionalCutter(Trimmer):
     read.
     """
     display_str = "Cut unconditionally"
+    collapsible = True
     
     def __init__(self, lengths=None):
         super().__init__()
@@ -550,6 +665,7 @@ class MinCutter(Trimmer):
             adapter-trimmed.
     """
     display_str = "Cut conditionally"
+    collapsible = True
     
     def __init__(self, lengths=None, count_trimmed=True, only_trimmed=False):
         super().__init__()
@@ -604,6 +720,9 @@ class MinCutter(Trimmer):
 class LengthTagModifier(Modifier):
     """Replace "length=..." strings in read names.
     """
+    lengthens = False
+    filter_neutral = True
+    
     def __init__(self, length_tag="length="):
         self.regex = re.compile(r"\b" + length_tag + r"[0-9]*\b")
         self.length_tag = length_tag
@@ -618,6 +737,9 @@ class LengthTagModifier(Modifier):
 class SuffixRemover(Modifier):
     """Remove a given suffix from read names.
     """
+    lengthens = False
+    filter_neutral = True
+    
     def __init__(self, suffixes=None):
         self.suffixes = suffixes or []
     
@@ -633,6 +755,9 @@ class SuffixRemover(Modifier):
 class PrefixSuffixAdder(Modifier):
     """Add a suffix and a prefix to read names.
     """
+    lengthens = False
+    filter_neutral = True
+    
     def __init__(self, prefix="", suffix=""):
         self.prefix = prefix
         self.suffix = suffix
@@ -650,6 +775,8 @@ class DoubleEncoder(Modifier):
     """Double-encode colorspace reads, using characters ACGTN to represent
     colors.
     """
+    lengthens = False
+    
     def __init__(self):
         self.double_encode_trans = str.maketrans('0123.', 'ACGTN')
     
@@ -661,14 +788,15 @@ class DoubleEncoder(Modifier):
 class ZeroCapper(Modifier):
     """Change negative quality values of a read to zero
     """
+    lengthens = False
+    filter_neutral = True
+    
     def __init__(self, quality_base=33):
-        qbase = quality_base
-        self.zero_cap_trans = str.maketrans(
-            ''.join(map(chr, range(qbase))), chr(qbase) * qbase)
+        self.quality_base = quality_base
     
     def __call__(self, read):
         read = read[:]
-        read.qualities = read.qualities.translate(self.zero_cap_trans)
+        read.qualities = zero_cap_qualities(read.qualities, self.quality_base)
         return read
 
 class PrimerTrimmer(Trimmer):
@@ -719,20 +847,12 @@ class NEndTrimmer(Trimmer):
     """Trims Ns from the 3' and 5' end of reads.
     """
     display_str = "End Ns trimmed"
-    
-    def __init__(self):
-        super(NEndTrimmer, self).__init__()
-        self.start_trim = re.compile(r'^N+')
-        self.end_trim = re.compile(r'N+$')
+    collapsible = True
     
     def __call__(self, read):
         if len(read) == 0:
             return read
-        sequence = read.sequence
-        start_cut = self.start_trim.match(sequence)
-        end_cut = self.end_trim.search(sequence)
-        start_cut = start_cut.end() if start_cut else 0
-        end_cut = end_cut.start() if end_cut else len(read)
+        start_cut, end_cut = nend_trim_index(read.sequence)
         return self.subseq(read, start_cut, end_cut)
 
 class RRBSTrimmer(MinCutter):
@@ -756,6 +876,7 @@ class NonDirectionalBisulfiteTrimmer(Modifier):
     """
     display_str = "Bisulfite-trimmed (Non-directional)"
     _regex = re.compile(r"^C[AG]A")
+    lengthens = False
     
     def __init__(self, trim_5p=2, trim_3p=2, rrbs=False):
         self._non_directional_cutter = MinCutter(
@@ -795,6 +916,7 @@ class SwiftBisulfiteTrimmer(ReadPairModifier):
     trimmed  off the end of read1 and the beginning of read2.
     """
     display_str = "Bisulfite-trimmed (Swift)"
+    lengthens = False
     
     def __init__(self, trim_5p1=0, trim_3p1=10, trim_5p2=10, trim_3p2=0):
         self._read1_cutter = MinCutter(
@@ -820,6 +942,30 @@ class MergeOverlapping(ReadPairModifier, ErrorCorrectorMixin):
         ErrorCorrectorMixin.__init__(self, mismatch_action)
         self.min_overlap = int(min_overlap) if min_overlap > 1 else min_overlap
         self.error_rate = error_rate
+        # Aligners are retargeted to each read pair rather than recreated;
+        # one per combination of alignment flags.
+        self.aligners = {}
+    
+    def _get_aligner(self, flags):
+        if flags not in self.aligners:
+            self.aligners[flags] = Aligner('', self.error_rate, flags)
+        return self.aligners[flags]
+    
+    def _known_overlap(self, read1, read2, read2_rc):
+        """If InsertAdapterCutter trimmed both reads to the insert (and they
+        have not been modified since), returns the ungapped alignment of the
+        full-length overlap, provided it is within the error rate.
+        """
+        insert_sequences = read1.insert_sequences
+        if not (
+                insert_sequences and
+                insert_sequences[0] is read1.sequence and
+                insert_sequences[1] is read2.sequence):
+            return None
+        alignment = compare_prefixes(read2_rc, read1.sequence)
+        if alignment[5] > self.error_rate * alignment[1]:
+            return None
+        return alignment
     
     def __call__(self, read1, read2):
         len1 = len(read1.sequence)
@@ -842,8 +988,11 @@ class MergeOverlapping(ReadPairModifier, ErrorCorrectorMixin):
         # align read1 to read2 reverse-complement to be compatible with
         # InsertAligner
         read2_rc = reverse_complement(read2.sequence)
-        aligner = Aligner(read2_rc, self.error_rate, aflags)
-        alignment = aligner.locate(read1.sequence)
+        alignment = self._known_overlap(read1, read2, read2_rc)
+        if alignment is None:
+            aligner = self._get_aligner(aflags)
+            aligner.reference = read2_rc
+            alignment = aligner.locate(read1.sequence)
         
         if alignment:
             r2_start, r2_stop, r1_start, r1_stop, matches, errors = alignment
@@ -952,6 +1101,19 @@ class Modifiers(object):
                 read_mods.append(mod[read-1])
         return read_mods
     
+    @property
+    def collapsible(self):
+        """Whether all registered modifiers are collapsible, i.e. reads with
+        identical sequences can be modified once using
+        :method:`modify_duplicates`.
+        """
+        for mods in self.modifiers:
+            if isinstance(mods, ReadPairModifier):
+                return False
+            if not all(mod.collapsible for mod in mods if mod is not None):
+                return False
+        return True
+    
     def get_adapters(self):
         """Returns the adapters from the AdapterCutter or InsertAdapterCutter
         modifier, if any.
@@ -972,11 +1134,50 @@ class Modifiers(object):
             adapters[1] = [mod.adapter2]
         return adapters
     
-    def modify(self, read1, read2=None):
+    def get_remaining_effects(self):
+        """Describes, for each position in the modifier chain, what the
+        modifiers from that position to the end can do to a read.
+        
+        Returns:
+            A list with one tuple (lengthens, filter_neutral) per registered
+            modifier, where `lengthens` is whether any of the remaining
+            modifiers can make a read longer, and `filter_neutral` is whether
+            all of them are filter-neutral (see :class:`Modifier`).
+        """
+        effects = []
+        lengthens = False
+        filter_neutral = True
+        for mods in reversed(self.modifiers):
+            if isinstance(mods, ReadPairModifier):
+                mods = (mods,)
+            for mod in mods:
+                if mod is not None:
+                    lengthens = lengthens or mod.lengthens
+                    filter_neutral = filter_neutral and mod.filter_neutral
+            effects.append((lengthens, filter_neutral))
+        effects.reverse()
+        return effects
+    
+    def modify(self, read1, read2=None, start=0, end=None):
         """Apply registered modifiers to a read/pair.
         
         Args:
             read1, read2: The reads to modify.
+            start, end: Only apply the modifiers in this slice of the chain.
+        
+        Returns:
+            A tuple of modified reads (read1, read2).
+        """
+        raise NotImplementedError()
+    
+    def modify_duplicates(self, count, read1, read2=None):
+        """Apply registered modifiers to a read/pair that stands for `count`
+        reads/pairs with identical sequences. Requires that all modifiers are
+        collapsible.
+        
+        Args:
+            count: The number of identical reads/pairs.
+            read1, read2: The reads to modify.
         
         Returns:
             A tuple of modified reads (read1, read2).
@@ -1000,11 +1201,16 @@ class SingleEndModifiers(Modifiers):
         if read1_args is not None:
             return self.add_modifier(mod_class, **read1_args)
     
-    def modify(self, read1, read2=None):
-        for mods in self.modifiers:
+    def modify(self, read1, read2=None, start=0, end=None):
+        for mods in self.modifiers[start:end]:
             read1 = mods[0](read1)
         return (read1,)
     
+    def modify_duplicates(self, count, read1, read2=None):
+        for mods in self.modifiers:
+            read1 = mods[0].modify_duplicates(read1, count)
+        return (read1,)
+    
     def summarize(self):
         summary = {}
         for mods in self.modifiers:
@@ -1048,8 +1254,8 @@ class PairedEndModifiers(Modifiers):
         if any(mods):
             return self._add_modifiers(mod_class, mods)
     
-    def modify(self, read1, read2=None):
-        for mods in self.modifiers:
+    def modify(self, read1, read2=None, start=0, end=None):
+        for mods in self.modifiers[start:end]:
             if isinstance(mods, ReadPairModifier):
                 read1, read2 = mods(read1, read2)
             else:
@@ -1059,6 +1265,14 @@ class PairedEndModifiers(Modifiers):
                     read2 = mods[1](read2)
         return (read1, read2)
     
+    def modify_duplicates(self, count, read1, read2=None):
+        for mods in self.modifiers:
+            if mods[0] is not None:
+                read1 = mods[0].modify_duplicates(read1, count)
+            if mods[1] is not None:
+                read2 = mods[1].modify_duplicates(read2, count)
+        return (read1, read2)
+    
     def summarize(self):
         summary = {}
         for mods in self.modifiers:
@@ -3,11 +3,13 @@
 """
 # Import cythonized functions, defaulting to pure python implementations.
 try:
-    from ._qualtrim import quality_trim_index, nextseq_trim_index
+    from ._qualtrim import (
+        quality_trim_index, nextseq_trim_index, nend_trim_index, mean_quality,
+        zero_cap_qualities)
 
 except:
     import logging
-    from atropos.util import qual2int
+    from atropos.util import qual2int, quals2ints, mean
     
     logging.getLogger().debug("Import failed for cythonized qualtrim functions")
     
@@ -81,3 +83,25 @@ except:
                 max_qual = score
                 max_i = idx
         return max_i
+    
+    def nend_trim_index(sequence):
+        """Find the positions at which to trim runs of N from the ends of a
+        sequence. Return tuple (start, stop), where start is the length of the
+        leading run and stop is the position at which the trailing run begins
+        (so an all-N sequence gives (len(sequence), 0)).
+        """
+        stop = len(sequence.rstrip('N'))
+        start = len(sequence) - len(sequence.lstrip('N'))
+        return (start, stop)
+    
+    def mean_quality(qualities, base=33):
+        """Return the mean of the quality values encoded in `qualities`.
+        """
+        return mean(list(quals2ints(qualities, base)))
+    
+    def zero_cap_qualities(qualities, base=33):
+        """Return `qualities` with all negative quality values (characters
+        < base) replaced by zero (chr(base)).
+        """
+        return qualities.translate(str.maketrans(
+            ''.join(map(chr, range(base))), chr(base) * base))
@@ -3,6 +3,7 @@
 import copy
 from atropos.io import xopen
 from atropos.io.seqio import FormatError, SequenceReader
+from atropos.align._align import PackedSequence
 from atropos.util import reverse_complement, truncate_string
 
 cdef class Sequence(object):
@@ -13,6 +14,11 @@ cdef class Sequence(object):
 
     If an adapter has been matched to the sequence, the 'match' attribute is
     set to the corresponding Match instance.
+
+    If the read and its mate have been trimmed to exactly overlapping inserts,
+    'insert_sequences' is set to a tuple of the two sequences at that point, so
+    that the overlap does not have to be re-aligned as long as neither read has
+    been modified since.
     """
     cdef:
         public str name
@@ -26,6 +32,9 @@ cdef class Sequence(object):
         public bint insert_overlap
         public bint merged
         public int corrected
+        public object insert_sequences
+        object _packed
+        str _packed_sequence
     
     def __init__(self, str name, str sequence, str qualities=None, str name2='',
                  original_length=None, match=None, match_info=None, clipped=None,
@@ -49,6 +58,17 @@ cdef class Sequence(object):
                 "length  of read ({2}) do not match".format(
                     rname, len(qualities), len(sequence)))
     
+    property packed:
+        """The sequence as a :class:`atropos.align.PackedSequence`. It is
+        computed on first access and recomputed if the sequence is replaced,
+        so each read is packed once for all of the aligners that compare it.
+        """
+        def __get__(self):
+            if self._packed is None or self._packed_sequence is not self.sequence:
+                self._packed = PackedSequence(self.sequence)
+                self._packed_sequence = self.sequence
+            return self._packed
+    
     def subseq(self, begin=0, end=None):
         if end is None:
             new_read = self[begin:]
@@ -111,7 +131,7 @@ cdef class Sequence(object):
     
     def __getitem__(self, key):
         """slicing"""
-        return self.__class__(
+        new_read = self.__class__(
             self.name,
             self.sequence[key],
             self.qualities[key] if self.qualities is not None else None,
@@ -124,6 +144,9 @@ cdef class Sequence(object):
             self.merged,
             self.corrected
         )
+        # Still valid if the slice leaves the sequence unchanged
+        new_read.insert_sequences = self.insert_sequences
+        return new_read
 
     def __repr__(self):
         qstr = ''
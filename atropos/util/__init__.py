@@ -1,12 +1,17 @@
 """Widely useful utility methods.
 """
+from array import array
 from collections import OrderedDict, Iterable
+import copy
 from datetime import datetime
 import errno
 import functools
+from itertools import product
 import logging
 import math
 from numbers import Number
+from operator import add
+import sys
 import time
 from atropos import AtroposError
 
@@ -134,6 +139,21 @@ class Summarizable(object):
         """
         raise NotImplementedError()
 
+class Packable(Mergeable):
+    """Base class for counters that can be converted to a compact
+    :class:`PackedCounts`, e.g. to send them between processes.
+    """
+    def pack(self):
+        """Returns a :class:`PackedCounts` with the counts of this object.
+        """
+        raise NotImplementedError()
+    
+    def set_count(self, keys, count):
+        """Set the count of the item with key tuple `keys`; used to unpack a
+        :class:`PackedCounts`.
+        """
+        raise NotImplementedError()
+
 class Const(Mergeable):
     """A :class:`Mergeable` that is a constant value. Merging simply checks
     that two values are identical.
@@ -228,7 +248,7 @@ class Timing(Summarizable):
         summary.update(self.cur_time - self.start_time)
         return summary
 
-class CountingDict(dict, Mergeable, Summarizable):
+class CountingDict(dict, Packable, Summarizable):
     """A dictionary that always returns 0 on get of a missing key.
     
     Args:
@@ -258,6 +278,16 @@ class CountingDict(dict, Mergeable, Summarizable):
             self[key] += value
         return self
     
+    def pack(self):
+        template = self.__class__(
+            sort_by=self.sort_by, summary_type=self.summary_type)
+        return PackedCounts.from_items(
+            template, (((key,), value) for key, value in self.items()),
+            (None,))
+    
+    def set_count(self, keys, count):
+        self[keys[0]] = count
+    
     def get_sorted_items(self):
         """Returns an iterable of (key, value) sorted according to this
         CountingDict's `sort_by` param.
@@ -282,8 +312,10 @@ class Histogram(CountingDict):
     def get_summary_stats(self):
         """Returns dict with mean, median, and modes of histogram.
         """
-        values = tuple(self.keys())
-        counts = tuple(self.values())
+        # weighted_median requires sorted values
+        items = sorted(self.items())
+        values = tuple(value for value, _ in items)
+        counts = tuple(count for _, count in items)
         mu0 = weighted_mean(values, counts)
         return dict(
             mean=mu0,
@@ -291,7 +323,7 @@ class Histogram(CountingDict):
             median=weighted_median(values, counts),
             modes=weighted_modes(values, counts))
 
-class NestedDict(dict, Mergeable, Summarizable):
+class NestedDict(dict, Packable, Summarizable):
     """A dict that initalizes :class:`CountingDict`s for missing keys.
     
     Args:
@@ -317,6 +349,19 @@ class NestedDict(dict, Mergeable, Summarizable):
                 self[key] = value
         return self
     
+    def pack(self):
+        return PackedCounts.from_items(
+            self.__class__(self.shape),
+            (
+                ((key1, key2), value)
+                for key1, child in self.items()
+                for key2, value in child.items()),
+            (None, None))
+    
+    def set_count(self, keys, count):
+        key1, key2 = keys
+        self[key1][key2] = count
+    
     def summarize(self):
         """Returns a flattened version of the nested dict.
         
@@ -343,6 +388,235 @@ class NestedDict(dict, Mergeable, Summarizable):
                     (key1, tuple(self[key1].get(key2, 0) for key2 in keys2))
                     for key1 in keys1))
 
+class CountingArray(Mergeable, Summarizable):
+    """Counts of non-negative integer keys (e.g. lengths), backed by a list
+    that grows as needed. Summarizes to the same dict as a
+    :class:`CountingDict` sorted by key.
+    
+    Args:
+        size: Initial number of keys.
+    """
+    def __init__(self, size=0):
+        self.counts = [0] * size
+    
+    def __getitem__(self, key):
+        if key < len(self.counts):
+            return self.counts[key]
+        return 0
+    
+    def increment(self, key, inc=1):
+        """Increment the count of `key` by `inc`.
+        """
+        counts = self.counts
+        if key >= len(counts):
+            counts.extend([0] * (key + 1 - len(counts)))
+        counts[key] += inc
+    
+    def items(self):
+        """Returns a list of (key, count) for keys with non-zero counts.
+        """
+        return [(key, count) for key, count in enumerate(self.counts) if count]
+    
+    def values(self):
+        """Returns a list of the non-zero counts.
+        """
+        return [count for count in self.counts if count]
+    
+    def merge(self, other):
+        if not isinstance(other, CountingArray):
+            raise ValueError(
+                "Cannot merge object of type {}".format(type(other)))
+        counts, other_counts = self.counts, other.counts
+        if len(counts) < len(other_counts):
+            counts, other_counts = other_counts, counts
+        self.counts = [
+            count + other_count
+            for count, other_count in zip(counts, other_counts)
+        ] + counts[len(other_counts):]
+        return self
+    
+    def summarize(self):
+        """Returns an OrderedDict of the non-zero counts, sorted by key.
+        """
+        return ordered_dict(self.items())
+
+class CountingMatrix(Mergeable, Summarizable):
+    """Counts of pairs of non-negative integer keys (e.g. lengths and numbers
+    of errors), backed by a list of rows that grows as needed. Summarizes to
+    the same dict as a 'wide' :class:`NestedDict`.
+    
+    Args:
+        nrows, ncols: Initial numbers of rows and columns.
+    """
+    def __init__(self, nrows=0, ncols=0):
+        self.ncols = ncols
+        self.rows = [[0] * ncols for _ in range(nrows)]
+    
+    def __getitem__(self, key):
+        row, col = key
+        if row < len(self.rows) and col < self.ncols:
+            return self.rows[row][col]
+        return 0
+    
+    def increment(self, row, col, inc=1):
+        """Increment the count of (`row`, `col`) by `inc`.
+        """
+        if col >= self.ncols:
+            self._add_cols(col + 1)
+        rows = self.rows
+        if row >= len(rows):
+            rows.extend([0] * self.ncols for _ in range(row + 1 - len(rows)))
+        rows[row][col] += inc
+    
+    def _add_cols(self, ncols):
+        extra = [0] * (ncols - self.ncols)
+        for row in self.rows:
+            row.extend(extra)
+        self.ncols = ncols
+    
+    def merge(self, other):
+        if not isinstance(other, CountingMatrix):
+            raise ValueError(
+                "Cannot merge object of type {}".format(type(other)))
+        if self.ncols < other.ncols:
+            self._add_cols(other.ncols)
+        rows, other_rows = self.rows, other.rows
+        if other.ncols < self.ncols:
+            pad = [0] * (self.ncols - other.ncols)
+            other_rows = [row + pad for row in other_rows]
+        if len(rows) < len(other_rows):
+            rows, other_rows = other_rows, rows
+        self.rows = [
+            [count + other_count for count, other_count in zip(row, other_row)]
+            for row, other_row in zip(rows, other_rows)
+        ] + rows[len(other_rows):]
+        return self
+    
+    def summarize(self):
+        """Returns a dict of {columns: cols, rows: {row: counts}}, where `cols`
+        are the columns with any non-zero count, and rows are the rows with
+        any non-zero count.
+        """
+        cols = tuple(
+            col for col in range(self.ncols)
+            if any(row[col] for row in self.rows))
+        return dict(
+            columns=cols,
+            rows=ordered_dict(
+                (key, tuple(row[col] for col in cols))
+                for key, row in enumerate(self.rows) if any(row)))
+
+class PackedCounts(Mergeable, Summarizable):
+    """Compact form of a :class:`Packable` counter: the sorted keys of each
+    dimension (the schema) and a flat array of counts in row-major order.
+    Merging adds the arrays, after laying out both on the union of the keys if
+    their schemas differ.
+    
+    Args:
+        template: An empty counter of the packed type; :meth:`unpack` fills
+            a copy of it.
+        keys: Tuple of tuples of keys, one per dimension.
+        counts: Sequence of counts in row-major order, or None.
+    """
+    def __init__(self, template, keys, counts=None):
+        self.template = template
+        self.keys = keys
+        if counts is None:
+            size = 1
+            for dim_keys in keys:
+                size *= len(dim_keys)
+            counts = [0] * size
+        self.counts = _counts_array(counts)
+    
+    @classmethod
+    def from_items(cls, template, items, keys):
+        """Pack an iterable of (key tuple, count).
+        
+        Args:
+            template: An empty counter of the packed type.
+            items: Iterable of (key tuple, count).
+            keys: Tuple with, for each dimension, a tuple of keys, or None to
+                use the sorted keys of that dimension that appear in `items`.
+        """
+        items = list(items)
+        keys = tuple(
+            tuple(sorted(set(item_keys[dim] for item_keys, _ in items)))
+            if dim_keys is None else dim_keys
+            for dim, dim_keys in enumerate(keys))
+        packed = cls(template, keys)
+        index = packed._indexes()
+        counts = list(packed.counts)
+        for item_keys, count in items:
+            counts[index(item_keys)] = count
+        return cls(template, keys, counts)
+    
+    def _indexes(self):
+        """Returns a function that computes the flat index of a key tuple.
+        """
+        key_indexes = [
+            dict((key, idx) for idx, key in enumerate(dim_keys))
+            for dim_keys in self.keys]
+        sizes = [len(dim_keys) for dim_keys in self.keys]
+        def index(item_keys):
+            flat = 0
+            for key, dim_indexes, size in zip(item_keys, key_indexes, sizes):
+                flat = flat * size + dim_indexes[key]
+            return flat
+        return index
+    
+    def items(self):
+        """Yields (key tuple, count) for each non-zero count.
+        """
+        for item_keys, count in zip(product(*self.keys), self.counts):
+            if count:
+                yield item_keys, count
+    
+    def merge(self, other):
+        if not isinstance(other, PackedCounts):
+            if not isinstance(other, Packable):
+                raise ValueError(
+                    "Cannot merge object of type {}".format(type(other)))
+            other = other.pack()
+        if self.keys == other.keys:
+            counts, other_counts = self.counts, other.counts
+        else:
+            keys = tuple(
+                tuple(sorted(set(dim_keys) | set(other_dim_keys)))
+                for dim_keys, other_dim_keys in zip(self.keys, other.keys))
+            counts = PackedCounts.from_items(
+                self.template, self.items(), keys).counts
+            other_counts = PackedCounts.from_items(
+                other.template, other.items(), keys).counts
+            self.keys = keys
+        self.counts = _counts_array(list(map(add, counts, other_counts)))
+        return self
+    
+    def unpack(self):
+        """Returns a counter of the packed type with the packed counts.
+        """
+        counter = copy.deepcopy(self.template)
+        for item_keys, count in self.items():
+            counter.set_count(item_keys, count)
+        return counter
+    
+    def summarize(self):
+        return self.unpack().summarize()
+
+def _counts_array(counts):
+    """Returns an array of `counts` with the smallest integer type that holds
+    all of them, or of doubles if any count is not an integer.
+    """
+    try:
+        counts = array('q', counts)
+    except TypeError:
+        return array('d', counts)
+    if counts:
+        max_count = max(max(counts), -min(counts))
+        for typecode in ('b', 'h', 'i'):
+            if max_count < 2 ** (array(typecode).itemsize * 8 - 1):
+                return array(typecode, counts)
+    return counts
+
 class MergingDict(OrderedDict, Mergeable):
     """An :class:`collections.OrderedDict` that implements :class:`Mergeable`.
     """
@@ -352,6 +626,69 @@ class MergingDict(OrderedDict, Mergeable):
         merge_dicts(self, other)
         return self
 
+class LRUCache(object):
+    """A mapping with a bounded number of items. When full, adding an item
+    evicts the least-recently used item. Keeps track of cache hits/misses and
+    of the approximate memory used by the cached keys and values.
+    
+    Args:
+        max_size: The maximum number of items to cache.
+    """
+    def __init__(self, max_size):
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._items = OrderedDict()
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __contains__(self, key):
+        return key in self._items
+    
+    def get(self, key, default=None):
+        """Returns the value of `key`, or `default` if `key` is not cached.
+        """
+        items = self._items
+        if key in items:
+            self.hits += 1
+            items.move_to_end(key)
+            return items[key]
+        self.misses += 1
+        return default
+    
+    def put(self, key, value):
+        """Add (or replace) the value of `key`.
+        """
+        items = self._items
+        if key in items:
+            self.nbytes -= _sizeof_item(key, items[key])
+        elif len(items) >= self.max_size:
+            self.nbytes -= _sizeof_item(*items.popitem(last=False))
+        items[key] = value
+        self.nbytes += _sizeof_item(key, value)
+    
+    def summarize(self):
+        """Returns a summary dict.
+        """
+        return dict(
+            cache_hits=self.hits,
+            cache_misses=self.misses,
+            cache_entries=len(self._items),
+            cache_bytes=self.nbytes)
+
+def _sizeof_item(key, value):
+    """Returns the approximate size of a cache item: the size of the key
+    plus the size of the value (and its members, if it is a tuple).
+    """
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, tuple):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
 def merge_dicts(dest, src):
     """Merge corresponding items in `src` into `dest`. Values in `src` missing
     in `dest` are simply added to `dest`. Values that appear in both `src` and
@@ -408,6 +745,27 @@ def merge_values(v_dest, v_src):
         assert v_dest == v_src
     return v_dest
 
+def pack_summary(value):
+    """Replaces the :class:`Packable` counters in a summary with their
+    :class:`PackedCounts`.
+    
+    Args:
+        value: A summary dict, or one of its values.
+    
+    Returns:
+        The packed value. Dicts and lists are updated in place.
+    """
+    if isinstance(value, Packable):
+        return value.pack()
+    elif isinstance(value, dict):
+        for key, val in value.items():
+            value[key] = pack_summary(val)
+    elif isinstance(value, list):
+        value[:] = [pack_summary(val) for val in value]
+    elif type(value) is tuple:
+        value = tuple(pack_summary(val) for val in value)
+    return value
+
 def ordered_dict(iterable):
     """Create an OrderedDict from an iterable of (key, value) tuples.
     """
@@ -426,6 +784,45 @@ def reverse_complement(seq):
     """
     return "".join(BASE_COMPLEMENTS[base] for base in reversed(seq))
 
+def reverse_complements(seqs):
+    """Returns a list of the reverse complements of the sequences in `seqs`.
+    """
+    return [reverse_complement(seq) for seq in seqs]
+
+KMER_CODES = dict(A=0, C=1, G=2, T=3)
+"""2-bit codes of the unambiguous bases (as used by
+:class:`atropos.align.PackedSequence`).
+"""
+
+def encode_kmer(kmer):
+    """Encodes a k-mer as an integer, two bits per base, with the first base in
+    the most significant position. Raises ValueError if `kmer` contains a base
+    other than A, C, G or T.
+    """
+    code = 0
+    for base in kmer:
+        if base not in KMER_CODES:
+            raise ValueError("Cannot encode ambiguous base {}".format(base))
+        code = (code << 2) | KMER_CODES[base]
+    return code
+
+def decode_kmer(code, k):
+    """Decodes an integer produced by :func:`encode_kmer` back into a k-mer of
+    length `k`.
+    """
+    return "".join(
+        "ACGT"[(code >> (2 * (k - i - 1))) & 3] for i in range(k))
+
+def reverse_complement_kmer(code, k):
+    """Returns the code of the reverse complement of the k-mer encoded by
+    `code`.
+    """
+    result = 0
+    for _ in range(k):
+        result = (result << 2) | ((code & 3) ^ 3)
+        code >>= 2
+    return result
+
 def sequence_complexity(seq):
     """Computes a simple measure of sequence complexity.
     
@@ -446,6 +843,17 @@ def sequence_complexity(seq):
             term += frac * math.log(frac) / LOG2
     return -term
 
+def sequence_complexities(seqs):
+    """Returns a list of the complexities (see :func:`sequence_complexity`) of
+    the sequences in `seqs`.
+    """
+    return [sequence_complexity(seq) for seq in seqs]
+
+def count_n(seq):
+    """Returns the number of N (or n) characters in `seq`.
+    """
+    return seq.lower().count('n')
+
 def qual2int(qual, base=33):
     """Convert a quality charater to a phred-scale int.
     
@@ -477,6 +885,33 @@ def qual2prob(qchar):
     """
     return 10 ** (-qual2int(qchar) / 10)
 
+def quals2probs(quals):
+    """Converts a string of quality chars to a list of probabilities.
+    """
+    return [qual2prob(qchar) for qchar in quals]
+
+def sum_qual_probs(quals):
+    """Returns the sum of the probabilities of a string of quality chars.
+    """
+    return sum(qual2prob(qchar) for qchar in quals)
+
+def count_quals(quals, counts):
+    """Adds the number of occurrences of each quality char in `quals` to
+    `counts`, a list of 256 ints indexed by character code.
+    """
+    for qchar in quals:
+        counts[ord(qchar)] += 1
+
+# Replace the sequence and quality helpers above with their cythonized,
+# table-driven versions, if available.
+try:
+    from ._util import (
+        complement, reverse_complement, reverse_complements,
+        sequence_complexity, sequence_complexities, count_n, qual2prob,
+        quals2probs, sum_qual_probs, count_quals)
+except ImportError:
+    logging.getLogger().debug("Import failed for cythonized util functions")
+
 def enumerate_range(collection, start, end):
     """Generates an indexed series:  (0,coll[0]), (1,coll[1]) ...
     
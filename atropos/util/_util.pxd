@@ -0,0 +1,33 @@
+# kate: syntax Python;
+"""
+Declarations shared with other Cython modules: direct access to the characters
+of str objects, which CPython stores as one byte per character when all of
+them are < 256.
+"""
+
+cdef extern from "Python.h":
+    int PyUnicode_READY(object o) except -1
+    int PyUnicode_KIND(object o)
+    void* PyUnicode_DATA(object o)
+    int PyUnicode_1BYTE_KIND
+    object PyUnicode_New(Py_ssize_t size, unsigned int maxchar)
+
+cdef inline const unsigned char* _buffer(str s) except? NULL:
+    """
+    Return a pointer to the characters of s, or NULL if s contains characters
+    >= 256. The pointer is valid for as long as s is alive.
+    """
+    PyUnicode_READY(s)
+    if PyUnicode_KIND(s) != PyUnicode_1BYTE_KIND:
+        return NULL
+    return <const unsigned char*>PyUnicode_DATA(s)
+
+cdef inline const unsigned char* _ascii_buffer(str s) except NULL:
+    """
+    Return a pointer to the characters of s, which must only contain characters
+    < 256. The pointer is valid for as long as s is alive.
+    """
+    cdef const unsigned char* buf = _buffer(s)
+    if buf == NULL:
+        raise ValueError("Sequence or qualities contain non-ASCII characters")
+    return buf
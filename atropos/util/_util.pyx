@@ -0,0 +1,185 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+"""
+Table-driven versions of the sequence helpers in atropos.util.
+
+Sequences and qualities are ASCII strings, which CPython stores as one byte
+per character, so these functions read the string buffers directly and look
+each character up in a 256-entry table. Strings with non-ASCII characters are
+handed to the equivalent pure-python expressions.
+"""
+
+from libc.math cimport log
+
+# Complements of the IUPAC bases; 0 marks a character that has no complement.
+cdef unsigned char COMPLEMENT_TABLE[256]
+cdef double PROB_TABLE[256]
+cdef double LOG2 = log(2)
+
+def _init_tables():
+    cdef int i
+    from atropos.util import BASE_COMPLEMENTS
+    for i in range(256):
+        COMPLEMENT_TABLE[i] = 0
+        PROB_TABLE[i] = 10.0 ** (-(i - 33) / 10.0)
+    for base, comp in BASE_COMPLEMENTS.items():
+        COMPLEMENT_TABLE[ord(base)] = ord(comp)
+
+_init_tables()
+
+cdef str _complement(str seq, bint reverse):
+    cdef Py_ssize_t n = len(seq)
+    cdef Py_ssize_t i
+    cdef unsigned char comp
+    cdef const unsigned char* bases = _buffer(seq)
+    cdef str result
+    cdef unsigned char* out
+    if bases == NULL:
+        # seq contains at least one character >= 256
+        for base in seq:
+            if ord(base) >= 256 or COMPLEMENT_TABLE[ord(base)] == 0:
+                raise KeyError(base)
+    result = PyUnicode_New(n, 127)
+    out = <unsigned char*>PyUnicode_DATA(result)
+    for i in range(n):
+        comp = COMPLEMENT_TABLE[bases[i]]
+        if comp == 0:
+            raise KeyError(seq[i])
+        if reverse:
+            out[n - i - 1] = comp
+        else:
+            out[i] = comp
+    return result
+
+def complement(str seq):
+    """
+    Return the complement of nucleotide sequence seq. Raises KeyError if seq
+    contains a character that is not an IUPAC base.
+    """
+    return _complement(seq, False)
+
+def reverse_complement(str seq):
+    """
+    Return the reverse complement of nucleotide sequence seq. Raises KeyError
+    if seq contains a character that is not an IUPAC base.
+    """
+    return _complement(seq, True)
+
+def reverse_complements(seqs):
+    """
+    Return a list of the reverse complements of the sequences in seqs.
+    """
+    return [_complement(seq, True) for seq in seqs]
+
+cdef double _sequence_complexity(str seq) except -1:
+    cdef Py_ssize_t n = len(seq)
+    cdef Py_ssize_t i
+    cdef Py_ssize_t counts[4]
+    cdef double frac
+    cdef double term = 0
+    cdef const unsigned char* bases = _buffer(seq)
+    counts[0] = counts[1] = counts[2] = counts[3] = 0
+    if bases == NULL:
+        seq = seq.upper()
+        for i, base in enumerate('ACGT'):
+            counts[i] = seq.count(base)
+    else:
+        for i in range(n):
+            if bases[i] == b'A' or bases[i] == b'a':
+                counts[0] += 1
+            elif bases[i] == b'C' or bases[i] == b'c':
+                counts[1] += 1
+            elif bases[i] == b'G' or bases[i] == b'g':
+                counts[2] += 1
+            elif bases[i] == b'T' or bases[i] == b't':
+                counts[3] += 1
+    for i in range(4):
+        if counts[i] > 0:
+            frac = counts[i] / <double>n
+            term += frac * log(frac) / LOG2
+    return -term if term != 0 else 0.0
+
+def sequence_complexity(str seq):
+    """
+    Compute a simple measure of sequence complexity, as a value in [0,2],
+    where 0 = a homopolymer and 2 = completely random.
+    """
+    return _sequence_complexity(seq)
+
+def sequence_complexities(seqs):
+    """
+    Return a list of the complexities of the sequences in seqs.
+    """
+    return [_sequence_complexity(seq) for seq in seqs]
+
+def count_n(str seq):
+    """
+    Return the number of N (or n) characters in seq.
+    """
+    cdef Py_ssize_t n = len(seq)
+    cdef Py_ssize_t i
+    cdef Py_ssize_t count = 0
+    cdef const unsigned char* bases = _buffer(seq)
+    if bases == NULL:
+        return seq.lower().count('n')
+    for i in range(n):
+        if bases[i] == b'N' or bases[i] == b'n':
+            count += 1
+    return count
+
+def qual2prob(str qchar):
+    """
+    Convert a quality character (with base 33) to an error probability.
+    """
+    cdef long q = ord(qchar)
+    if 0 <= q < 256:
+        return PROB_TABLE[q]
+    return 10.0 ** (-(q - 33) / 10.0)
+
+def quals2probs(str quals):
+    """
+    Return a list of the error probabilities of the quality characters (with
+    base 33) in quals.
+    """
+    cdef Py_ssize_t n = len(quals)
+    cdef Py_ssize_t i
+    cdef const unsigned char* qbuf = _buffer(quals)
+    if qbuf == NULL:
+        return [10.0 ** (-(ord(q) - 33) / 10.0) for q in quals]
+    return [PROB_TABLE[qbuf[i]] for i in range(n)]
+
+def sum_qual_probs(str quals):
+    """
+    Return the sum of the error probabilities of the quality characters (with
+    base 33) in quals.
+    """
+    cdef Py_ssize_t n = len(quals)
+    cdef Py_ssize_t i
+    cdef double total = 0
+    cdef const unsigned char* qbuf = _buffer(quals)
+    if qbuf == NULL:
+        return sum(10.0 ** (-(ord(q) - 33) / 10.0) for q in quals)
+    for i in range(n):
+        total += PROB_TABLE[qbuf[i]]
+    return total
+
+def count_quals(str quals, counts):
+    """
+    Add the number of occurrences of each character in quals to counts, a list
+    of 256 ints indexed by character code.
+    """
+    cdef Py_ssize_t n = len(quals)
+    cdef Py_ssize_t i
+    cdef Py_ssize_t local_counts[256]
+    cdef const unsigned char* qbuf = _buffer(quals)
+    if qbuf == NULL:
+        for qchar in quals:
+            counts[ord(qchar)] += 1
+        return
+    for i in range(256):
+        local_counts[i] = 0
+    for i in range(n):
+        local_counts[qbuf[i]] += 1
+    for i in range(256):
+        if local_counts[i]:
+            counts[i] += local_counts[i]
@@ -83,6 +83,9 @@ extensions = [
     Extension('atropos.align._align', sources=['atropos/align/_align.pyx']),
     Extension('atropos.commands.trim._qualtrim', sources=['atropos/commands/trim/_qualtrim.pyx']),
     Extension('atropos.io._seqio', sources=['atropos/io/_seqio.pyx']),
+    Extension('atropos.util._util', sources=['atropos/util/_util.pyx']),
+    Extension('atropos.commands._base', sources=['atropos/commands/_base.pyx']),
+    Extension('atropos.commands.detect._kmers', sources=['atropos/commands/detect/_kmers.pyx']),
 ]
 
 cmdclass = versioneer.get_cmdclass()
@@ -139,6 +142,7 @@ setup(
         'khmer' : ['khmer'],
         'pysam' : ['pysam'],
         'jinja' : ['jinja2'],
+        'numpy' : ['numpy'],
         'sra' : ['srastream>=0.1.3']
     },
     classifiers = [
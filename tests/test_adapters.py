@@ -1,7 +1,8 @@
 # coding: utf-8
 from pytest import raises
 from atropos.adapters import (
-    Adapter, Match, ColorspaceAdapter, FRONT, BACK, parse_braces, LinkedAdapter)
+    Adapter, Match, ColorspaceAdapter, FRONT, BACK, PREFIX, SUFFIX,
+    parse_braces, LinkedAdapter, BarcodeIndex)
 from atropos.io.seqio import Sequence
 
 def test_issue_52():
@@ -95,3 +96,34 @@ def test_linked_adapter():
     trimmed = linked_adapter.trimmed(match)
     assert trimmed.name == 'seq'
     assert trimmed.sequence == 'CCCCC'
+
+
+def test_barcode_index():
+    barcodes = [
+        Adapter(seq, PREFIX, 0.25, name=seq, indels=False)
+        for seq in ('ACGTAC', 'TTGCAG', 'ACGTTG')]
+    assert BarcodeIndex.supports(barcodes)
+    index = BarcodeIndex(barcodes)
+    # ACGTAG and ACGTTC are within one error of both ACGTAC and ACGTTG
+    assert index.collisions == 2
+    for seq, name, errors in (
+            ('ACGTACGGGG', 'ACGTAC', 0), ('ACGTTGGGGG', 'ACGTTG', 0),
+            ('TTGCNGCCCC', 'TTGCAG', 1), ('ACGTAGCCCC', 'ACGTAC', 1)):
+        assert index.covers(seq)
+        match = index.match_to(Sequence('read', seq), seq)
+        assert match.adapter.name == name
+        assert (match.rstart, match.rstop, match.errors) == (0, 6, errors)
+    assert index.match_to(Sequence('read', 'GGGGGGGG'), 'GGGGGGGG') is None
+    assert not index.covers('ACG')
+    assert not index.covers('ACGTA.CCC')
+
+def test_barcode_index_supports():
+    def adapters(where=PREFIX, indels=False, lengths=(6, 6)):
+        return [
+            Adapter('ACGTACGT'[:length], where, indels=indels)
+            for length in lengths]
+    assert BarcodeIndex.supports(adapters(SUFFIX))
+    assert not BarcodeIndex.supports(adapters(lengths=(6,)))
+    assert not BarcodeIndex.supports(adapters(BACK))
+    assert not BarcodeIndex.supports(adapters(indels=True))
+    assert not BarcodeIndex.supports(adapters(lengths=(6, 7)))
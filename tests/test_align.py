@@ -12,6 +12,13 @@ class TestAligner():
         aligner = Aligner(reference, 0.1, flags=BACK)
         aligner.locate('CC')
 
+    def test_change_reference(self):
+        aligner = Aligner('', 0.1, flags=BACK)
+        for reference in ('CTCCAGCTTAGACATATC', 'GCTTAG', 'CTCCAGCTTAGACATATCGGCCTTAA'):
+            aligner.reference = reference
+            assert aligner.locate('AAAGCTTAG') == locate(
+                reference, 'AAAGCTTAG', 0.1, flags=BACK)
+
     def test_100_percent_error_rate(self):
         reference = 'GCTTAGACATATC'
         aligner = Aligner(reference, 1.0, flags=BACK)
@@ -165,6 +172,63 @@ def test_short_adapter_overlap():
     assert match2.rstart == 28
     assert match2.length == 2
 
+def test_insert_align_unequal_lengths():
+    a1_seq = 'TTAGACATATGG'
+    a2_seq = 'CAGTGGAGTATA'
+    aligner = InsertAligner(a1_seq, a2_seq)
+    r1 = 'AGTCGAGCCCATTGCAGACT' + a1_seq[0:10]
+    r2 = 'AGTCTGCAATGGGCTCGACT' + a2_seq[0:10] + 'ACGTA'
+    insert_match, match1, match2 = aligner.match_insert(r1, r2)
+    assert insert_match[5] == 0
+    assert match1.rstart == 20
+    assert match1.length == 10
+    assert match2.rstart == 20
+    assert match2.length == 12
+
+def test_insert_align_no_match():
+    aligner = InsertAligner('TTAGACATATGG', 'CAGTGGAGTATA')
+    r1 = 'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+    r2 = 'GGGGGGGGGGGGGGGGGGGGGGGGGGGGGG'
+    assert aligner.match_insert(r1, r2) is None
+
+def test_insert_align_packed():
+    # Reads with a base other than A, C, G or T are compared character by
+    # character instead of packed; a base beyond the overlap must not change
+    # the result.
+    import random
+    from atropos.align import PackedSequence
+    from atropos.util import reverse_complement
+    a1_seq = 'AGATCGGAAGAGCACACGTCTG'
+    a2_seq = 'AGATCGGAAGAGCGTCGTGTAG'
+    aligner = InsertAligner(a1_seq, a2_seq)
+    rng = random.Random(42)
+    for _ in range(500):
+        insert = ''.join(rng.choice('ACGT') for _ in range(rng.randint(1, 80)))
+        r1 = insert + a1_seq + 'ACGT' * 20
+        r2 = reverse_complement(insert) + a2_seq + 'TGCA' * 20
+        r1 = ''.join(
+            base if rng.random() < 0.97 else rng.choice('ACGT')
+            for base in r1[:rng.randint(10, 100)])
+        r2 = r2[:rng.randint(5, len(r1))]
+        assert aligner.matcher.match_insert(r1 + 'A', r2) == (
+            aligner.matcher.match_insert(r1 + 'N', r2)), (r1, r2)
+        assert aligner.matcher.match_insert(
+            r1, r2, PackedSequence(r1), PackedSequence(r2)) == (
+            aligner.matcher.match_insert(r1, r2)), (r1, r2)
+
+def test_match_copy():
+    import pickle
+    from atropos.align import Match
+    m = Match(0, 5, 3, 8, 4, 1, front=None, adapter='adapter', read='read')
+    assert m.length == 5
+    assert not m.front
+    for m2 in (m.copy(), pickle.loads(pickle.dumps(m))):
+        assert m2 is not m
+        assert (
+            m2.astart, m2.astop, m2.rstart, m2.rstop, m2.matches, m2.errors,
+            m2.front, m2.adapter, m2.read) == (
+                0, 5, 3, 8, 4, 1, False, 'adapter', 'read')
+
 def test_multi_aligner_no_mismatches():
     from atropos.align._align import MultiAligner
     a = MultiAligner(max_error_rate=0, min_overlap=3)
@@ -209,3 +273,93 @@ def test_multi_aligner_with_mismatches():
     assert matches[1][3] == 12
     assert matches[1][4] == 11
     assert matches[1][5] == 1
+
+def test_ungapped_aligner_same_as_aligner_without_indels():
+    import random
+    from atropos.adapters import FRONT, ANYWHERE
+    from atropos.align import PackedSequence, UngappedAligner
+    rng = random.Random(42)
+    for _ in range(5000):
+        # Without N (or wildcards), sequences are compared packed.
+        alphabet = rng.choice(('ACGT', 'ACGTN'))
+        reference = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 30)))
+        query = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        if query and rng.random() < 0.5:
+            pos = rng.randint(0, len(query))
+            query = query[:pos] + reference[:rng.randint(0, len(reference))] + query[pos:]
+        flags = rng.choice((BACK, FRONT, ANYWHERE))
+        error_rate = rng.choice((0, 0.1, 0.2, 0.5))
+        wildcard_ref, wildcard_query = rng.choice(
+            ((False, False), (True, False), (False, True), (True, True)))
+        min_overlap = rng.randint(1, len(reference))
+        aligner = Aligner(
+            reference, error_rate, flags, wildcard_ref, wildcard_query)
+        aligner.min_overlap = min_overlap
+        aligner.indel_cost = 100000
+        ungapped = UngappedAligner(
+            reference, error_rate, flags, wildcard_ref, wildcard_query,
+            min_overlap)
+        assert ungapped.locate(query) == aligner.locate(query), (
+            reference, query, flags, error_rate)
+        assert ungapped.locate(query, PackedSequence(query)) == (
+            aligner.locate(query)), (reference, query, flags, error_rate)
+
+def test_packed_sequence():
+    import pickle
+    from atropos.align import PackedSequence
+    from atropos.util import encode_kmer
+    seq = 'ACGTTGCANACGTACGTACGTACGTACGTACGTACGTAC'
+    packed = PackedSequence(seq)
+    assert len(packed) == len(seq)
+    assert packed.ambiguous == 1
+    assert packed.unpack() == seq
+    assert pickle.loads(pickle.dumps(packed)).unpack() == seq
+    assert packed.reverse_complement().unpack() == (
+        'GTACGTACGTACGTACGTACGTACGTACGTNTGCAACGT')
+    kmers = packed.kmers(4)
+    assert kmers[:5] == [
+        encode_kmer('ACGT'), encode_kmer('CGTT'), encode_kmer('GTTG'),
+        encode_kmer('TTGC'), encode_kmer('TGCA')]
+    assert kmers[5:9] == [-1] * 4
+    assert kmers[9] == encode_kmer('ACGT')
+
+def test_packed_sequence_reverse_complement():
+    from atropos.align import PackedSequence
+    from atropos.util import reverse_complement
+    for length in (0, 1, 31, 32, 33, 64, 100):
+        seq = ('ACGTTGCAGN' * 10)[:length]
+        packed = PackedSequence(seq).reverse_complement()
+        assert packed.unpack() == reverse_complement(seq)
+        assert packed.ambiguous == seq.count('N')
+
+def test_packed_sequence_mismatches():
+    from atropos.align import PackedSequence
+    seq1 = PackedSequence('GGACGTACGTACGTACGTACGTACGTACGTACGTACGTAN')
+    seq2 = PackedSequence('ACGTACGTACGTACGTACGTACGTACGTACGTACCTAC')
+    assert seq1.mismatches(seq2, 2) == 2
+    assert seq1.mismatches(seq2, 2, wildcards=True) == 1
+    assert seq1.mismatches(seq2, 2, 30) == 0
+    assert seq1.mismatches(seq2) == 38
+
+def test_aho_corasick():
+    from atropos.align import AhoCorasick
+    patterns = ['ACGT', 'CGTA', 'GTT', 'ACGTN', 'CGTA', 'AAAAAAAAAAAA']
+    automaton = AhoCorasick(patterns)
+    for text in ('', 'TTACGTACGTTN', 'NACGTNAACGTTGTTT', 'XXXX'):
+        assert automaton.find_first(text) == [
+            text.find(pattern) for pattern in patterns]
+
+def test_correct_mismatches():
+    from atropos.align import correct_mismatches
+    # read2 is the reverse complement of read1 with one mismatch at read1
+    # position 1 and an N at read1 position 5
+    seq1, qual1 = 'ACGTACGTAA', 'IIIIIIIIII'
+    seq2, qual2 = 'TTACNTACCT', '##########'
+    assert correct_mismatches(
+        seq1, qual1, seq2, qual2, 0, 10, 0, 10, 'conservative') == (
+            seq1, qual1, 0, 'TTACGTACGT', '####I###I#', 2)
+    assert correct_mismatches(
+        seq1, qual1, seq2, qual2, 0, 10, 0, 10, 'N') == (
+            'ANGTANGTAA', qual1, 2, 'TTACNTACNT', qual2, 2)
+    assert correct_mismatches(
+        seq1, None, seq2, None, 0, 10, 0, 10, 'N')[1::3] == (None, None)
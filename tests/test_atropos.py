@@ -74,6 +74,25 @@ def test_minimum_length():
     run("-c -m 5 -a 330201030313112312", "minlen.fa", "lengths.fa")
 
 
+def test_minimum_length_early_filter():
+    '''-m/--minimum-length with --early-filter'''
+    run("-c -m 5 -a 330201030313112312 --early-filter", "minlen.fa", "lengths.fa")
+
+
+def test_too_short_early_filter():
+    '''--too-short-output with --early-filter'''
+    run("-c -m 5 -a 330201030313112312 --early-filter --too-short-output tooshort.tmp.fa", "minlen.fa", "lengths.fa")
+    assert files_equal(datapath('tooshort.fa'), "tooshort.tmp.fa")
+    os.remove('tooshort.tmp.fa')
+
+
+def test_too_short_compile_handler():
+    '''--too-short-output with --compile-handler'''
+    run("-c -m 5 -a 330201030313112312 --compile-handler --too-short-output tooshort.tmp.fa", "minlen.fa", "lengths.fa")
+    assert files_equal(datapath('tooshort.fa'), "tooshort.tmp.fa")
+    os.remove('tooshort.tmp.fa')
+
+
 def test_too_short():
     '''--too-short-output'''
     run("-c -m 5 -a 330201030313112312 --too-short-output tooshort.tmp.fa", "minlen.fa", "lengths.fa")
@@ -142,6 +161,12 @@ def test_mask_adapter():
     '''mask adapter with N (reads maintain the same length)'''
     run("-b CAAG -n 3 --mask-adapter", "anywhere_repeat.fastq", "anywhere_repeat.fastq")
 
+def test_mask_adapter_alignment_cache():
+    run("-b CAAG -n 3 --mask-adapter --alignment-cache-size 2", "anywhere_repeat.fastq", "anywhere_repeat.fastq")
+
+def test_mask_adapter_collapse_duplicates():
+    run("-b CAAG -n 3 --mask-adapter --collapse-duplicates", "anywhere_repeat.fastq", "anywhere_repeat.fastq")
+
 def test_gz_multiblock():
     '''compressed gz file with multiple blocks (created by concatenating two .gz files)'''
     run("-b TTAGACATATCTCCGTCG", "small.fastq", "multiblock.fastq.gz")
@@ -227,12 +252,24 @@ def test_info_file():
         assert files_equal(cutpath('illumina.info.txt'), infotmp)
 
 
+def test_info_file_compile_handler():
+    with temporary_path("infotmp.txt") as infotmp:
+        run(["--info-file", infotmp, '--compile-handler', '-a', 'adapt=GCCGAACTTCTTAGACTGCCTTAAGGACGT'], "illumina.fastq", "illumina.fastq.gz")
+        assert files_equal(cutpath('illumina.info.txt'), infotmp)
+
+
 def test_info_file_times():
     with temporary_path("infotmp.txt") as infotmp:
         run(["--info-file", infotmp, '--times', '2', '-a', 'adapt=GCCGAACTTCTTA', '-a', 'adapt2=GACTGCCTTAAGGACGT'], "illumina5.fastq", "illumina5.fastq")
         assert files_equal(cutpath('illumina5.info.txt'), infotmp)
 
 
+def test_info_file_times_alignment_cache():
+    with temporary_path("infotmp.txt") as infotmp:
+        run(["--info-file", infotmp, '--times', '2', '--alignment-cache-size', '10', '-a', 'adapt=GCCGAACTTCTTA', '-a', 'adapt2=GACTGCCTTAAGGACGT'], "illumina5.fastq", "illumina5.fastq")
+        assert files_equal(cutpath('illumina5.info.txt'), infotmp)
+
+
 def test_info_file_fasta():
     with temporary_path("infotmp.txt") as infotmp:
         # Just make sure that it runs
@@ -400,3 +437,77 @@ def test_custom_bisulfite_4():
 def test_sra():
     run('-b CTGGAGTTCAGACGTGTGCTCT --max-reads 100', 
         'SRR2040662_trimmed.fq', sra_accn='SRR2040662')
+
+def test_detect_adapters():
+    # Reads with a random insert followed by the adapter; trimming with the
+    # detected adapter gives the same result as trimming with the adapter.
+    import random
+    rng = random.Random(1)
+    adapter = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC'
+    with temporary_path('detect_in.fastq') as inpath, \
+            temporary_path('detect_expected.fastq') as expected:
+        with open(inpath, 'w') as out:
+            for i in range(500):
+                insert = ''.join(
+                    rng.choice('ACGT') for _ in range(rng.randint(20, 60)))
+                seq = (insert + adapter + insert)[:60]
+                out.write('@read{}\n{}\n+\n{}\n'.format(i, seq, 'I' * 60))
+        command = get_command('trim')
+        common = ['--no-default-adapters', '--no-cache-adapters', '-se', inpath]
+        retcode, summary = command.execute(
+            common + ['-a', adapter, '-o', expected])
+        assert retcode == 0
+        with temporary_path('detect_out.fastq') as outpath:
+            retcode, summary = command.execute(
+                common + ['--detect-adapters', '200', '-o', outpath])
+            assert retcode == 0
+            assert summary['detect']['matches'][0]
+            assert files_equal(expected, outpath)
+        # Without any known adapters, the 'known' detector falls back to the
+        # heuristic detector.
+        with temporary_path('detect_out.fastq') as outpath:
+            retcode, summary = command.execute(
+                common + [
+                    '--detect-adapters', '200', '--adapter-detector', 'known',
+                    '-o', outpath])
+            assert retcode == 0
+            assert summary['detect']['detector'] == 'heuristic'
+            assert files_equal(expected, outpath)
+
+def test_detect_adapters_duplicated_reads():
+    # Copies of a read are not detected as an adapter, and neither is a
+    # sequence that covers almost the whole read (here a read that is
+    # duplicated except for its last bases); the adapter is detected instead.
+    import random
+    rng = random.Random(1)
+    adapter = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC'
+    copied = ''.join(rng.choice('ACGT') for _ in range(60))
+    duplicated = ''.join(rng.choice('ACGT') for _ in range(57))
+    with temporary_path('detect_in.fastq') as inpath, \
+            temporary_path('detect_expected.fastq') as expected:
+        with open(inpath, 'w') as out:
+            for i in range(500):
+                choice = rng.random()
+                if choice < 0.2:
+                    seq = copied
+                elif choice < 0.3:
+                    seq = duplicated + ''.join(
+                        rng.choice('ACGT') for _ in range(3))
+                else:
+                    insert = ''.join(
+                        rng.choice('ACGT') for _ in range(rng.randint(20, 60)))
+                    seq = (insert + adapter + insert)[:60]
+                out.write('@read{}\n{}\n+\n{}\n'.format(i, seq, 'I' * 60))
+        command = get_command('trim')
+        common = ['--no-default-adapters', '--no-cache-adapters', '-se', inpath]
+        retcode, summary = command.execute(
+            common + ['-a', adapter, '-o', expected])
+        assert retcode == 0
+        with temporary_path('detect_out.fastq') as outpath:
+            retcode, summary = command.execute(
+                common + ['--detect-adapters', '200', '-o', outpath])
+            assert retcode == 0
+            matches = summary['detect']['matches'][0]
+            assert all(match['longest_kmer'] != copied for match in matches)
+            assert duplicated.startswith(matches[0]['longest_kmer'])
+            assert files_equal(expected, outpath)
@@ -0,0 +1,229 @@
+# coding: utf-8
+import pickle
+from atropos.adapters import AdapterCache
+from atropos.commands.detect import (
+    HeuristicDetector, KnownContaminantDetector, SketchDetector,
+    ContaminantIndex, ReadSample, create_contaminant_matchers)
+from atropos.commands.detect.kmers import (
+    find_overrepresented_kmers, CountMinSketch)
+from atropos.io.seqio import Sequence
+from atropos.util import reverse_complement
+
+ADAPTER = 'AGATCGGAAGAGCACACGTCT'
+
+# Reads made of a random prefix and an adapter prefix of the given length.
+READS = [prefix + ADAPTER[:length] for prefix, length in (
+    ('CGTAATGCCTTT', 20), ('CCTAACAGA', 14), ('TTTTCGAACTCGTGTTGTCG', 20),
+    ('GCGAC', 20), ('GGAATTAGATCAGTTAAATGGCA', 14), ('AAACT', 14),
+    ('GCAGGGCTTTTAGTCGTGGGATGA', 16), ('CAGTGGGTAAAGGTGGCGCGGGGT', 11),
+    ('CGCGC', 15), ('TAAGGCTCAG', 21), ('CTGCAACGCGGAGCTGGTGTGTTAT', 12),
+    ('ATTCATGGCAG', 11), ('AACTAATACGCA', 18), ('TAAGCGTAGCCAACCGCATTAG', 13),
+    ('TATGAACAAAATA', 21), ('TGCGAGT', 20), ('GGGCGTACATACAGTTA', 19),
+    ('AGTGTTTACCGATCTCAG', 15), ('GATATAGAATCCTAAATCAGAA', 11),
+    ('GGAACAAAGCACCCTTGGTG', 18), ('ATCTCTTCTCCATTTCCG', 13),
+    ('GCGTGCGAG', 17), ('CCGCGTCTTCTATATAT', 13), ('ACGCCGCCAGCA', 15),
+    ('TAAAAGGAGT', 19), ('AAGGTTTACTTCGAG', 11),
+    ('ATGAGGTGGAGATGAGCC', 12), ('TAACGTGCTTGCAACT', 15), ('GGTACATG', 13),
+    ('GGTTAGTACGAAACCTTCCTC', 18), ('', 9), ('N', 13))]
+
+def test_find_overrepresented_kmers():
+    assert find_overrepresented_kmers(['ACGT'], 8, lambda k: 0) == []
+    found = find_overrepresented_kmers(READS, 8, lambda k: 4)
+    assert len(found) == 120
+    counts = dict((kmer, count) for kmer, count, read_id in found)
+    assert counts['AGATCGGAA'] == 32
+    assert counts['AGATCGGAAGAGCACACGT'] == 8
+    assert counts['GAGATCGGAAGAGCAC'] == 5
+    # AGATCGGA is over-represented, but one of the reads that contain it is an
+    # over-represented 9-mer.
+    assert 'AGATCGGA' not in counts
+    # The longest k-mers are not reported.
+    assert 'AGATCGGAAGAGCACACGTC' not in counts
+    read_ids = dict((kmer, read_id) for kmer, count, read_id in found)
+    assert read_ids['AGATCGGAA'] == 30
+    assert read_ids['TAGATCGGAAGAGCA'] == 5
+
+def test_heuristic_detector():
+    detector = HeuristicDetector(
+        kmer_size=8, n_reads=len(READS), min_frequency=0.1,
+        past_end_bases=None)
+    detector._read_length = 40
+    for read in READS:
+        seq = detector._filter_seq(read)
+        if seq:
+            detector._read_sequences.add(seq)
+    matches = detector.matches()
+    assert len(matches) == 1
+    assert matches[0].seq == 'AGATCGGAAGAGCACACG'
+    assert matches[0].count == 1176
+    assert matches[0].longest_match[0] == 'AGATCGGAAGAGCACACGTC'
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(9, memory=2**16, depth=4, capacity=16)
+    sketch.consume(READS)
+    # The k-mer that contains 'N' is not counted
+    assert sketch.total == sum(max(len(read) - 8, 0) for read in READS) - 1
+    assert sketch.get('AGATCGGAA') == 32
+    assert sketch.get('AGATCNGAA') == 0
+    hitters = sketch.heavy_hitters()
+    assert len(hitters) == 16
+    assert hitters[0] == ('AGATCGGAA', 32)
+    assert hitters[1] == ('ATCGGAAGA', 31)
+    counts = [count for kmer, count in hitters]
+    assert counts == sorted(counts, reverse=True)
+
+def test_sketch_detector():
+    detector = SketchDetector(
+        kmer_size=12, n_reads=len(READS), overrep_cutoff=2,
+        past_end_bases=None, sketch_memory=2**16)
+    detector._read_length = 40
+    for read in READS:
+        detector.handle_reads(None, Sequence('read', read))
+    matches = detector.matches()
+    kmers = set(match.seq for match in matches)
+    assert 'AGATCGGAAGAG' in kmers
+    assert all(len(kmer) == 12 for kmer in kmers)
+
+def _collect(detector_class, reads, **kwargs):
+    detector = detector_class(
+        kmer_size=8, n_reads=len(READS), past_end_bases=None, **kwargs)
+    detector._read_length = 40
+    for read in reads:
+        detector.handle_reads(None, Sequence('read', read))
+    return detector
+
+def _known_contaminants():
+    contaminants = AdapterCache(None)
+    contaminants.add('adapter', ADAPTER)
+    contaminants.add('other', 'CGTAATGCCTTTTTTTCGAACTCGTGTT')
+    return contaminants
+
+def test_merge_detector_states():
+    for detector_class, kwargs in (
+            (HeuristicDetector, dict(min_frequency=0.1)),
+            (SketchDetector, dict(overrep_cutoff=2, sketch_memory=2**16)),
+            (KnownContaminantDetector, dict(
+                known_contaminants=_known_contaminants(), overrep_cutoff=2))):
+        expected = _collect(detector_class, READS, **kwargs)
+        state = _collect(detector_class, READS[:10], **kwargs).get_state()
+        other = _collect(detector_class, READS[10:], **kwargs).get_state()
+        # States are sent from worker processes to the main process
+        state = pickle.loads(pickle.dumps(state)).merge(
+            pickle.loads(pickle.dumps(other)))
+        assert state.read_length == 40
+        assert sorted(state.sample.sequences) == sorted(
+            expected._sample.sequences)
+        detector = _collect(detector_class, (), **kwargs)
+        detector.set_state(state)
+        assert detector.matches()
+        assert (
+            [(match.seq, match.count) for match in detector.matches()] ==
+            [(match.seq, match.count) for match in expected.matches()])
+
+def test_duplicate_reads():
+    # Distinct reads are counted once, so many copies of a read are not
+    # reported as a contaminant, whether or not the copies are seen by the
+    # same detector.
+    duplicates = [READS[0]] * 50
+    for detector_class, kwargs in (
+            (HeuristicDetector, dict(min_frequency=0.1)),
+            (KnownContaminantDetector, dict(
+                known_contaminants=_known_contaminants(), overrep_cutoff=2))):
+        expected = [
+            (match.seq, match.count)
+            for match in _collect(detector_class, READS, **kwargs).matches()]
+        assert expected
+        detector = _collect(detector_class, READS + duplicates, **kwargs)
+        assert [
+            (match.seq, match.count)
+            for match in detector.matches()] == expected
+        state = _collect(
+            detector_class, READS + duplicates[:25], **kwargs).get_state()
+        state.merge(_collect(
+            detector_class, duplicates[25:], **kwargs).get_state())
+        detector = _collect(detector_class, (), **kwargs)
+        detector.set_state(state)
+        assert [
+            (match.seq, match.count)
+            for match in detector.matches()] == expected
+
+def test_read_sample():
+    def collect(batches, size=10):
+        sample = ReadSample(size)
+        for batch_index, reads in batches:
+            for pos, read in enumerate(reads):
+                sample.add(batch_index, pos, read)
+        return sample
+    
+    batches = [(1, READS[:16]), (2, READS[16:])]
+    expected = collect(batches)
+    assert len(expected) == 10
+    assert expected.n_reads == len(READS)
+    # The sample does not depend on how batches are split between workers
+    merged = collect(batches[:1]).merge(collect(batches[1:]))
+    assert sorted(merged.sequences) == sorted(expected.sequences)
+    # Abundance is exact when all reads are in the sample, and is otherwise
+    # scaled to the number of reads
+    assert collect(batches, 100).estimate_count('GATCGGAAGAGC') == sum(
+        1 for read in READS if 'GATCGGAAGAGC' in read)
+    hits = sum(1 for seq in expected.sequences if 'AGATCGGAAG' in seq)
+    assert expected.estimate_count('AGATCGGAAG') == round(
+        hits * len(READS) / 10)
+    assert expected.estimate_count('GATTACA') == 0
+
+def test_contaminant_index():
+    contaminants = AdapterCache(None)
+    contaminants.add('adapter', ADAPTER)
+    contaminants.add('adapter_rc', reverse_complement(ADAPTER[5:]))
+    contaminants.add('other', 'CGTAATGCCTTTTTTTCGAACTCGTGTT')
+    contaminants.add('short', 'ACGT')
+    index = ContaminantIndex(contaminants, 8)
+    matchers = dict(
+        (contam.seq, contam)
+        for contam in create_contaminant_matchers(contaminants, 8))
+    for read in READS:
+        readrc = reverse_complement(read)
+        results = index.match(read, readrc)
+        fracs = [(f1, f2) for contam, (f1, f2, seq) in results]
+        assert fracs == sorted(fracs, reverse=True)
+        for contam, match in results:
+            assert match == matchers[contam.seq].match(read, readrc)
+        # Contaminants that share no kmers with the read are not returned
+        matched = set(contam.seq for contam, match in results)
+        for seq, contam in matchers.items():
+            if seq not in matched:
+                assert contam.match(read, readrc)[0] == 0
+    results = index.match(READS[0], reverse_complement(READS[0]))
+    assert results[0][0].seq == ADAPTER
+    assert results[0][1] == (13 / 14, 13 / 25, READS[0])
+
+def test_detector_convergence():
+    def batch(index, prefix):
+        records = [Sequence('read', prefix + read) for read in READS]
+        return (dict(index=index, source=0, size=len(records)), records)
+    
+    detector = HeuristicDetector(
+        kmer_size=8, n_reads=1000, min_frequency=0.1, past_end_bases=None,
+        check_interval=1)
+    detector.process_batch(batch(1, 'A'))
+    assert not detector.done
+    detector.process_batch(batch(2, 'C'))
+    assert detector.done
+    summary = dict(detect={})
+    detector.finish(summary)
+    assert detector.n_reads == 2 * len(READS)
+    assert summary['detect']['matches'][0][0]['longest_kmer'] == (
+        'AGATCGGAAGAGCACACG')
+    
+    # The heuristic detector rescans all reads, so it is only checked once the
+    # number of reads has grown by check_growth since the previous check.
+    detector = HeuristicDetector(
+        kmer_size=8, n_reads=1000, min_frequency=0.1, past_end_bases=None,
+        check_interval=1)
+    detector.process_batch(batch(1, 'A'))
+    assert detector._checked_reads == len(READS)
+    detector.process_batch(
+        (dict(index=2, source=0, size=1), [Sequence('read', READS[0])]))
+    assert detector._checked_reads == len(READS)
+    detector.process_batch(batch(3, 'C'))
+    assert detector._checked_reads == 2 * len(READS) + 1
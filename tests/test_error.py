@@ -0,0 +1,87 @@
+# coding: utf-8
+import pickle
+import random
+from atropos.commands.error import (
+    BaseQualityErrorEstimator, ShadowRegressionErrorEstimator,
+    PairedErrorEstimator)
+from atropos.io.seqio import Sequence
+from atropos.util import merge_values
+
+def simulate_reads(rng, n_templates, read_len, sub_rate, indel_rate=0):
+    for _ in range(n_templates):
+        template = ''.join(rng.choice('ACGT') for _ in range(read_len + 5))
+        for _ in range(rng.randint(5, 200)):
+            seq = []
+            for base in template:
+                rand = rng.random()
+                if rand < sub_rate:
+                    seq.append(rng.choice([b for b in 'ACGT' if b != base]))
+                elif rand < sub_rate + indel_rate:
+                    # deletion
+                    pass
+                elif rand < sub_rate + 2 * indel_rate:
+                    # insertion
+                    seq.extend((rng.choice('ACGT'), base))
+                else:
+                    seq.append(base)
+            seq = ''.join(seq[:read_len])
+            yield Sequence('read', seq, 'I' * read_len)
+
+def test_shadow_regression():
+    for method, expected in (('sub', 0.004), ('indel', 0.004), ('all', 0.008)):
+        estimator = ShadowRegressionErrorEstimator(method=method)
+        for read in simulate_reads(random.Random(1), 100, 40, 0.004, 0.002):
+            estimator.handle_reads(None, read)
+        estimate, details = estimator.estimate()
+        assert abs(estimate - expected) < 0.001
+        assert estimate == details['per_read']['error rate']
+        assert details['per_read']['standard error'] < 0.001
+        per_cycle = details['per_cycle']
+        assert [cycle[0] for cycle in per_cycle] == list(range(1, 41))
+        assert abs(
+            sum(cycle[1] for cycle in per_cycle) / 40 - expected) < 0.001
+
+def test_shadow_counts():
+    estimator = ShadowRegressionErrorEstimator(method='all')
+    for seq, count in (
+            ('ACGTACGTAC', 10), ('ACGTTCGTAC', 2), ('ACGTCGTACA', 1),
+            ('TTGCATGCAA', 5), ('TTGCATGCAG', 3), ('GGGCCCAAAT', 1),
+            # A deletion at cycle 2 and an insertion at cycle 7 (two edits)
+            ('AGTACGTTAC', 1)):
+        for _ in range(count):
+            estimator.handle_reads(None, Sequence('read', seq, 'I' * 10))
+    templates, shadows = estimator._count_shadows()
+    # TTGCATGCAG is a shadow of TTGCATGCAA, so it is not a template
+    assert templates == [('ACGTACGTAC', 10), ('TTGCATGCAA', 5)]
+    # A substitution at cycle 5, a deletion at cycle 5 and a substitution at
+    # cycle 10
+    assert sorted(shadows) == [(0, 4, 1), (0, 4, 2), (1, 9, 3)]
+
+def test_merge_estimator_states():
+    reads = list(simulate_reads(random.Random(1), 50, 40, 0.004))
+    quals = random.Random(2).choices('#+5?I', k=len(reads))
+    for read, qual in zip(reads, quals):
+        read.qualities = qual * 40
+    pairs = list(zip(reads, reversed(reads)))
+    
+    def collect(records, pipeline_class, **kwargs):
+        estimator = pipeline_class(**kwargs)
+        estimator.handle_records(dict(bp=[0, 0]), records)
+        return estimator
+    
+    for records, pipeline_class, kwargs in (
+            (reads, BaseQualityErrorEstimator, dict(max_read_len=30)),
+            (reads, ShadowRegressionErrorEstimator, dict()),
+            (pairs, PairedErrorEstimator, dict(
+                estimator_class=BaseQualityErrorEstimator))):
+        expected = collect(records, pipeline_class, **kwargs)
+        # States are sent from worker processes to the main process
+        state = merge_values(
+            pickle.loads(pickle.dumps(
+                collect(records[:100], pipeline_class, **kwargs).get_state())),
+            pickle.loads(pickle.dumps(
+                collect(records[100:], pipeline_class, **kwargs).get_state())))
+        estimator = collect((), pipeline_class, **kwargs)
+        estimator.set_state(state)
+        assert estimator.summarize_estimates() == (
+            expected.summarize_estimates())
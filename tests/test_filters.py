@@ -3,7 +3,10 @@
 Tests write output (should it return True or False or write)
 """
 from atropos.commands.trim.filters import (
-    NContentFilter, DISCARD, KEEP, SingleWrapper, PairedWrapper)
+    NContentFilter, DISCARD, KEEP, SingleWrapper, PairedWrapper, FilterFactory,
+    Filters, TooShortReadFilter, TooLongReadFilter, plan_early_filters)
+from atropos.commands.trim.modifiers import (
+    SingleEndModifiers, UnconditionalCutter, QualityTrimmer, LengthTagModifier)
 from atropos.io.seqio import Sequence
 
 def test_ncontentfilter():
@@ -39,3 +42,38 @@ def test_ncontentfilter_paired():
         assert filter_legacy(read1, read2) == filter(read1)
         # discard entire pair if one of the reads fulfills criteria
         assert filter_both(read1, read2) == expected
+
+
+def test_plan_early_filters():
+    filters = Filters(FilterFactory(False, 1))
+    filters.add_filter(TooShortReadFilter, 5)
+    filters.add_filter(TooLongReadFilter, 8)
+    filters.add_filter(NContentFilter, 0)
+    modifiers = SingleEndModifiers()
+    modifiers.add_modifier(UnconditionalCutter, lengths=[2])
+    modifiers.add_modifier(QualityTrimmer, cutoff_front=0, cutoff_back=10)
+    modifiers.add_modifier(LengthTagModifier, length_tag='length=')
+    assert modifiers.get_remaining_effects() == [
+        (False, False), (False, False), (False, True)]
+    
+    early = plan_early_filters(filters, modifiers)
+    assert [index for index, checks in early.checkpoints] == [0, 1, 2]
+    # Only the too-short filter is decided before the length tag is added
+    assert len(early.checkpoints[0][1]) == 1
+    assert len(early.checkpoints[2][1]) == 3
+    short = Sequence('read1', 'ACGT', qualities='IIII')
+    assert early.filter(early.checkpoints[0][1], short) is TooShortReadFilter
+    assert filters[TooShortReadFilter].filtered == 1
+    # A read that is long enough might still be trimmed
+    read = Sequence('read1', 'ACGTACGTAN', qualities='IIIIIIIIII')
+    assert early.filter(early.checkpoints[0][1], read) is None
+    # Once only the length tag remains, all verdicts are final
+    assert early.filter(early.checkpoints[2][1], read) is TooLongReadFilter
+    read = Sequence('read1', 'ACGTACN', qualities='IIIIIII')
+    assert early.filter(early.checkpoints[2][1], read) is NContentFilter
+    
+    # Reads that are written to a too-short output are not discarded early
+    early = plan_early_filters(
+        filters, modifiers, routed=set((TooShortReadFilter,)))
+    assert [index for index, checks in early.checkpoints] == [2]
+    assert early.filter(early.checkpoints[0][1], short) is None
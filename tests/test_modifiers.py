@@ -46,6 +46,62 @@ def test_quality_trimmer():
     qt = QualityTrimmer(10, 0, 33)
     assert qt(read) == Sequence('read1', 'GTTTACGTA', '456789###')
 
+def test_adapter_cutter_match_info():
+    adapter = Adapter('TTAGACATAT', BACK)
+    read = Sequence('read1', 'ACGTACGTACTTAGACATAT', '#' * 20)
+    trimmed = AdapterCutter([adapter])(read)
+    assert trimmed.sequence == 'ACGTACGTAC'
+    assert trimmed.match.rstart == 10
+    assert len(trimmed.match_info) == 1
+    assert trimmed.match_info[0].seq_adapter == 'TTAGACATAT'
+    assert trimmed.match_info[0].rsize_total == 10
+    
+    trimmed = AdapterCutter([adapter], record_match_info=False)(read)
+    assert trimmed.sequence == 'ACGTACGTAC'
+    assert trimmed.match.rstart == 10
+    assert trimmed.match_info is None
+
+def test_adapter_cutter_cache():
+    adapter = Adapter('TTAGACATAT', BACK)
+    cutter = AdapterCutter([adapter], cache_size=2)
+    seqs = [
+        'ACGTACGTACTTAGACATAT', 'ACGTACGTACTTAGACATAT', 'CCCCCCCCCCC',
+        'ACGTACGTACTTAGACATAT', 'GGGGGGGGTTAGA', 'GGGGGGGGTTAGA',
+        'ACGTACGTACTTAGACATAT']
+    trimmed = [cutter(Sequence('read', seq)).sequence for seq in seqs]
+    assert trimmed == [
+        'ACGTACGTAC', 'ACGTACGTAC', 'CCCCCCCCCCC', 'ACGTACGTAC', 'GGGGGGGG',
+        'GGGGGGGG', 'ACGTACGTAC']
+    summary = cutter.summarize()
+    assert summary['records_with_adapters'] == 6
+    assert summary['cache_hits'] == 4
+    assert summary['cache_misses'] == 3
+    assert summary['cache_entries'] == 2
+    assert summary['cache_bytes'] > 0
+    # adapter statistics count every read, including cache hits
+    assert sum(adapter.lengths_back.values()) == 6
+
+def test_adapter_cutter_automaton():
+    adapters = [
+        Adapter('CCGATTAC', BACK, name='a1'),
+        Adapter('ACGTTCAGGA', BACK, name='a2'),
+        Adapter('GGATCACGTT', BACK, name='a3'),
+        Adapter('TTTTTT', PREFIX, name='a4')]
+    cutter = AdapterCutter(adapters)
+    assert cutter.automaton is not None
+    assert cutter.exact_indexes == [0, 1, 2]
+    # exact match of the longer adapter wins over that of the shorter one
+    read = Sequence('read1', 'AAAACCGATTACCCACGTTCAGGATT')
+    assert cutter(read).sequence == 'AAAACCGATTACCC'
+    # a3 is not found exactly, but its approximate match beats a1's exact match
+    read = Sequence('read2', 'AAAACCGATTACGGATCACCTT')
+    match = cutter._best_match(read)
+    assert match.adapter.name == 'a3'
+    assert match.errors == 1
+    # no exact match
+    read = Sequence('read3', 'AAAAACGTTCTGGA')
+    assert cutter(read).sequence == 'AAAA'
+
 def test_Modifiers_single():
     m = SingleEndModifiers()
     m.add_modifier(UnconditionalCutter, lengths=[5])
@@ -259,6 +315,29 @@ def test_overlapping_with_error_correction():
     assert read1_merged.sequence == 'AGATCGGTAGAGCGTCATGTAGGGAAAGAGTGTAGATCTC'
     assert read1_merged.qualities == 'FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF#######'
 
+def test_merge_known_insert_overlap():
+    trimmer = MergeOverlapping(min_overlap=10, error_rate=0.1)
+    frag = 'CCAAGCAGACATTCACTCAGATTGCA'
+    read1 = Sequence('foo', frag, '#' * 26)
+    read2 = Sequence('foo', rc(frag[:10] + 'T' + frag[11:]), '!' * 26)
+    read1.insert_overlap = read2.insert_overlap = True
+    read1.insert_sequences = (read1.sequence, read2.sequence)
+    # a no-op slice keeps the record of the overlap
+    read1 = read1[:]
+    read1_merged, read2_merged = trimmer(read1, read2)
+    assert read1_merged.merged
+    assert read2_merged is None
+    assert read1_merged.sequence == frag
+    # the overlap was not realigned
+    assert trimmer.aligners == {}
+    # once a read is modified, the overlap is aligned again
+    read1 = Sequence('foo', frag, '#' * 26)
+    read1.insert_overlap = True
+    read1.insert_sequences = (frag[:-1], read2.sequence)
+    read1_merged, read2_merged = trimmer(read1, read2)
+    assert read1_merged.merged
+    assert len(trimmer.aligners) == 1
+
 def test_mismatched_adapter_overlaps():
     """
     This is a test case from real data. The adapter overlaps 1 less bp
@@ -186,6 +186,22 @@ def test_paired_end_qualtrim():
         aligners=BACK_ALIGNERS
     )
 
+def test_paired_end_qualtrim_early_filter():
+    '''single-pass paired-end with -q, -m and --early-filter'''
+    run_paired('-q 20 -a TTAGACATAT -A CAGTGGAGTA -m 14 -M 90 --early-filter',
+        in1='paired.1.fastq', in2='paired.2.fastq',
+        expected1='pairedq.1.fastq', expected2='pairedq.2.fastq',
+        aligners=BACK_ALIGNERS
+    )
+
+def test_paired_end_qualtrim_compile_handler():
+    '''single-pass paired-end with -q, -m and --compile-handler'''
+    run_paired('-q 20 -a TTAGACATAT -A CAGTGGAGTA -m 14 -M 90 --compile-handler',
+        in1='paired.1.fastq', in2='paired.2.fastq',
+        expected1='pairedq.1.fastq', expected2='pairedq.2.fastq',
+        aligners=BACK_ALIGNERS
+    )
+
 def test_paired_end_qualtrim_swapped():
     '''single-pass paired-end with -q and -m, but files swapped'''
     run_paired('-q 20 -a CAGTGGAGTA -A TTAGACATAT -m 14 --adapter-max-rmp 0.001',
@@ -386,3 +402,24 @@ def test_summary():
         aligners=BACK_ALIGNERS, assert_files_equal=False,
         callback=check_summary
     )
+
+def test_parallel_stats():
+    summaries = []
+    def collect_summary(aligner, infiles, outfiles, result):
+        summaries.append(result[1])
+    for threads in ([], ['--threads', '3']):
+        run_paired(
+            threads + [
+             '--batch-size', '10', '--stats', 'both:tiles=^([^-]+)',
+             '-a', 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCACACAGTGATCTCGTATGCCGTCTTCTGCTTG',
+             '-A', 'AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTAGATCTCGGTGGTCGCCGTATCATT'],
+            in1='big.1.fq', in2='big.2.fq',
+            expected1='out.1.fastq', expected2='out.2.fastq',
+            assert_files_equal=False, callback=collect_summary)
+    serial, parallel = summaries
+    assert parallel['mode'] == 'parallel'
+    assert 'tile_base_qualities' in serial['pre'][0]['read1']
+    # Statistics are the same whether or not they are merged from the packed
+    # summaries of worker processes
+    for key in ('pre', 'post'):
+        assert parallel[key] == serial[key]
@@ -1,5 +1,7 @@
 # coding: utf-8
-from atropos.commands.trim.qualtrim import nextseq_trim_index
+from atropos.commands.trim.qualtrim import (
+    quality_trim_index, nextseq_trim_index, nend_trim_index, mean_quality,
+    zero_cap_qualities)
 from atropos.io.seqio import Sequence
 
 def test_nextseq_trim():
@@ -10,3 +12,23 @@ def test_nextseq_trim():
         'AA//EAEE//A6///E//A//EA/EEEEEEAEA//EEEEEEEEEEEEEEE###########EE#EA'
     )
     assert nextseq_trim_index(s, cutoff=22) == 33
+
+def test_quality_trim_index():
+    assert quality_trim_index('', 10, 10) == (0, 0)
+    assert quality_trim_index('##IIIIII#', 10, 10) == (2, 8)
+    assert quality_trim_index('####', 10, 10) == (0, 0)
+
+def test_nend_trim_index():
+    assert nend_trim_index('') == (0, 0)
+    assert nend_trim_index('ACGT') == (0, 4)
+    assert nend_trim_index('NNACNGTN') == (2, 7)
+    assert nend_trim_index('NNNN') == (4, 0)
+
+def test_mean_quality():
+    assert mean_quality('+5?I') == 25.0
+    assert mean_quality('BCD', base=64) == 3.0
+
+def test_zero_cap_qualities():
+    quals = 'II+I'
+    assert zero_cap_qualities(quals) is quals
+    assert zero_cap_qualities('I!5I', base=53) == 'I55I'
@@ -37,6 +37,14 @@ class TestSequence:
         with raises(FormatError):
             ColorspaceSequence(name="name", sequence="K0123", qualities="####")
 
+    def test_packed(self):
+        read = Sequence(name="name", sequence="ACGTN")
+        packed = read.packed
+        assert packed.unpack() == "ACGTN"
+        assert read.packed is packed
+        read.sequence = "ACG"
+        assert read.packed.unpack() == "ACG"
+
 
 class TestFastaReader:
     def test(self):
@@ -1,5 +1,6 @@
 # coding: utf-8
 from atropos.adapters import Adapter, ColorspaceAdapter, PREFIX, BACK
+from atropos.commands.trim.filters import NoFilter
 from atropos.commands.trim.modifiers import AdapterCutter
 from atropos.io.seqio import ColorspaceSequence, Sequence
 
@@ -23,3 +24,138 @@ def test_statistics():
         for d in (adapter.lengths_front, adapter.lengths_back):
             trimmed_bp += sum(seqlen * count for (seqlen, count) in d.items())
     assert trimmed_bp <= len(read), trimmed_bp
+
+
+def test_modify_duplicates():
+    from atropos.commands.trim import RecordHandler
+    from atropos.commands.trim.modifiers import (
+        SingleEndModifiers, UnconditionalCutter)
+    adapter = Adapter('CCCC', BACK, 0.1)
+    modifiers = SingleEndModifiers()
+    modifiers.add_modifier(UnconditionalCutter, lengths=[2])
+    modifiers.add_modifier(AdapterCutter, adapters=[adapter])
+    assert modifiers.collapsible
+    handler = RecordHandler(modifiers, None, None)
+    reads = [
+        Sequence('r1', 'GGAAAACCCCAAAA', 'ABCDEFGHIJKLMN'),
+        Sequence('r2', 'TTTT', '1234'),
+        Sequence('r3', 'GGAAAACCCCAAAA', 'abcdefghijklmn')]
+    duplicates = {'GGAAAACCCCAAAA': [2, None], 'TTTT': [1, None]}
+    trimmed = [
+        handler.modify_duplicate(duplicates, read)[0] for read in reads]
+    assert [(r.name, r.sequence, r.qualities) for r in trimmed] == [
+        ('r1', 'AAAA', 'CDEF'), ('r2', 'TT', '34'), ('r3', 'AAAA', 'cdef')]
+    assert trimmed[0].match is not None
+    assert trimmed[1].match is None
+    # statistics are the same as if each read was modified separately
+    cutter, adapter_cutter = (mods[0] for mods in modifiers.modifiers)
+    assert cutter.trimmed_bases == 6
+    assert adapter_cutter.with_adapters == 2
+    assert adapter.lengths_back[8] == 2
+
+
+def test_compile_record_handler():
+    from collections import defaultdict
+    from atropos.commands.trim import RecordHandler
+    from atropos.commands.trim.codegen import compile_record_handler
+    from atropos.commands.trim.filters import (
+        FilterFactory, Filters, TooShortReadFilter)
+    from atropos.commands.trim.modifiers import (
+        SingleEndModifiers, UnconditionalCutter)
+    from atropos.commands.trim.writers import Formatters
+    
+    def create_handler():
+        modifiers = SingleEndModifiers()
+        modifiers.add_modifier(UnconditionalCutter, lengths=[2])
+        modifiers.add_modifier(AdapterCutter, adapters=[
+            Adapter('CCCC', BACK, 0.1)])
+        filters = Filters(FilterFactory(False, 1))
+        filters.add_filter(TooShortReadFilter, 4)
+        formatters = Formatters('out.fastq', dict(qualities=True))
+        formatters.add_seq_formatter(TooShortReadFilter, 'short.fastq')
+        formatters.add_seq_formatter(NoFilter, 'out.fastq')
+        return RecordHandler(modifiers, filters, formatters)
+    
+    reads = [
+        Sequence('r1', 'GGAAAACCCCAAAA', 'ABCDEFGHIJKLMN'),
+        Sequence('r2', 'TTTT', '1234'),
+        Sequence('r3', 'GGAAACCCC', 'abcdefghi')]
+    expected_handler = create_handler()
+    expected = defaultdict(list)
+    expected_bp = [0, 0]
+    for read in reads:
+        expected_bp[0] += len(read)
+        expected_handler.handle_record(dict(results=expected), read)
+    
+    handler = create_handler()
+    handle_records = compile_record_handler(handler, False)
+    results = defaultdict(list)
+    bp = [0, 0]
+    handle_records(dict(results=results, bp=bp, index=0), reads)
+    assert results == expected
+    assert results['short.fastq'] == [
+        '@r2\nTT\n+\n34\n', '@r3\nAAA\n+\ncde\n']
+    assert bp == expected_bp
+    summary = handler.summarize()['trim']
+    expected_summary = expected_handler.summarize()['trim']
+    for key in ('filters', 'formatters'):
+        assert summary[key] == expected_summary[key]
+    
+    # Handlers with early filters are not compiled
+    assert compile_record_handler(
+        RecordHandler(handler.modifiers, handler.filters, handler.formatters,
+                      early_filters=object()), False) is None
+
+
+def test_records_loop():
+    from pytest import raises
+    from atropos import AtroposError
+    from atropos.commands.base import (
+        Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin)
+    
+    class SingleEnd(SingleEndPipelineMixin, Pipeline):
+        def handle_reads(self, context, read1, read2=None):
+            if read1.name == 'bad':
+                raise ValueError()
+            self.handled.append((read1.name, read2))
+    
+    class PairedEnd(PairedEndPipelineMixin, Pipeline):
+        def handle_reads(self, context, read1, read2=None):
+            self.handled.append((read1.name, read2.name))
+    
+    reads = [Sequence('r1', 'ACGT'), Sequence('r2', 'AC')]
+    pairs = list(zip(reads, [Sequence('p1', 'A'), Sequence('p2', 'CGT')]))
+    for records_loop in (True, False):
+        for pipeline_class, records, expected_bp, expected_handled in (
+                (SingleEnd, reads, [6, 0], [('r1', None), ('r2', None)]),
+                (PairedEnd, pairs, [6, 4], [('r1', 'p1'), ('r2', 'p2')])):
+            pipeline = pipeline_class()
+            if not records_loop:
+                pipeline.records_loop = None
+            pipeline.handled = []
+            context = dict(bp=[0, 0], index=3)
+            pipeline.handle_records(context, records)
+            assert context['bp'] == expected_bp
+            assert pipeline.handled == expected_handled
+        
+        pipeline = SingleEnd()
+        if not records_loop:
+            pipeline.records_loop = None
+        pipeline.handled = []
+        context = dict(bp=[0, 0], index=3)
+        with raises(AtroposError) as err:
+            pipeline.handle_records(
+                context, reads + [Sequence('bad', 'ACG'), reads[0]])
+        assert str(err.value) == "An error occurred at record 2 of batch 3"
+        assert isinstance(err.value.__cause__, ValueError)
+        assert context['bp'] == [9, 0]
+    
+    # The compiled loop is not used by a pipeline that overrides handle_record
+    class Overriding(SingleEnd):
+        def handle_record(self, context, record):
+            self.handled.append(('record', record.name))
+    
+    pipeline = Overriding()
+    pipeline.handled = []
+    pipeline.handle_records(dict(bp=[0, 0], index=3), reads)
+    assert pipeline.handled == [('record', 'r1'), ('record', 'r2')]
@@ -0,0 +1,156 @@
+# coding: utf-8
+import copy
+import pickle
+from pytest import raises
+from atropos.commands.stats import BaseCountingDicts, BaseNestedDicts
+from atropos.util import (
+    complement, reverse_complement, reverse_complements, sequence_complexity,
+    sequence_complexities, count_n, qual2prob, quals2probs, sum_qual_probs,
+    count_quals, CountingArray, CountingDict, CountingMatrix, Histogram,
+    NestedDict, PackedCounts, merge_dicts, pack_summary)
+
+def test_reverse_complement():
+    assert complement('ACGTNacgtnRY') == 'TGCANtgcanYR'
+    assert reverse_complement('') == ''
+    assert reverse_complement('AACGTNacgtnRY') == 'RYnacgtNACGTT'
+    assert reverse_complements(['AC', 'GGT']) == ['GT', 'ACC']
+    with raises(KeyError):
+        reverse_complement('ACGX')
+    with raises(KeyError):
+        reverse_complement('ACGU')
+
+def test_sequence_complexity():
+    assert sequence_complexity('') == 0
+    assert sequence_complexity('AAAA') == 0
+    assert sequence_complexity('ACGTacgt') == 2.0
+    assert sequence_complexity('AAccNNNN') == 1.0
+    assert sequence_complexities(['AAAA', 'ACGT']) == [0, 2.0]
+
+def test_count_n():
+    assert count_n('') == 0
+    assert count_n('ACNGTnN') == 3
+
+def test_qual2prob():
+    assert qual2prob('!') == 1.0
+    assert qual2prob('+') == 0.1
+    assert qual2prob('5') == 0.01
+    assert quals2probs('!+5') == [1.0, 0.1, 0.01]
+    assert sum_qual_probs('') == 0
+    assert sum_qual_probs('!+5') == sum(quals2probs('!+5'))
+
+def test_count_quals():
+    counts = [0] * 256
+    count_quals('', counts)
+    assert counts == [0] * 256
+    count_quals('!++5', counts)
+    count_quals('+', counts)
+    assert counts[ord('!')] == 1
+    assert counts[ord('+')] == 3
+    assert counts[ord('5')] == 1
+    assert sum(counts) == 5
+
+def test_counting_array():
+    counts = [(3, 1), (0, 2), (3, 4), (10, 1)]
+    array1 = CountingArray(5)
+    dict1 = CountingDict()
+    for key, inc in counts:
+        array1.increment(key, inc)
+        dict1[key] += inc
+    assert array1[3] == 5
+    assert array1[100] == 0
+    assert array1.summarize() == dict1.summarize()
+    array2 = CountingArray()
+    array2.increment(12, 2)
+    array2.increment(3)
+    dict1[12] += 2
+    dict1[3] += 1
+    assert array2.merge(array1).summarize() == dict1.summarize()
+    assert sum(array2.values()) == 11
+
+def test_counting_matrix():
+    counts = [(3, 1, 1), (0, 0, 2), (3, 1, 4), (10, 2, 1)]
+    matrix1 = CountingMatrix(5, 2)
+    nested1 = NestedDict()
+    for row, col, inc in counts:
+        matrix1.increment(row, col, inc)
+        nested1[row][col] += inc
+    assert matrix1[3, 1] == 5
+    assert matrix1[3, 5] == 0
+    summary = matrix1.summarize()
+    assert summary == nested1.summarize()
+    assert summary['columns'] == (0, 1, 2)
+    matrix2 = CountingMatrix()
+    matrix2.increment(12, 4)
+    matrix2.increment(3, 0)
+    nested1[12][4] += 1
+    nested1[3][0] += 1
+    assert matrix1.merge(matrix2).summarize() == nested1.summarize()
+
+def test_packed_counts():
+    hist1 = Histogram()
+    for key, inc in ((30, 2), (10, 1), (20, 4)):
+        hist1.increment(key, inc)
+    hist2 = Histogram()
+    for key, inc in ((40, 1), (20, 1)):
+        hist2.increment(key, inc)
+    packed = hist1.pack()
+    assert packed.keys == ((10, 20, 30),)
+    assert list(packed.counts) == [1, 4, 2]
+    assert packed.counts.typecode == 'b'
+    # Packed counters are merged with packed or unpacked counters that have
+    # different keys
+    packed = pickle.loads(pickle.dumps(packed)).merge(hist2)
+    assert packed.keys == ((10, 20, 30, 40),)
+    assert isinstance(packed.unpack(), Histogram)
+    assert packed.summarize() == copy.deepcopy(hist1).merge(hist2).summarize()
+    assert hist1.pack().merge(hist1.pack()).summarize()['hist'] == {
+        10: 2, 20: 8, 30: 4}
+    
+    counts = CountingDict()
+    counts.increment('A', 0.5)
+    assert counts.pack().counts.typecode == 'd'
+    assert counts.pack().unpack() == {'A': 0.5}
+    
+    nested1 = NestedDict()
+    nested1['a'][3] += 200
+    nested1['b'][1] += 1
+    nested2 = NestedDict()
+    nested2['c'][1] += 70000
+    packed = nested1.pack()
+    assert packed.keys == (('a', 'b'), (1, 3))
+    assert list(packed.items()) == [(('a', 3), 200), (('b', 1), 1)]
+    assert packed.counts.typecode == 'h'
+    packed.merge(nested2.pack())
+    assert packed.counts.typecode == 'i'
+    assert packed.summarize() == nested1.merge(nested2).summarize()
+    
+    with raises(ValueError):
+        packed.merge({})
+
+def test_pack_summary():
+    def summary(reads):
+        bases = BaseCountingDicts()
+        quals = BaseNestedDicts(is_qualities=True)
+        for read in reads:
+            for idx, base in enumerate(read):
+                bases[idx][base] += 1
+                quals[idx]['tile{}'.format(len(read))]['I'] += 1
+        return dict(
+            count=len(reads),
+            stats=[dict(bases=bases, quals=quals, name='test')])
+    
+    reads1 = ['ACGT', 'AC', 'GGGGG']
+    reads2 = ['TTNTTT', 'CA']
+    expected = summary(reads1)
+    merge_dicts(expected, summary(reads2))
+    packed = pack_summary(summary(reads1))
+    assert isinstance(packed['stats'][0]['bases'], PackedCounts)
+    assert isinstance(packed['stats'][0]['quals'], PackedCounts)
+    assert packed['stats'][0]['bases'].keys == (
+        (0, 1, 2, 3, 4), ('A', 'C', 'G', 'T'))
+    merge_dicts(packed, pack_summary(summary(reads2)))
+    assert packed['count'] == 5
+    for key in ('bases', 'quals'):
+        assert (
+            packed['stats'][0][key].summarize() ==
+            expected['stats'][0][key].summarize())